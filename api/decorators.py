@@ -152,7 +152,12 @@ def decompress(func):
 def pickle(func):
     @wraps(func)
     def pickled(*args, **kwargs):
-        return dumps(func(*args, **kwargs))
+        result = func(*args, **kwargs)
+
+        if isinstance(result, current_app.response_class):
+            return result
+
+        return dumps(result)
     return pickled
 
 def unpickle(func):
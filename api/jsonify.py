@@ -10,6 +10,7 @@ except ImportError:
 from google.appengine.ext import db
 from datetime import datetime
 import re
+import types
 
 SIMPLE_TYPES = (int, long, float, bool, basestring)
 
@@ -31,11 +32,50 @@ def dumps(obj, camel_cased=False):
         for key in obj:
             value = dumps(obj[key], camel_cased)
             if camel_cased:
-                properties[camel_casify(key)] = value
+                properties[camel_casify_cached(key)] = value
             else:
                 properties[key] = value
         return properties
 
+    plan = plan_for(obj)
+    if plan is None:
+        return dumps_by_dir(obj, camel_cased)
+
+    properties = dict()
+    if plan.is_model:
+        properties['kind'] = obj.kind()
+
+    names = plan.names
+    if plan.include_instance_attributes:
+        extra_names = [name for name in getattr(obj, "__dict__", ())
+                       if name not in plan.name_set and
+                           is_visible_property(name, plan.serialize_blacklist)]
+        if extra_names:
+            # Same order as dir(obj), in case camel casing makes two
+            # names collide
+            names = sorted(names + extra_names)
+
+    for property in names:
+        try:
+            value = obj.__getattribute__(property)
+            if is_visible_class(value.__class__):
+                value = dumps(value, camel_cased)
+                if camel_cased:
+                    properties[plan.camel_names.get(property) or
+                               camel_casify(property)] = value
+                else:
+                    properties[property] = value
+        except:
+            continue
+
+    if len(properties) == 0:
+        return str(obj)
+    else:
+        return properties
+
+
+def dumps_by_dir(obj, camel_cased=False):
+    """ dumps for an object that can't use a cached SerializationPlan """
     properties = dict()
     if isinstance(obj, db.Model):
         properties['kind'] = obj.kind()
@@ -67,6 +107,70 @@ def dumps(obj, camel_cased=False):
     else:
         return properties
 
+
+class SerializationPlan(object):
+    """ What dumps needs to know about a class to serialize its instances:
+    the names of its visible attributes and their camel cased versions.
+    Instance attributes can't be known ahead of time, so unless the class
+    has a _serialize_whitelist they are still looked for on each object.
+    """
+
+    def __init__(self, cls):
+        self.is_model = issubclass(cls, db.Model)
+
+        self.serialize_blacklist = getattr(cls, "_serialize_blacklist", [])
+
+        if hasattr(cls, "_serialize_whitelist"):
+            serialize_list = cls._serialize_whitelist
+            self.include_instance_attributes = False
+        else:
+            serialize_list = dir(cls)
+            self.include_instance_attributes = True
+
+        self.names = [name for name in serialize_list
+                      if is_visible_property(name, self.serialize_blacklist)]
+        self.name_set = set(self.names)
+        self.camel_names = dict((name, camel_casify(name))
+                                for name in self.names)
+
+
+# class -> SerializationPlan
+_plans = {}
+
+
+def plan_for(obj):
+    """ The SerializationPlan for obj's class, or None if obj has its own
+    _serialize_whitelist or _serialize_blacklist and has to be looked over
+    with dir()
+    """
+    cls = getattr(obj, "__class__", None)
+
+    # Classes and old-style instances don't have the same dir() as their
+    # class, so they're left to dumps_by_dir
+    if not isinstance(cls, type) or isinstance(obj, (type, types.ClassType)):
+        return None
+
+    instance_dict = getattr(obj, "__dict__", None)
+    if instance_dict and ("_serialize_whitelist" in instance_dict or
+                          "_serialize_blacklist" in instance_dict):
+        return None
+
+    plan = _plans.get(cls)
+    if plan is None:
+        plan = _plans[cls] = SerializationPlan(cls)
+    return plan
+
+
+# class -> whether attributes of that class are serialized
+_visible_classes = {}
+
+
+def is_visible_class(cls):
+    visible = _visible_classes.get(cls)
+    if visible is None:
+        visible = _visible_classes[cls] = is_visible_class_name(str(cls))
+    return visible
+
 UNDERSCORE_RE = re.compile("_([a-z])")
 
 
@@ -79,6 +183,21 @@ def camel_casify(str):
     return re.sub(UNDERSCORE_RE, camel_case_replacer, str)
 
 
+# Dict keys seen by camel_casify_cached. Keys can be data, like exercise
+# names, so only so many are remembered.
+_camel_cased_keys = {}
+MAX_CAMEL_CASED_KEYS = 10000
+
+
+def camel_casify_cached(key):
+    camel_cased = _camel_cased_keys.get(key)
+    if camel_cased is None:
+        camel_cased = camel_casify(key)
+        if len(_camel_cased_keys) < MAX_CAMEL_CASED_KEYS:
+            _camel_cased_keys[key] = camel_cased
+    return camel_cased
+
+
 def is_visible_property(property, serialize_blacklist):
     return (property[0] != '_' and
             not property.startswith("INDEX_") and
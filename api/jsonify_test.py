@@ -1,7 +1,64 @@
 """ Unit tests for jsonify functionality """
 
+import datetime
+import logging
+import time
 import unittest
+
+from google.appengine.ext import db
+from mock import patch
+
+import jsonify
 from jsonify import camel_casify, JSONModelEncoder, JSONModelEncoderCamelCased
+from testutil import testsize
+
+
+class FakeEntity(db.Model):
+    user_name = db.StringProperty()
+    problem_count = db.IntegerProperty()
+    last_done = db.DateTimeProperty()
+    tags = db.StringListProperty()
+    secret = db.StringProperty()
+
+    _serialize_blacklist = ["secret"]
+
+    @property
+    def display_name(self):
+        return self.user_name.title()
+
+    @property
+    def broken(self):
+        raise Exception("Properties that raise are left out")
+
+    def method(self):
+        return "Methods are left out"
+
+
+class FakeWhitelisted(object):
+    _serialize_whitelist = ["one_two", "entity", "missing"]
+
+    def __init__(self, entity):
+        self.one_two = 12
+        self.three = 3
+        self.entity = entity
+
+
+class FakeObject(object):
+    class_attribute = "class"
+
+    def __init__(self, i):
+        self.instance_attribute = i
+        if i % 2:
+            self.sometimes_here = [i]
+        self._private = i
+
+
+def make_entities(count):
+    when = datetime.datetime(2012, 3, 1)
+    return [FakeEntity(user_name="user %s" % i, problem_count=i,
+                       last_done=when + datetime.timedelta(minutes=i),
+                       tags=["tag_%s" % (i % 5)], secret="secret")
+            for i in range(count)]
 
 
 class JsonifyTest(unittest.TestCase):
@@ -38,5 +95,62 @@ class JsonifyTest(unittest.TestCase):
              ' "fivesix": "pickup sticks"}'),
             JSONModelEncoderCamelCased().encode(self.o))
 
+    def jsonify_by_dir(self, data, camel_cased=False):
+        """ jsonify without the serialization plans """
+        patcher = patch.object(jsonify, "plan_for")
+        plan_for = patcher.start()
+        try:
+            plan_for.return_value = None
+            return jsonify.jsonify(data, camel_cased=camel_cased)
+        finally:
+            patcher.stop()
+
+    def assert_same_as_dir(self, data):
+        for camel_cased in [False, True]:
+            self.assertEqual(
+                self.jsonify_by_dir(data, camel_cased=camel_cased),
+                jsonify.jsonify(data, camel_cased=camel_cased))
+
+    def test_plans_match_dir(self):
+        entities = make_entities(10)
+        self.assert_same_as_dir({
+            "entities": entities,
+            "whitelisted": [FakeWhitelisted(entity) for entity in entities],
+            "objects": [FakeObject(i) for i in range(4)],
+            "tuple": (1, 2),
+        })
+
+        data = jsonify.dumps(entities[0])
+        self.assertEqual("FakeEntity", data["kind"])
+        self.assertEqual("User 0", data["display_name"])
+        self.assertFalse("secret" in data)
+        self.assertFalse("broken" in data)
+        self.assertFalse("method" in data)
+
+        data = jsonify.dumps(FakeObject(1))
+        self.assertEqual(["class_attribute", "instance_attribute",
+                          "sometimes_here"], sorted(data.keys()))
+
+    @testsize.large()
+    def test_benchmark(self):
+        entities = make_entities(5000)
+
+        # Warm up the plans
+        jsonify.jsonify(entities[:1])
+
+        start = time.time()
+        with_plans = jsonify.jsonify(entities, camel_cased=True)
+        plan_time = time.time() - start
+
+        start = time.time()
+        by_dir = self.jsonify_by_dir(entities, camel_cased=True)
+        dir_time = time.time() - start
+
+        logging.info("jsonify of %d entities: %.0fms with plans, "
+                     "%.0fms with dir()" % (len(entities), plan_time * 1000,
+                                            dir_time * 1000))
+        self.assertEqual(by_dir, with_plans)
+        self.assertTrue(plan_time < dir_time)
+
 if __name__ == '__main__':
     unittest.main()
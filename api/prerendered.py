@@ -0,0 +1,210 @@
+"""Public topic library responses, rendered once per topic tree version.
+
+These endpoints only change when a new topic tree version is published, so
+each is rendered to JSON once per version and casing, persisted with
+layer_cache, and kept in instance memory along with its gzipped copy and an
+ETag of its content. Serving one is a dict lookup, with no memcache round
+trip, serialization or compression. Publishing renders the upcoming version
+ahead of time, see topic_models._preload_default_version_data.
+"""
+
+import cStringIO as StringIO
+import gzip
+import hashlib
+
+from flask import request, current_app
+
+import api.jsonify as apijsonify
+import layer_cache
+import setting_model
+import topic_models
+
+
+def topics_library_compact(version):
+    topics = topic_models.Topic.get_filled_content_topics(
+        types=["Video", "Url"], version=version)
+
+    def trimmed_item(item, topic):
+        trimmed_item_dict = {}
+        if item.kind() == "Video":
+            trimmed_item_dict['url'] = "/%s/v/%s" % (
+                topic.get_extended_slug(), item.readable_id)
+            trimmed_item_dict['key_id'] = item.key().id()
+        elif item.kind() == "Url":
+            trimmed_item_dict['url'] = item.url
+        trimmed_item_dict['title'] = item.title
+        return trimmed_item_dict
+
+    topic_dict = {}
+    for topic in topics:
+        # special cases
+        if topic.id == "new-and-noteworthy":
+            continue
+        if (topic.standalone_title == "California Standards Test: Geometry" and
+                topic.id != "geometry-2"):
+            continue
+
+        trimmed_info = {}
+        trimmed_info['id'] = topic.id
+        trimmed_info['children'] = [trimmed_item(v, topic)
+                                    for v in topic.children]
+        topic_dict[topic.id] = trimmed_info
+
+    return topic_dict
+
+
+def playlists_library(version):
+    tree = topic_models.Topic.get_by_id("root", version).make_tree()
+
+    def convert_tree(tree):
+        topics = []
+        for child in tree.children:
+
+            if hasattr(child, "id"):
+                # special cases
+                if child.id == "new-and-noteworthy":
+                    continue
+                elif (child.standalone_title ==
+                        "California Standards Test: Algebra I" and
+                        child.id != "algebra-i"):
+                    child.id = "algebra-i"
+                elif (child.standalone_title ==
+                        "California Standards Test: Geometry" and
+                        child.id != "geometry-2"):
+                    child.id = "geometry-2"
+
+            if child.kind() == "Topic":
+                topic = {}
+                topic["name"] = child.title
+                videos = []
+
+                for grandchild in child.children:
+                    if grandchild.kind() in ["Video", "Url"]:
+                        videos.append(grandchild)
+
+                if len(videos):
+                    child.videos = videos
+                    child.url = ""
+                    child.youtube_id = ""
+                    del child.children
+                    topic["playlist"] = child
+                else:
+                    topic["items"] = convert_tree(child)
+
+                topics.append(topic)
+        return topics
+
+    return convert_tree(tree)
+
+
+def playlists_library_list(version):
+    topics = topic_models.Topic.get_filled_content_topics(
+        types=["Video", "Url"], version=version)
+
+    topics_list = [t for t in topics if not (
+        (t.standalone_title == "California Standards Test: Algebra I" and
+         t.id != "algebra-i") or
+        (t.standalone_title == "California Standards Test: Geometry" and
+         t.id != "geometry-2"))]
+
+    for topic in topics_list:
+        topic.videos = topic.children
+        topic.title = topic.standalone_title
+        del topic.children
+
+    return topics_list
+
+
+# Name -> function returning the object to jsonify for a TopicVersion
+RENDERERS = {
+    "topics_library_compact": topics_library_compact,
+    "playlists_library": playlists_library,
+    "playlists_library_list": playlists_library_list,
+}
+
+# (name, camel_cased) -> (version number, PrerenderedResponse)
+_responses = {}
+
+
+class PrerenderedResponse(object):
+    def __init__(self, body):
+        self.body = body
+
+        buf = StringIO.StringIO()
+        gzip_file = gzip.GzipFile(fileobj=buf, mode="wb")
+        gzip_file.write(body)
+        gzip_file.close()
+        self.gzipped = buf.getvalue()
+
+        # Each content coding is a different representation, so they can't
+        # share a strong ETag
+        md5 = hashlib.md5(body).hexdigest()
+        self.etag = "\"%s\"" % md5
+        self.gzipped_etag = "\"%s-gz\"" % md5
+
+
+@layer_cache.cache_with_key_fxn(
+    lambda name, version_number, camel_cased: "prerendered_%s_v%s_%s" % (
+        name, version_number, "camel" if camel_cased else "underscore"),
+    layer=layer_cache.Layers.Memcache | layer_cache.Layers.Datastore)
+def render(name, version_number, camel_cased):
+    """Returns the UTF-8 JSON of the named response for a version."""
+    version = topic_models.TopicVersion.get_by_id(version_number)
+    body = apijsonify.jsonify(RENDERERS[name](version),
+                              camel_cased=camel_cased)
+    if isinstance(body, unicode):
+        body = body.encode("utf-8")
+    return body
+
+
+def get(name, version_number, camel_cased):
+    """Returns the PrerenderedResponse of the named response for a version,
+    from instance memory if this instance has already served it.
+    """
+    version_number = str(version_number)
+    cached = _responses.get((name, camel_cased))
+    if cached and cached[0] == version_number:
+        return cached[1]
+
+    prerendered = PrerenderedResponse(
+        render(name, version_number, camel_cased))
+    _responses[(name, camel_cased)] = (version_number, prerendered)
+    return prerendered
+
+
+def preload(version_number):
+    """Renders every response for a version that's being published."""
+    for name in RENDERERS:
+        for camel_cased in [False, True]:
+            render(name, str(version_number), camel_cased, bust_cache=True)
+
+
+def response(name):
+    """Serves the named response for the current topic tree version, gzipped
+    if the client accepts it and wrapped in the request's JSONP callback.
+    """
+    prerendered = get(name,
+                      setting_model.Setting.topic_tree_version() or "default",
+                      request.values.get("casing") == "camel")
+
+    headers = {"Vary": "Accept-Encoding"}
+    callback = request.values.get("callback")
+    if callback:
+        # Wrapped per request, so there's no ETag to revalidate against
+        body = "%s(%s)" % (callback.encode("utf-8"), prerendered.body)
+    else:
+        if "gzip" in request.headers.get("Accept-Encoding", ""):
+            body = prerendered.gzipped
+            headers["ETag"] = prerendered.gzipped_etag
+            headers["Content-Encoding"] = "gzip"
+        else:
+            body = prerendered.body
+            headers["ETag"] = prerendered.etag
+
+        if request.headers.get("If-None-Match") == headers["ETag"]:
+            return current_app.response_class(
+                status=304,
+                headers={"ETag": headers["ETag"], "Vary": "Accept-Encoding"})
+
+    return current_app.response_class(
+        body, headers=headers, mimetype="application/json; charset=utf-8")
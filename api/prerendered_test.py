@@ -0,0 +1,145 @@
+import cStringIO as StringIO
+import gzip
+import hashlib
+
+from mock import patch
+
+from api import api_app
+from api import prerendered
+from api import v1
+from testutil import GAEModelTestCase
+
+
+class PrerenderedTest(GAEModelTestCase):
+    def setUp(self):
+        super(PrerenderedTest, self).setUp()
+        prerendered._responses.clear()
+        self.rendered_versions = []
+
+    def tearDown(self):
+        prerendered._responses.clear()
+        super(PrerenderedTest, self).tearDown()
+
+    def fake_renderer(self, version):
+        self.rendered_versions.append(version)
+        return {"topic_count": len(self.rendered_versions)}
+
+    @patch("topic_models.TopicVersion.get_by_id")
+    def test_rendered_once_per_version(self, get_by_id):
+        get_by_id.side_effect = lambda version_number: version_number
+        patcher = patch.dict(prerendered.RENDERERS,
+                             {"fake": self.fake_renderer}, clear=True)
+        patcher.start()
+        try:
+            response = prerendered.get("fake", 3, False)
+            self.assertEqual(response, prerendered.get("fake", "3", False))
+            self.assertEqual(["3"], self.rendered_versions)
+
+            self.assertTrue('"topic_count": 1' in response.body)
+            self.assertEqual('"%s"' % hashlib.md5(response.body).hexdigest(),
+                             response.etag)
+            self.assertEqual(response.body, gzip.GzipFile(
+                fileobj=StringIO.StringIO(response.gzipped)).read())
+
+            # A new instance gets the persisted rendering
+            prerendered._responses.clear()
+            self.assertEqual(response.body,
+                             prerendered.get("fake", "3", False).body)
+            self.assertEqual(["3"], self.rendered_versions)
+
+            camel_cased = prerendered.get("fake", "3", True)
+            self.assertTrue('"topicCount": 2' in camel_cased.body)
+
+            # Publishing renders the new version ahead of time
+            prerendered.preload(4)
+            self.assertEqual(["3", "3", "4", "4"], self.rendered_versions)
+            self.assertTrue('"topic_count": 3' in
+                            prerendered.get("fake", "4", False).body)
+            self.assertEqual(4, len(self.rendered_versions))
+        finally:
+            patcher.stop()
+
+
+class PrerenderedResponseTest(GAEModelTestCase):
+    def setUp(self):
+        super(PrerenderedResponseTest, self).setUp()
+        self.prerendered = prerendered.PrerenderedResponse('{"a": 1}')
+        self.patcher = patch("api.prerendered.get")
+        self.patcher.start().return_value = self.prerendered
+
+    def tearDown(self):
+        self.patcher.stop()
+        super(PrerenderedResponseTest, self).tearDown()
+
+    def response(self, query_string="", **headers):
+        context = api_app.test_request_context(
+            "/api/v1/topics/library/compact", query_string=query_string,
+            headers=headers)
+        context.push()
+        try:
+            return prerendered.response("topics_library_compact")
+        finally:
+            context.pop()
+
+    def test_identity(self):
+        response = self.response()
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('{"a": 1}', response.data)
+        self.assertEqual(self.prerendered.etag, response.headers["ETag"])
+        self.assertEqual(None, response.headers.get("Content-Encoding"))
+        self.assertEqual("Accept-Encoding", response.headers["Vary"])
+
+    def test_gzip(self):
+        response = self.response(**{"Accept-Encoding": "gzip, deflate"})
+        self.assertEqual("gzip", response.headers["Content-Encoding"])
+        self.assertEqual('{"a": 1}', gzip.GzipFile(
+            fileobj=StringIO.StringIO(response.data)).read())
+
+        # A different representation than the identity one
+        self.assertEqual(self.prerendered.gzipped_etag,
+                         response.headers["ETag"])
+        self.assertNotEqual(self.prerendered.etag, response.headers["ETag"])
+
+    def test_not_modified(self):
+        response = self.response(**{"If-None-Match": self.prerendered.etag})
+        self.assertEqual(304, response.status_code)
+        self.assertEqual("", response.data)
+
+        response = self.response(**{
+            "If-None-Match": self.prerendered.gzipped_etag,
+            "Accept-Encoding": "gzip"})
+        self.assertEqual(304, response.status_code)
+
+        # An ETag for the other coding doesn't match
+        response = self.response(**{
+            "If-None-Match": self.prerendered.etag,
+            "Accept-Encoding": "gzip"})
+        self.assertEqual(200, response.status_code)
+
+    def test_jsonp(self):
+        response = self.response("callback=handle",
+                                 **{"Accept-Encoding": "gzip",
+                                    "If-None-Match": self.prerendered.etag})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('handle({"a": 1})', response.data)
+        self.assertEqual(None, response.headers.get("Content-Encoding"))
+        self.assertEqual(None, response.headers.get("ETag"))
+
+    @patch("topic_models.TopicVersion.get_default_version")
+    @patch("api.prerendered.playlists_library_list")
+    def test_fresh_route_skips_the_prerendered_response(
+            self, playlists_library_list, get_default_version):
+        playlists_library_list.return_value = [{"title": "Fresh"}]
+
+        context = api_app.test_request_context(
+            "/api/v1/playlists/library/list/fresh")
+        context.push()
+        try:
+            response = v1.playlists_library_list(fresh=True)
+        finally:
+            context.pop()
+
+        playlists_library_list.assert_called_once_with(
+            get_default_version.return_value)
+        self.assertEqual(0, prerendered.get.call_count)
+        self.assertTrue('"Fresh"' in response.data)
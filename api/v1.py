@@ -1,5 +1,6 @@
 import os
 import datetime
+import itertools
 import logging
 from itertools import izip
 
@@ -38,6 +39,7 @@ from common_core.models import CommonCoreMap
 from youtube_sync import youtube_get_video_data_dict, youtube_get_video_data
 from app import App
 
+from api import prerendered
 from api import route
 from api import v1_utils
 from api.decorators import jsonify, jsonp, pickle, compress, decompress, etag,\
@@ -157,39 +159,8 @@ def content_topics(version_id = None):
 @route("/api/v1/topics/library/compact", methods=["GET"])
 @api.auth.decorators.open_access
 @cacheable(caching_age=(60 * 60 * 24 * 60))
-@etag(lambda: setting_model.Setting.topic_tree_version())
-@jsonp
-@layer_cache.cache_with_key_fxn(
-    lambda: "api_topics_library_compact_%s" %
-            setting_model.Setting.topic_tree_version(),
-    layer=layer_cache.Layers.Memcache)
-@jsonify
 def topics_library_compact():
-    topics = topic_models.Topic.get_filled_content_topics(types = ["Video", "Url"])
-
-    def trimmed_item(item, topic):
-        trimmed_item_dict = {}
-        if item.kind() == "Video":
-            trimmed_item_dict['url'] = "/%s/v/%s" % (topic.get_extended_slug(), item.readable_id)
-            trimmed_item_dict['key_id'] = item.key().id()
-        elif item.kind() == "Url":
-            trimmed_item_dict['url'] = item.url
-        trimmed_item_dict['title'] = item.title
-        return trimmed_item_dict
-
-    topic_dict = {}
-    for topic in topics:
-        # special cases
-        if ((topic.id == "new-and-noteworthy") or
-            (topic.standalone_title == "California Standards Test: Geometry" and topic.id != "geometry-2")):
-            continue
-
-        trimmed_info = {}
-        trimmed_info['id'] = topic.id
-        trimmed_info['children'] = [trimmed_item(v, topic) for v in topic.children]
-        topic_dict[topic.id] = trimmed_info
-
-    return topic_dict
+    return prerendered.response("topics_library_compact")
 
 @route("/api/v1/topicversion/<version_id>/changelist", methods=["GET"])
 @api.auth.decorators.developer_required
@@ -788,50 +759,8 @@ def set_explore_url(video_id):
 
 @route("/api/v1/playlists/library", methods=["GET"])
 @api.auth.decorators.open_access
-@etag(lambda: setting_model.Setting.topic_tree_version())
-@jsonp
-@cache_with_key_fxn_and_param(
-    "casing",
-    lambda: "api_library_%s" % setting_model.Setting.topic_tree_version(),
-    layer=layer_cache.Layers.Memcache)
-@jsonify
 def playlists_library():
-    tree = topic_models.Topic.get_by_id("root").make_tree()
-    def convert_tree(tree):
-        topics = []
-        for child in tree.children:
-
-            if hasattr(child, "id"):
-                # special cases
-                if child.id == "new-and-noteworthy":
-                    continue
-                elif child.standalone_title == "California Standards Test: Algebra I" and child.id != "algebra-i":
-                    child.id = "algebra-i"
-                elif child.standalone_title == "California Standards Test: Geometry" and child.id != "geometry-2":
-                    child.id = "geometry-2"
-
-            if child.kind() == "Topic":
-                topic = {}
-                topic["name"] = child.title
-                videos = []
-
-                for grandchild in child.children:
-                    if grandchild.kind() == "Video" or grandchild.kind() == "Url":
-                        videos.append(grandchild)
-
-                if len(videos):
-                    child.videos = videos
-                    child.url = ""
-                    child.youtube_id = ""
-                    del child.children
-                    topic["playlist"] = child
-                else:
-                    topic["items"] = convert_tree(child)
-
-                topics.append(topic)
-        return topics
-
-    return convert_tree(tree)
+    return prerendered.response("playlists_library")
 
 # We expose the following "fresh" route but don't publish the URL for internal services
 # that don't want to deal w/ cached values ie. youtube-export script
@@ -840,27 +769,12 @@ def playlists_library():
 @route("/api/v1/playlists/library/list", methods=["GET"])
 @api.auth.decorators.open_access
 @jsonp
-@cache_with_key_fxn_and_param(
-    "casing",
-    lambda fresh=False: (
-        None if fresh else
-        "api_library_list_%s" % setting_model.Setting.topic_tree_version()),
-    layer=layer_cache.Layers.Memcache)
 @jsonify
 def playlists_library_list(fresh=False):
-    topics = topic_models.Topic.get_filled_content_topics(types = ["Video", "Url"])
-
-    topics_list = [t for t in topics if not (
-        (t.standalone_title == "California Standards Test: Algebra I" and t.id != "algebra-i") or
-        (t.standalone_title == "California Standards Test: Geometry" and t.id != "geometry-2"))
-        ]
-
-    for topic in topics_list:
-        topic.videos = topic.children
-        topic.title = topic.standalone_title
-        del topic.children
-
-    return topics_list
+    if fresh:
+        return prerendered.playlists_library_list(
+            topic_models.TopicVersion.get_default_version())
+    return prerendered.response("playlists_library_list")
 
 @route("/api/v1/exercises", methods=["GET"])
 @api.auth.decorators.open_access
@@ -1370,6 +1284,31 @@ def filter_query_by_request_dates(query, property):
         except ValueError:
             raise ValueError("Invalid date format sent to dt_end, use ISO 8601 Combined.")
 
+def stream_export_response(query, protobuf=False):
+    """Streams the query's results from the request's 'cursor', up to 'max'.
+
+    Protobuf exports are length-prefixed frames, other exports are a line of
+    JSON per entity. Both end with the cursor to continue from, see
+    v1_utils.stream_protobuf_export and v1_utils.stream_ndjson_export.
+    """
+    cursor = request.request_string("cursor")
+    if cursor:
+        query.with_cursor(cursor)
+
+    max_entities = request.request_int("max",
+                                       default=v1_utils.EXPORT_MAX_ENTITIES)
+
+    if protobuf:
+        return current_app.response_class(
+            v1_utils.stream_protobuf_export(query, max_entities),
+            mimetype="application/octet-stream")
+
+    # The export is written after the request is gone, so read casing now
+    camel_cased = request.values.get("casing") == "camel"
+    return current_app.response_class(
+        v1_utils.stream_ndjson_export(query, max_entities, camel_cased),
+        mimetype="application/x-ndjson")
+
 @route("/api/v1/user/videos", methods=["GET"])
 @api.auth.decorators.login_required
 @jsonp
@@ -2230,6 +2169,9 @@ def protobuf_entities(entity):
     Notes: 'entity' must be a subclass of 'backup_model.BackupModel'
            'dt{start,end}' must be in ISO 8601 format
            'max' defaults to 500
+           'stream=1' streams up to 'max' (default 10000) entities starting
+           at 'cursor' as length-prefixed protobufs, then an empty frame and
+           a frame with the cursor to continue from, empty once done
     Example:
         /api/v1/dev/protobuf/ProblemLog?dt_start=2012-02-11T20%3A07%3A49Z&dt_end=2012-02-11T21%3A07%3A49Z
         Returns up to 500 problem_logs from between 'dt_start' and 'dt_end'
@@ -2242,6 +2184,9 @@ def protobuf_entities(entity):
     filter_query_by_request_dates(query, "backup_timestamp")
     query.order("backup_timestamp")
 
+    if request.request_bool("stream", default=False):
+        return stream_export_response(query, protobuf=True)
+
     return map(lambda entity: db.model_to_protobuf(entity).Encode(),
                query.fetch(request.request_int("max", default=500)))
 
@@ -2253,6 +2198,10 @@ def problem_logs():
     problem_log_query = exercise_models.ProblemLog.all()
     filter_query_by_request_dates(problem_log_query, "time_done")
     problem_log_query.order("time_done")
+
+    if request.request_bool("stream", default=False):
+        return stream_export_response(problem_log_query)
+
     return problem_log_query.fetch(request.request_int("max", default=500))
 
 @route("/api/v1/dev/videos", methods=["GET"])
@@ -2263,6 +2212,10 @@ def video_logs():
     video_log_query = video_models.VideoLog.all()
     filter_query_by_request_dates(video_log_query, "time_watched")
     video_log_query.order("time_watched")
+
+    if request.request_bool("stream", default=False):
+        return stream_export_response(video_log_query)
+
     return video_log_query.fetch(request.request_int("max", default=500))
 
 @route("/api/v1/dev/users", methods=["GET"])
@@ -2273,6 +2226,10 @@ def user_data():
     user_data_query = user_models.UserData.all()
     filter_query_by_request_dates(user_data_query, "joined")
     user_data_query.order("joined")
+
+    if request.request_bool("stream", default=False):
+        return stream_export_response(user_data_query)
+
     return user_data_query.fetch(request.request_int("max", default=500))
 
 @route("/api/v1/user/students/progressreport", methods=["GET"])
@@ -2290,8 +2247,22 @@ def get_student_progress_report():
     except Exception, e:
         return api_invalid_param_response(e.message)
 
-    return class_progress_report_graph.class_progress_report_graph_context(
-        user_data_coach, students)
+    if request.values.get("format") != "matrix":
+        return class_progress_report_graph.class_progress_report_graph_context(
+            user_data_coach, students)
+
+    # The matrix form is streamed out after this returns, so anything that
+    # needs the request, like the exercise graph template, is looked up now
+    report = class_progress_report_graph.class_progress_report_graph_json(
+        user_data_coach, students,
+        template=exercise_models.ExerciseGraphTemplate.get())
+
+    callback = request.values.get("callback")
+    if callback:
+        report = itertools.chain(["%s(" % callback], report, [")"])
+
+    return current_app.response_class(report,
+        mimetype="application/json; charset=utf-8")
 
 @route("/api/v1/user/goals", methods=["GET"])
 @api.auth.decorators.login_required
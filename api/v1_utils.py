@@ -7,12 +7,18 @@ import cPickle as pickle
 import cStringIO as StringIO
 import datetime
 import logging
+import struct
 import traceback
 import zlib
+try:
+    import json                  # python 2.6 and later
+except ImportError:
+    import simplejson as json    # python 2.5 and earlier
 
 from google.appengine.ext import db
 from google.appengine.ext import deferred
 
+import api.jsonify as apijsonify
 import app
 import exercise_models
 import exercise_video_model
@@ -306,3 +312,75 @@ def topictree_import_task(version_id, topic_id, publish, tree_json_compressed):
         raise deferred.PermanentTaskFailure
 
     return True
+
+
+# Streamed exports fetch EXPORT_BATCH_SIZE entities at a time and write each
+# batch out before fetching the next, so memory doesn't grow with the number
+# of entities. Clients page through with the cursor written at the end.
+EXPORT_BATCH_SIZE = 200
+EXPORT_MAX_ENTITIES = 10000
+
+# Protobuf exports are frames of a 4 byte big-endian length and that many
+# bytes
+EXPORT_FRAME_LENGTH = struct.Struct(">I")
+
+def export_batches(query, max_entities):
+    """Yields (entities, cursor) for batches of up to max_entities of the
+    query's results. The cursor continues after the batch, and is None once
+    the query has no more results.
+    """
+    remaining = max_entities
+    while remaining > 0:
+        batch_size = min(EXPORT_BATCH_SIZE, remaining)
+        entities = query.fetch(batch_size)
+        remaining -= len(entities)
+
+        if len(entities) < batch_size:
+            yield entities, None
+            return
+
+        cursor = query.cursor()
+        yield entities, cursor
+        query.with_cursor(cursor)
+
+def export_frame(data):
+    return EXPORT_FRAME_LENGTH.pack(len(data)) + data
+
+def stream_protobuf_export(query, max_entities):
+    """Yields a frame with each entity's encoded protobuf, an empty frame,
+    then a frame with the cursor to continue from (empty when done).
+    """
+    cursor = None
+    for entities, cursor in export_batches(query, max_entities):
+        yield "".join([export_frame(db.model_to_protobuf(entity).Encode())
+                       for entity in entities])
+
+    yield export_frame("") + export_frame(cursor or "")
+
+def stream_ndjson_export(query, max_entities, camel_cased=False):
+    """Yields a line of JSON for each entity, then a {"cursor": cursor} line
+    with the cursor to continue from (null when done).
+    """
+    cursor = None
+    for entities, cursor in export_batches(query, max_entities):
+        yield "".join(["%s\n" % json.dumps(apijsonify.dumps(entity, camel_cased),
+                                            sort_keys=True)
+                       for entity in entities])
+
+    yield "%s\n" % json.dumps({"cursor": cursor})
+
+def read_protobuf_export(data):
+    """Returns ([encoded protobufs], cursor) from a protobuf export."""
+    protobufs = []
+    offset = 0
+    while True:
+        length = EXPORT_FRAME_LENGTH.unpack_from(data, offset)[0]
+        offset += EXPORT_FRAME_LENGTH.size
+        if not length:
+            break
+        protobufs.append(data[offset:offset + length])
+        offset += length
+
+    length = EXPORT_FRAME_LENGTH.unpack_from(data, offset)[0]
+    offset += EXPORT_FRAME_LENGTH.size
+    return protobufs, data[offset:offset + length] or None
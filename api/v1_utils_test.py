@@ -0,0 +1,57 @@
+import datetime
+try:
+    import json                  # python 2.6 and later
+except ImportError:
+    import simplejson as json    # python 2.5 and earlier
+
+from google.appengine.api import users
+from google.appengine.ext import db
+from mock import patch
+
+import exercise_models
+from api import v1_utils
+from testutil import GAEModelTestCase
+
+
+class StreamExportTest(GAEModelTestCase):
+    def setUp(self):
+        super(StreamExportTest, self).setUp()
+        start = datetime.datetime(2012, 3, 1)
+        db.put([exercise_models.ProblemLog(
+                    user=users.User("student@example.com"),
+                    exercise="addition_1", correct=True, time_taken=i,
+                    time_done=start + datetime.timedelta(minutes=i))
+                for i in range(25)])
+
+    def query(self, cursor=None):
+        query = exercise_models.ProblemLog.all().order("time_done")
+        if cursor:
+            query.with_cursor(cursor)
+        return query
+
+    @patch("api.v1_utils.EXPORT_BATCH_SIZE", 10)
+    def test_protobuf_export_resumes_from_cursor(self):
+        protobufs, cursor = v1_utils.read_protobuf_export("".join(
+            v1_utils.stream_protobuf_export(self.query(), 20)))
+        self.assertEqual(20, len(protobufs))
+        self.assertTrue(cursor)
+
+        rest, cursor = v1_utils.read_protobuf_export("".join(
+            v1_utils.stream_protobuf_export(self.query(cursor), 20)))
+        self.assertEqual(None, cursor)
+
+        time_taken = [db.model_from_protobuf(protobuf).time_taken
+                      for protobuf in protobufs + rest]
+        self.assertEqual(range(25), time_taken)
+
+    @patch("api.v1_utils.EXPORT_BATCH_SIZE", 10)
+    def test_ndjson_export(self):
+        chunks = list(v1_utils.stream_ndjson_export(self.query(), 100,
+                                                    camel_cased=True))
+
+        # A chunk per batch, then the cursor
+        self.assertEqual(4, len(chunks))
+
+        lines = [json.loads(line) for line in "".join(chunks).splitlines()]
+        self.assertEqual({"cursor": None}, lines.pop())
+        self.assertEqual(range(25), [line["timeTaken"] for line in lines])
@@ -1,7 +1,10 @@
 from __future__ import absolute_import
 import datetime
+import os
 import time
 
+import cache_stats
+import cachepy
 import request_handler
 import user_util
 from google.appengine.api import memcache
@@ -40,3 +43,63 @@ class MemcacheStatus(request_handler.RequestHandler):
                 'memcache_stats': memcache_stats,
             }
             self.render_jinja2_template("memcache_stats.html", template_values)
+
+
+class CachepyStatus(request_handler.RequestHandler):
+    """Handle requests to show the state of this instance's cachepy cache.
+
+    cachepy lives in each instance's memory, so this only describes the
+    instance that happened to serve the request. Hit it a few times to get
+    a feel for the fleet when sizing instances or cachepy.MAX_BYTES.
+    """
+
+    @user_util.developer_required
+    def get(self):
+        now = datetime.datetime.now()
+        now_time_t = int(time.mktime(now.timetuple()))
+        cachepy_stats = cachepy.stats()
+
+        if self.request.get('output') in ('text', 'txt'):
+            self.response.out.write(now_time_t)
+            self.response.out.write(' h:%(hits)s'
+                                    ' m:%(misses)s'
+                                    ' e:%(evictions)s'
+                                    ' x:%(expirations)s'
+                                    ' i:%(keys_count)s'
+                                    ' b:%(bytes)s'
+                                    ' mb:%(max_bytes)s'
+                                    '\n' % cachepy_stats)
+            self.response.headers['Content-Type'] = "text/text"
+        else:
+            template_values = {
+                'now': now.ctime(),
+                'now_time_t': now_time_t,
+                'instance_id': os.environ.get('INSTANCE_ID'),
+                'cachepy_stats': cachepy_stats,
+                'largest_keys': cachepy.largest_keys(),
+            }
+            self.render_jinja2_template("cachepy_stats.html", template_values)
+
+
+class CacheStatsReport(request_handler.RequestHandler):
+    """Handle requests to show layer_cache and request_cache counters summed
+    over all instances, so we can find the caches that cost the most RPCs.
+
+    Instances add their counters to memcache about once every
+    cache_stats.FLUSH_INTERVAL_SECONDS, so the totals lag a little behind.
+    POST to start counting from scratch.
+    """
+
+    @user_util.developer_required
+    def get(self):
+        template_values = {
+            'now': datetime.datetime.now().ctime(),
+            'counters': cache_stats.COUNTERS,
+            'rows': cache_stats.aggregated_stats(),
+        }
+        self.render_jinja2_template("cache_stats.html", template_values)
+
+    @user_util.developer_required
+    def post(self):
+        cache_stats.reset_aggregated_stats()
+        self.redirect("/stats/cachestats")
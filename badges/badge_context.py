@@ -11,3 +11,27 @@ class BadgeContextType:
     EXERCISE = 1
     TOPIC = 2
     FEEDBACK = 3
+
+
+class BadgeSignal:
+    """The kinds of user actions and state changes badges depend on.
+
+    Each badge lists its signals, and the checks run after an action only
+    look at badges listed under one of the signals the action sent.
+
+    Attributes:
+        PROBLEM: A problem was answered, changing the UserExercise and the
+            action cache's problem logs.
+        VIDEO: Part of a video was watched, changing the UserTopic, the
+            user's seconds watched and the action cache's video logs.
+        POINTS: The user's energy points went up.
+        PROFICIENCY: The user became proficient at an exercise.
+        TIME: Time went by, which only the periodic badge review checks.
+    """
+    PROBLEM = "problem"
+    VIDEO = "video"
+    POINTS = "points"
+    PROFICIENCY = "proficiency"
+    TIME = "time"
+
+    ALL = frozenset([PROBLEM, VIDEO, POINTS, PROFICIENCY, TIME])
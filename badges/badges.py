@@ -2,7 +2,7 @@ import util
 import models_badges
 import phantom_users.util_notify
 from notifications import UserNotifier
-from badge_context import BadgeContextType
+from badge_context import BadgeContextType, BadgeSignal
 
 
 class BadgeCategory(object):
@@ -173,6 +173,11 @@ class BadgeCategory(object):
 # arguments that have already been calculated / retrieved.
 class Badge(object):
 
+    # The BadgeSignals whose actions can make this badge satisfied. Badges
+    # are only checked after those actions, so subclasses should list all
+    # the state their is_satisfied_by reads. Defaults to checking always.
+    signals = BadgeSignal.ALL
+
     _serialize_whitelist = [
             "points", "badge_category", "description",
             "safe_extended_description", "name", "user_badges", "icon_src",
@@ -1,10 +1,12 @@
-from badges import Badge, BadgeCategory
+from badges import Badge, BadgeCategory, BadgeSignal
 
 
 # All badges awarded for consecutively performing activity on the site
 # inherit from ConsecutiveActivityBadge
 class ConsecutiveActivityBadge(Badge):
 
+    signals = frozenset([BadgeSignal.PROBLEM, BadgeSignal.VIDEO])
+
     def is_satisfied_by(self, *args, **kwargs):
         user_data = kwargs.get("user_data", None)
         if user_data is None:
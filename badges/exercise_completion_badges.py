@@ -5,11 +5,13 @@ except ImportError:
     import simplejson as json
 
 import exercise_models
-from badges import Badge, BadgeCategory, RetiredBadge
+from badges import Badge, BadgeCategory, BadgeSignal, RetiredBadge
 
 # All badges awarded for completing some subset of exercises inherit from ExerciseCompletionBadge
 class ExerciseCompletionBadge(Badge):
 
+    signals = frozenset([BadgeSignal.PROFICIENCY])
+
     def __init__(self):
         super(ExerciseCompletionBadge, self).__init__()
         self.is_goal = True
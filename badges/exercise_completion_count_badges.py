@@ -1,8 +1,10 @@
-from badges import Badge, BadgeCategory
+from badges import Badge, BadgeCategory, BadgeSignal
 
 # All badges awarded for completing some specific count of exercises inherit from ExerciseCompletionCountBadge
 class ExerciseCompletionCountBadge(Badge):
 
+    signals = frozenset([BadgeSignal.PROFICIENCY])
+
     def is_satisfied_by(self, *args, **kwargs):
         user_data = kwargs.get("user_data", None)
         if user_data is None:
@@ -1,6 +1,9 @@
+import calendar
+import datetime
+import struct
+
 from google.appengine.api import memcache
 from google.appengine.ext import db
-from google.appengine.datastore import entity_pb
 
 # LastActionCache stores a highly compressed cache of the most recent actions
 # each individual user has taken. The data is stored in memcache only at the moment
@@ -9,34 +12,252 @@ from google.appengine.datastore import entity_pb
 #
 # LastActionCache is used to quickly assess badge completion based on each users' recent actions.
 #
-# LastActionCache explicitly stores only the protobuf versions of each cached action for extremely
-# fast serialization and deserialization of the action cache to and from memcache on every action request.
-# We only take the time to turn each protobuf instance into a real DB model on demand (when needed for badge assessment).
+# Each type of action is kept in a ring of memcache segments of SEGMENT_SIZE
+# actions, and only the fields badges read are stored, packed with struct.
+# Pushing an action only rewrites the segment it goes in, plus a small
+# header with the number of actions pushed, instead of the whole cache.
+
+def _dt_to_timestamp(dt):
+    if dt is None:
+        return 0.0
+    return calendar.timegm(dt.timetuple()) + dt.microsecond / 1000000.0
+
+def _timestamp_to_dt(timestamp):
+    return datetime.datetime.utcfromtimestamp(timestamp)
+
+
+class CachedProblemLog(object):
+    """ The parts of a ProblemLog that badges read """
+
+    # time_done, time_taken, correct, length of exercise
+    FORMAT = struct.Struct("<diBH")
+
+    def __init__(self, exercise, correct, time_taken, time_done):
+        self.exercise = exercise
+        self.correct = correct
+        self.time_taken = time_taken
+        self.time_done = time_done
+
+    @staticmethod
+    def from_model(problem_log):
+        return CachedProblemLog(problem_log.exercise or "",
+                                problem_log.correct,
+                                problem_log.time_taken or 0,
+                                problem_log.time_done)
+
+    def pack(self):
+        exercise = self.exercise.encode("utf-8")
+        return CachedProblemLog.FORMAT.pack(_dt_to_timestamp(self.time_done),
+                                            self.time_taken,
+                                            int(bool(self.correct)),
+                                            len(exercise)) + exercise
+
+    @staticmethod
+    def unpack_from(data, offset):
+        """ Returns the CachedProblemLog at offset and the offset after it """
+        time_done, time_taken, correct, length = (
+            CachedProblemLog.FORMAT.unpack_from(data, offset))
+        offset += CachedProblemLog.FORMAT.size
+        exercise = data[offset:offset + length].decode("utf-8")
+        return (CachedProblemLog(exercise, bool(correct), time_taken,
+                                 _timestamp_to_dt(time_done)),
+                offset + length)
+
+
+class CachedVideoLog(object):
+    """ The parts of a VideoLog that badges and VideoLog.add_entry read """
+
+    # time_watched, seconds_watched, length of video key
+    FORMAT = struct.Struct("<diH")
+
+    def __init__(self, video_key, seconds_watched, time_watched):
+        self.video_key = video_key
+        self.seconds_watched = seconds_watched
+        self.time_watched = time_watched
+
+    @staticmethod
+    def from_model(video_log):
+        video_key = video_log.key_for_video()
+        return CachedVideoLog(video_key and str(video_key) or "",
+                              video_log.seconds_watched or 0,
+                              video_log.time_watched)
+
+    def key_for_video(self):
+        if not self.video_key:
+            return None
+        return db.Key(self.video_key)
+
+    def pack(self):
+        return CachedVideoLog.FORMAT.pack(_dt_to_timestamp(self.time_watched),
+                                          self.seconds_watched,
+                                          len(self.video_key)) + self.video_key
+
+    @staticmethod
+    def unpack_from(data, offset):
+        """ Returns the CachedVideoLog at offset and the offset after it """
+        time_watched, seconds_watched, length = (
+            CachedVideoLog.FORMAT.unpack_from(data, offset))
+        offset += CachedVideoLog.FORMAT.size
+        video_key = data[offset:offset + length]
+        return (CachedVideoLog(video_key, seconds_watched,
+                               _timestamp_to_dt(time_watched)),
+                offset + length)
+
+
+class ActionRing(object):
+    """ The most recent actions of one type, indexed from the oldest cached
+    one. Segment n holds actions n * SEGMENT_SIZE up to the next segment and
+    lives in memcache slot n % SEGMENTS, starting with its packed n so stale
+    slots can be told apart.
+    """
+
+    SEGMENT_HEADER = struct.Struct("<I")
+
+    def __init__(self, record_class, count=0, segments=None):
+        self.record_class = record_class
+        # Number of actions ever pushed
+        self.count = count
+        # Segment number -> packed segment
+        self.segments = segments or {}
+        self.records = {}
+
+    @staticmethod
+    def load(record_class, count, slots):
+        """ Builds the ring from a header count and {slot: packed segment},
+        keeping the unbroken run of segments that ends with the newest. """
+        if not count:
+            return ActionRing(record_class)
+
+        head = (count - 1) / LastActionCache.SEGMENT_SIZE
+        segments = {}
+        n = head
+        while n >= 0 and n > head - LastActionCache.SEGMENTS:
+            data = slots.get(n % LastActionCache.SEGMENTS)
+            if (data is None or
+                    ActionRing.SEGMENT_HEADER.unpack_from(data)[0] != n):
+                break
+            segments[n] = data
+            n -= 1
+
+        ring = ActionRing(record_class, count, segments)
+
+        # If the newest segment is gone or behind the count, nothing can be
+        # trusted to be in order
+        if (head not in segments or
+                len(ring.segment_records(head)) !=
+                    count - head * LastActionCache.SEGMENT_SIZE):
+            return ActionRing(record_class)
+
+        return ring
+
+    def first_index(self):
+        if not self.segments:
+            return self.count
+        return min(self.segments) * LastActionCache.SEGMENT_SIZE
+
+    def __len__(self):
+        return self.count - self.first_index()
+
+    def segment_records(self, n):
+        records = self.records.get(n)
+        if records is None:
+            data = self.segments[n]
+            records = []
+            offset = ActionRing.SEGMENT_HEADER.size
+            while offset < len(data):
+                record, offset = self.record_class.unpack_from(data, offset)
+                records.append(record)
+            self.records[n] = records
+        return records
+
+    def get(self, ix):
+        ix += self.first_index()
+        return self.segment_records(ix / LastActionCache.SEGMENT_SIZE)[
+            ix % LastActionCache.SEGMENT_SIZE]
+
+    def push(self, record):
+        """ Adds a record and returns (slot, packed segment) to store """
+        n = self.count / LastActionCache.SEGMENT_SIZE
+        data = self.segments.get(n)
+        if data is None:
+            data = ActionRing.SEGMENT_HEADER.pack(n)
+
+        self.segments[n] = data + record.pack()
+        self.records.pop(n, None)
+        self.count += 1
+
+        for old in [old for old in self.segments
+                    if old <= n - LastActionCache.SEGMENTS]:
+            del self.segments[old]
+            self.records.pop(old, None)
+
+        return n % LastActionCache.SEGMENTS, self.segments[n]
+
 
 class LastActionCache:
 
     CACHED_ACTIONS_PER_TYPE = 500
-    VERSION = 2
+    SEGMENT_SIZE = 50
+    # One more than needed, so there are always at least
+    # CACHED_ACTIONS_PER_TYPE actions even right after a segment is started
+    SEGMENTS = CACHED_ACTIONS_PER_TYPE / SEGMENT_SIZE + 1
+    VERSION = 3
 
     @staticmethod
     def key_for_email(email):
         return "last_action_cache_%s_%s" % (LastActionCache.VERSION, email)
 
+    @staticmethod
+    def segment_key(key, kind, slot):
+        return "%s_%s_%s" % (key, kind, slot)
+
+    @staticmethod
+    def memcache_keys(user_data):
+        """ The header and every slot of both rings, read in one round trip """
+        key = LastActionCache.key_for_email(user_data.key_email)
+        return [key] + [LastActionCache.segment_key(key, kind, slot)
+                        for kind in ["problem", "video"]
+                        for slot in xrange(LastActionCache.SEGMENTS)]
+
     @staticmethod
     def get_for_user_data(user_data):
-        action_cache = memcache.get(LastActionCache.key_for_email(user_data.key_email))
-        if action_cache is None:
-            action_cache = LastActionCache(user_data)
+        return LastActionCache.from_cached(user_data, memcache.get_multi(
+            LastActionCache.memcache_keys(user_data)))
+
+    @staticmethod
+    def from_cached(user_data, cached):
+        """ Builds the cache from a get_multi including memcache_keys() """
+        action_cache = LastActionCache(user_data)
+        key = action_cache.key
+
+        counts = cached.get(key)
+        if counts is None:
+            return action_cache
+
+        slots = {"problem": {}, "video": {}}
+        for kind in ["problem", "video"]:
+            for slot in xrange(LastActionCache.SEGMENTS):
+                slot_key = LastActionCache.segment_key(key, kind, slot)
+                if slot_key in cached:
+                    slots[kind][slot] = cached[slot_key]
+
+        problem_count, video_count = counts
+        action_cache.problem_logs = ActionRing.load(
+            CachedProblemLog, problem_count, slots["problem"])
+        action_cache.video_logs = ActionRing.load(
+            CachedVideoLog, video_count, slots["video"])
         return action_cache
 
     def __init__(self, user_data):
-        self.problem_logs = [] # Protobuf version of problem logs for extremely fast (de)serialization
-        self.problem_log_models = {} # Deserialized problem log models
-
-        self.video_logs = [] # Protobuf version of video logs for extremely fast (de)serialization
-        self.video_log_models = {} # Deserialized video log models
+        # len() of these is the number of cached actions
+        self.problem_logs = ActionRing(CachedProblemLog)
+        self.video_logs = ActionRing(CachedVideoLog)
 
         self.key_email = user_data.key_email
+        self.key = LastActionCache.key_for_email(self.key_email)
+
+        # Segments pushed to but not yet written to memcache
+        self.unstored = {}
 
     # Push a new problem log to the cache and return the LastActionCache
     @staticmethod
@@ -45,19 +266,20 @@ class LastActionCache:
         action_cache.push_problem_log(problem_log)
         return action_cache
 
-    # Push a new problem log using protobuf for fast serialization/pickle
-    def push_problem_log(self, problem_log):
-        self.problem_logs.append(db.model_to_protobuf(problem_log).Encode())
-        if len(self.problem_logs) > LastActionCache.CACHED_ACTIONS_PER_TYPE:
-            self.problem_logs = self.problem_logs[-1 * LastActionCache.CACHED_ACTIONS_PER_TYPE:]
-
-        self.store()
+    # With store=False the write is left for the caller to batch, see
+    # take_unstored
+    def push_problem_log(self, problem_log, store=True):
+        slot, data = self.problem_logs.push(
+            CachedProblemLog.from_model(problem_log))
+        self.unstored[LastActionCache.segment_key(self.key, "problem", slot)] = (
+            data)
+        if store:
+            self.store()
 
-    # Get a new problem log from the cache via protobuf deserialization
+    # Get a cached problem log, 0 being the oldest. It only has the exercise,
+    # correct, time_taken and time_done of the ProblemLog.
     def get_problem_log(self, ix):
-        if not self.problem_log_models.has_key(ix):
-            self.problem_log_models[ix] = db.model_from_protobuf(entity_pb.EntityProto(self.problem_logs[ix]))
-        return self.problem_log_models[ix]
+        return self.problem_logs.get(ix)
 
     # Push a new video log to the cache and return the LastActionCache
     @staticmethod
@@ -66,19 +288,17 @@ class LastActionCache:
         action_cache.push_video_log(video_log)
         return action_cache
 
-    # Push a new video log to the cache using protobuf for fast serialization/pickle
-    def push_video_log(self, video_log):
-        self.video_logs.append(db.model_to_protobuf(video_log).Encode())
-        if len(self.video_logs) > LastActionCache.CACHED_ACTIONS_PER_TYPE:
-            self.video_logs = self.video_logs[-1 * LastActionCache.CACHED_ACTIONS_PER_TYPE:]
+    def push_video_log(self, video_log, store=True):
+        slot, data = self.video_logs.push(CachedVideoLog.from_model(video_log))
+        self.unstored[LastActionCache.segment_key(self.key, "video", slot)] = (
+            data)
+        if store:
+            self.store()
 
-        self.store()
-
-    # Get a new video log from the cache via protobuf deserialization
+    # Get a cached video log, 0 being the oldest. It only has the
+    # seconds_watched, time_watched and key_for_video() of the VideoLog.
     def get_video_log(self, ix):
-        if not self.video_log_models.has_key(ix):
-            self.video_log_models[ix] = db.model_from_protobuf(entity_pb.EntityProto(self.video_logs[ix]))
-        return self.video_log_models[ix]
+        return self.video_logs.get(ix)
 
     def get_last_video_log(self):
         c = len(self.video_logs)
@@ -86,10 +306,16 @@ class LastActionCache:
             return None
         return self.get_video_log(c - 1)
 
-    def store(self):
-        # Wipe out deserialized models before serialization for speed
-        self.problem_log_models = {}
-        self.video_log_models = {}
+    def take_unstored(self):
+        """ Returns the memcache writes for the segments pushed to since the
+        last store, including the header, and forgets them. """
+        if not self.unstored:
+            return {}
 
-        memcache.set(LastActionCache.key_for_email(self.key_email), self)
+        unstored = self.unstored
+        unstored[self.key] = (self.problem_logs.count, self.video_logs.count)
+        self.unstored = {}
+        return unstored
 
+    def store(self):
+        memcache.set_multi(self.take_unstored())
@@ -0,0 +1,109 @@
+import datetime
+import logging
+
+from google.appengine.api import memcache
+from google.appengine.api import users
+from google.appengine.ext import db
+from mock import patch
+
+import exercise_models
+import video_models
+from badges.last_action_cache import LastActionCache
+from testutil import GAEModelTestCase
+
+REAL_SET_MULTI = memcache.set_multi
+
+
+class FakeUserData(object):
+    def __init__(self, email):
+        self.key_email = email
+
+
+class LastActionCacheTest(GAEModelTestCase):
+    def setUp(self):
+        super(LastActionCacheTest, self).setUp()
+        self.user_data = FakeUserData("student@example.com")
+        self.start = datetime.datetime(2012, 3, 1, 9, 0, 0, 500000)
+
+    def problem_log(self, i):
+        return exercise_models.ProblemLog(
+            user=users.User(self.user_data.key_email),
+            exercise="addition_%s" % (i % 3), correct=(i % 2 == 0),
+            time_taken=i, time_done=self.start + datetime.timedelta(minutes=i))
+
+    def push_problem_logs(self, count):
+        action_cache = LastActionCache.get_for_user_data(self.user_data)
+        for i in range(count):
+            action_cache.push_problem_log(self.problem_log(i))
+
+    def test_round_trip(self):
+        self.push_problem_logs(3)
+        video_key = db.Key.from_path("Video", 42)
+        LastActionCache.get_cache_and_push_video_log(
+            self.user_data,
+            video_models.VideoLog(video=video_key, seconds_watched=30,
+                                  time_watched=self.start))
+
+        action_cache = LastActionCache.get_for_user_data(self.user_data)
+        self.assertEqual(3, len(action_cache.problem_logs))
+        problem_log = action_cache.get_problem_log(2)
+        self.assertEqual("addition_2", problem_log.exercise)
+        self.assertTrue(problem_log.correct)
+        self.assertEqual(2, problem_log.time_taken)
+        self.assertEqual(self.start + datetime.timedelta(minutes=2),
+                         problem_log.time_done)
+        self.assertFalse(action_cache.get_problem_log(1).correct)
+
+        video_log = action_cache.get_last_video_log()
+        self.assertEqual(video_key, video_log.key_for_video())
+        self.assertEqual(30, video_log.seconds_watched)
+        self.assertEqual(self.start, video_log.time_watched)
+
+    def test_only_recent_actions_are_kept(self):
+        self.push_problem_logs(1234)
+
+        action_cache = LastActionCache.get_for_user_data(self.user_data)
+        count = len(action_cache.problem_logs)
+        self.assertTrue(LastActionCache.CACHED_ACTIONS_PER_TYPE <= count <
+                        LastActionCache.CACHED_ACTIONS_PER_TYPE +
+                        LastActionCache.SEGMENT_SIZE)
+        self.assertEqual(
+            1233, action_cache.get_problem_log(count - 1).time_taken)
+        self.assertEqual(
+            1234 - count, action_cache.get_problem_log(0).time_taken)
+
+    def test_evicted_segments(self):
+        self.push_problem_logs(120)
+        key = LastActionCache.key_for_email(self.user_data.key_email)
+
+        # Losing an older segment cuts the cache off there
+        memcache.delete(LastActionCache.segment_key(key, "problem", 0))
+        action_cache = LastActionCache.get_for_user_data(self.user_data)
+        self.assertEqual(70, len(action_cache.problem_logs))
+        self.assertEqual(50, action_cache.get_problem_log(0).time_taken)
+
+        # Losing the newest one starts it over
+        memcache.delete(LastActionCache.segment_key(key, "problem", 2))
+        action_cache = LastActionCache.get_for_user_data(self.user_data)
+        self.assertEqual(0, len(action_cache.problem_logs))
+
+        action_cache.push_problem_log(self.problem_log(7))
+        action_cache = LastActionCache.get_for_user_data(self.user_data)
+        self.assertEqual(1, len(action_cache.problem_logs))
+        self.assertEqual(7, action_cache.get_problem_log(0).time_taken)
+
+    @patch("google.appengine.api.memcache.set_multi")
+    def test_pushes_only_write_one_segment(self, mock_set_multi):
+        mock_set_multi.side_effect = REAL_SET_MULTI
+        self.push_problem_logs(LastActionCache.CACHED_ACTIONS_PER_TYPE)
+
+        written = [sum(len(str(value)) for value in call[0][0].values())
+                   for call in mock_set_multi.call_args_list]
+        whole_cache = sum(
+            len(db.model_to_protobuf(self.problem_log(i)).Encode())
+            for i in range(LastActionCache.CACHED_ACTIONS_PER_TYPE))
+
+        logging.info("A full cache's push writes at most %d bytes, "
+                     "%d bytes as protobufs in one object" %
+                     (max(written), whole_cache))
+        self.assertTrue(max(written) * 10 < whole_cache)
@@ -1,11 +1,13 @@
 import util
-from badges import Badge, BadgeCategory
+from badges import Badge, BadgeCategory, BadgeSignal
 
 
 # All badges awarded for getting a certain number of points inherit
 # from PointBadge
 class PointBadge(Badge):
 
+    signals = frozenset([BadgeSignal.POINTS])
+
     def is_satisfied_by(self, *args, **kwargs):
         user_data = kwargs.get("user_data", None)
         if user_data is None:
@@ -1,6 +1,6 @@
 import datetime
 
-from badges import Badge, BadgeCategory
+from badges import Badge, BadgeCategory, BadgeSignal
 from templatefilters import seconds_to_time_string
 
 
@@ -9,6 +9,8 @@ from templatefilters import seconds_to_time_string
 # inherit from PowerTimeBadge
 class PowerTimeBadge(Badge):
 
+    signals = frozenset([BadgeSignal.PROBLEM, BadgeSignal.VIDEO])
+
     def is_satisfied_by(self, *args, **kwargs):
         action_cache = kwargs.get("action_cache", None)
 
@@ -1,4 +1,4 @@
-from badges import BadgeCategory
+from badges import BadgeCategory, BadgeSignal
 from exercise_badges import ExerciseBadge
 
 
@@ -6,6 +6,8 @@ from exercise_badges import ExerciseBadge
 # having some trouble inherit from RecoveryProblemBadge
 class RecoveryProblemBadge(ExerciseBadge):
 
+    signals = frozenset([BadgeSignal.PROBLEM])
+
     def is_satisfied_by(self, *args, **kwargs):
         user_exercise = kwargs.get("user_exercise", None)
         action_cache = kwargs.get("action_cache", None)
@@ -1,4 +1,4 @@
-from badges import BadgeCategory
+from badges import BadgeCategory, BadgeSignal
 from exercise_badges import ExerciseBadge
 
 
@@ -6,6 +6,8 @@ from exercise_badges import ExerciseBadge
 # from StreakBadge
 class StreakBadge(ExerciseBadge):
 
+    signals = frozenset([BadgeSignal.PROBLEM])
+
     def is_satisfied_by(self, *args, **kwargs):
         user_exercise = kwargs.get("user_exercise", None)
         if user_exercise is None:
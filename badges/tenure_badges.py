@@ -1,5 +1,5 @@
 import util
-from badges import Badge, BadgeCategory
+from badges import Badge, BadgeCategory, BadgeSignal
 from templatefilters import seconds_to_time_string
 
 
@@ -7,6 +7,8 @@ from templatefilters import seconds_to_time_string
 # for various periods of time from TenureBadge
 class TenureBadge(Badge):
 
+    signals = frozenset([BadgeSignal.TIME])
+
     def is_satisfied_by(self, *args, **kwargs):
         user_data = kwargs.get("user_data", None)
         if user_data is None:
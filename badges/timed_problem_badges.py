@@ -1,10 +1,12 @@
-from badges import BadgeCategory
+from badges import BadgeCategory, BadgeSignal
 from exercise_badges import ExerciseBadge
 
 # All badges awarded for completing a certain number of correct problems
 # within a specific amount of time inherit from TimedProblemBadge
 class TimedProblemBadge(ExerciseBadge):
 
+    signals = frozenset([BadgeSignal.PROBLEM])
+
     def is_satisfied_by(self, *args, **kwargs):
         user_exercise = kwargs.get("user_exercise", None)
         action_cache = kwargs.get("action_cache", None)
@@ -2,7 +2,7 @@ from google.appengine.ext import db
 
 import object_property
 import topic_models
-from badges import Badge, BadgeCategory
+from badges import Badge, BadgeCategory, BadgeSignal
 from templatefilters import slugify
 
 
@@ -68,6 +68,8 @@ class TopicExerciseBadge(Badge):
     TopicExerciseBadgeType datastore entities.
     """
 
+    signals = frozenset([BadgeSignal.PROFICIENCY])
+
     @staticmethod
     def all():
         badges = [TopicExerciseBadge(t) for t in TopicExerciseBadgeType.all()]
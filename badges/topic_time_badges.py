@@ -1,4 +1,4 @@
-from badges import BadgeCategory
+from badges import BadgeCategory, BadgeSignal
 from topic_badges import TopicBadge
 from templatefilters import seconds_to_time_string
 
@@ -7,6 +7,8 @@ from templatefilters import seconds_to_time_string
 # inherit from TopicTimeBadge
 class TopicTimeBadge(TopicBadge):
 
+    signals = frozenset([BadgeSignal.VIDEO])
+
     def __init__(self):
         TopicBadge.__init__(self)
 
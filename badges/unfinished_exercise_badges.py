@@ -1,10 +1,12 @@
-from badges import BadgeCategory
+from badges import BadgeCategory, BadgeSignal
 from exercise_badges import ExerciseBadge
 
 # All badges awarded for just barely missing proficiency even though most
 # questions are being answered correctly inherit from this class
 class UnfinishedExerciseBadge(ExerciseBadge):
 
+    signals = frozenset([BadgeSignal.PROBLEM])
+
     def is_satisfied_by(self, *args, **kwargs):
         user_data = kwargs.get("user_data", None)
         user_exercise = kwargs.get("user_exercise", None)
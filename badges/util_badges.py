@@ -156,6 +156,37 @@ def all_badges_dict():
 def badges_with_context_type(badge_context_type):
     return filter(lambda badge: badge.badge_context_type == badge_context_type, all_badges())
 
+@layer_cache.cache_with_key_fxn(
+        lambda: "badge_signal_index:%s" % setting_model.Setting.topic_tree_version(),
+        layer=layer_cache.Layers.InAppMemory)
+def badge_signal_index():
+    """ Returns (badges, {(badge context type, signal): [index in badges]})
+    for the badges that can be awarded automatically. """
+    checked_badges = filter(
+            lambda badge: not badge.is_manually_awarded() and not badge.is_retired,
+            all_badges())
+
+    index = {}
+    for i, badge in enumerate(checked_badges):
+        for signal in badge.signals:
+            index.setdefault((badge.badge_context_type, signal), []).append(i)
+
+    return checked_badges, index
+
+def badges_to_check(badge_context_type, signals=None):
+    """ The badges of a context type that depend on any of the signals, in
+    all_badges order. With no signals every badge of the type is checked. """
+    checked_badges, index = badge_signal_index()
+
+    if signals is None:
+        signals = badges.BadgeSignal.ALL
+
+    indices = set()
+    for signal in signals:
+        indices.update(index.get((badge_context_type, signal), []))
+
+    return [checked_badges[i] for i in sorted(indices)]
+
 def get_badge_counts(user_data):
 
     count_dict = badges.BadgeCategory.empty_count_dict()
@@ -382,15 +413,14 @@ def badge_update_map(user_data):
     user_data.last_badge_review = datetime.datetime.now()
     user_data.put()
 
-# Award this user any earned no-context badges.
-def update_with_no_context(user_data, action_cache = None):
-    possible_badges = badges_with_context_type(badges.BadgeContextType.NONE)
+# Award this user any earned no-context badges. signals are the BadgeSignals
+# sent by whatever the user just did, only badges depending on them are checked.
+def update_with_no_context(user_data, action_cache = None, signals = None):
+    possible_badges = badges_to_check(badges.BadgeContextType.NONE, signals)
     action_cache = action_cache or last_action_cache.LastActionCache.get_for_user_data(user_data)
 
     awarded = False
     for badge in possible_badges:
-        if badge.is_manually_awarded():
-            continue
         if not badge.is_already_owned_by(user_data=user_data):
             if badge.is_satisfied_by(user_data=user_data, action_cache=action_cache):
                 badge.award_to(user_data=user_data)
@@ -399,14 +429,12 @@ def update_with_no_context(user_data, action_cache = None):
     return awarded
 
 # Award this user any earned Exercise-context badges for the provided UserExercise.
-def update_with_user_exercise(user_data, user_exercise, include_other_badges = False, action_cache = None):
-    possible_badges = badges_with_context_type(badges.BadgeContextType.EXERCISE)
+def update_with_user_exercise(user_data, user_exercise, include_other_badges = False, action_cache = None, signals = None):
+    possible_badges = badges_to_check(badges.BadgeContextType.EXERCISE, signals)
     action_cache = action_cache or last_action_cache.LastActionCache.get_for_user_data(user_data)
 
     awarded = False
     for badge in possible_badges:
-        if badge.is_manually_awarded():
-            continue
         # Pass in pre-retrieved user_exercise data so each badge check doesn't have to talk to the datastore
         if not badge.is_already_owned_by(user_data=user_data, user_exercise=user_exercise):
             if badge.is_satisfied_by(user_data=user_data, user_exercise=user_exercise, action_cache=action_cache):
@@ -414,19 +442,17 @@ def update_with_user_exercise(user_data, user_exercise, include_other_badges = F
                 awarded = True
 
     if include_other_badges:
-        awarded = update_with_no_context(user_data, action_cache=action_cache) or awarded
+        awarded = update_with_no_context(user_data, action_cache=action_cache, signals=signals) or awarded
 
     return awarded
 
 # Award this user any earned Topic-context badges for the provided UserTopic.
-def update_with_user_topic(user_data, user_topic, include_other_badges = False, action_cache = None):
-    possible_badges = badges_with_context_type(badges.BadgeContextType.TOPIC)
+def update_with_user_topic(user_data, user_topic, include_other_badges = False, action_cache = None, signals = None):
+    possible_badges = badges_to_check(badges.BadgeContextType.TOPIC, signals)
     action_cache = action_cache or last_action_cache.LastActionCache.get_for_user_data(user_data)
 
     awarded = False
     for badge in possible_badges:
-        if badge.is_manually_awarded():
-            continue
         # Pass in pre-retrieved user_topic data so each badge check doesn't have to talk to the datastore
         if not badge.is_already_owned_by(user_data=user_data, user_topic=user_topic):
             if badge.is_satisfied_by(user_data=user_data, user_topic=user_topic, action_cache=action_cache):
@@ -434,7 +460,7 @@ def update_with_user_topic(user_data, user_topic, include_other_badges = False,
                 awarded = True
 
     if include_other_badges:
-        awarded = update_with_no_context(user_data, action_cache=action_cache) or awarded
+        awarded = update_with_no_context(user_data, action_cache=action_cache, signals=signals) or awarded
 
     return awarded
 
@@ -0,0 +1,123 @@
+import logging
+import time
+
+from mock import patch
+
+import exercise_models
+import user_models
+from badges import util_badges
+from badges.badges import BadgeContextType, BadgeSignal
+from badges.last_action_cache import LastActionCache
+from badges.points_badges import TenThousandaireBadge
+from badges.streak_badges import NiceStreakBadge
+from badges.tenure_badges import YearOneBadge
+from badges.topic_exercise_badges import TopicExerciseBadgeType
+from testutil import GAEModelTestCase
+from testutil import testsize
+
+
+class BadgeSignalTest(GAEModelTestCase):
+    def setUp(self):
+        super(BadgeSignalTest, self).setUp()
+
+        # A topic challenge patch for every 10 exercises, like the real tree
+        for i in range(50):
+            TopicExerciseBadgeType(
+                key_name="topic:topic_%s" % i,
+                topic_key_name="topic_%s" % i,
+                topic_standalone_title="Topic %s" % i,
+                exercise_names_required=["exercise_%s_%s" % (i, j)
+                                         for j in range(10)]).put()
+
+        self.user_data = user_models.UserData.insert_for("student",
+                                                         "student@example.com")
+        self.user_exercise = exercise_models.UserExercise(
+            user=self.user_data.user, exercise="addition_1", total_done=5,
+            streak=3, longest_streak=3)
+        self.action_cache = LastActionCache.get_for_user_data(self.user_data)
+
+    def names(self, badges):
+        return set(badge.name for badge in badges)
+
+    def test_no_signals_checks_every_automatic_badge(self):
+        for context_type in [BadgeContextType.NONE,
+                             BadgeContextType.EXERCISE,
+                             BadgeContextType.TOPIC]:
+            expected = [badge.name for badge
+                        in util_badges.badges_with_context_type(context_type)
+                        if not badge.is_manually_awarded() and
+                            not badge.is_retired]
+            self.assertEqual(expected, [badge.name for badge in
+                                        util_badges.badges_to_check(
+                                            context_type)])
+
+    def test_only_badges_with_the_signals_are_checked(self):
+        exercise_badges = self.names(util_badges.badges_to_check(
+            BadgeContextType.EXERCISE, [BadgeSignal.PROBLEM]))
+        self.assertTrue(NiceStreakBadge().name in exercise_badges)
+
+        no_context_badges = self.names(util_badges.badges_to_check(
+            BadgeContextType.NONE, [BadgeSignal.PROBLEM]))
+        self.assertFalse(TenThousandaireBadge().name in no_context_badges)
+        self.assertFalse(YearOneBadge().name in no_context_badges)
+        self.assertFalse("topic_exercise_topic_0" in no_context_badges)
+
+        no_context_badges = self.names(util_badges.badges_to_check(
+            BadgeContextType.NONE,
+            [BadgeSignal.POINTS, BadgeSignal.PROFICIENCY]))
+        self.assertTrue(TenThousandaireBadge().name in no_context_badges)
+        self.assertTrue("topic_exercise_topic_0" in no_context_badges)
+
+    @patch("badges.badges.Badge.award_to")
+    def test_badges_are_awarded_for_their_signals(self, award_to):
+        self.user_data.points = 20000
+
+        util_badges.update_with_no_context(self.user_data,
+                                           action_cache=self.action_cache,
+                                           signals=[BadgeSignal.PROBLEM])
+        self.assertEqual(0, award_to.call_count)
+
+        util_badges.update_with_no_context(self.user_data,
+                                           action_cache=self.action_cache,
+                                           signals=[BadgeSignal.POINTS])
+        self.assertEqual(1, award_to.call_count)
+
+    @testsize.large()
+    @patch("badges.badges.Badge.award_to")
+    def test_benchmark(self, award_to):
+        attempts = 200
+        problem_signals = [BadgeSignal.PROBLEM]
+
+        def check_all(signals):
+            start = time.time()
+            for i in range(attempts):
+                util_badges.update_with_user_exercise(
+                    self.user_data, self.user_exercise,
+                    include_other_badges=True,
+                    action_cache=self.action_cache,
+                    signals=signals)
+            return (time.time() - start) / attempts
+
+        # Warm up the badge caches
+        check_all(None)
+
+        all_badges_time = check_all(None)
+        signal_time = check_all(problem_signals)
+
+        checked = (
+            len(util_badges.badges_to_check(BadgeContextType.EXERCISE,
+                                            problem_signals)) +
+            len(util_badges.badges_to_check(BadgeContextType.NONE,
+                                            problem_signals)))
+        logging.info("Per attempt: %.2fms checking %d of %d badges, "
+                     "%.2fms checking the %d depending on problems" % (
+                         all_badges_time * 1000,
+                         len(util_badges.badges_to_check(
+                             BadgeContextType.EXERCISE)) +
+                         len(util_badges.badges_to_check(
+                             BadgeContextType.NONE)),
+                         len(util_badges.all_badges()),
+                         signal_time * 1000, checked))
+
+        self.assertEqual(0, award_to.call_count)
+        self.assertTrue(signal_time < all_badges_time)
@@ -1,4 +1,4 @@
-from badges import Badge, BadgeCategory
+from badges import Badge, BadgeCategory, BadgeSignal
 from templatefilters import seconds_to_time_string
 
 
@@ -6,6 +6,8 @@ from templatefilters import seconds_to_time_string
 # videos, total
 class VideoTimeBadge(Badge):
 
+    signals = frozenset([BadgeSignal.VIDEO])
+
     def is_satisfied_by(self, *args, **kwargs):
         user_data = kwargs.get("user_data", None)
         if user_data is None:
@@ -74,12 +74,21 @@ You may also start the update by calling:
 
 bulk_update.handler.start_task('/admin/myupdate', {'kind': 'ModelClass'})
 
+To update a big kind faster, add shards=N (at most MAX_SHARDS), e.g.
+/admin/myupdate?kind=ModelClass&shards=16. The kind's key space is split
+into N key ranges that are updated by concurrent task chains, BATCH_SIZE
+keys at a time. When use_transaction() is False each batch is fetched and
+put with one db.get and one db.put. Each shard logs its progress and
+throughput, and visiting the update's url again shows them. Sharding walks
+every key of the kind, so it's only available to handlers that don't
+override get_keys_query.
  
 """
 
 import cgi
 import datetime
 import logging
+import time
 import user_util
 from google.appengine.ext import webapp
 from google.appengine.ext.webapp.util import run_wsgi_app
@@ -88,8 +97,16 @@ from google.appengine.ext import db
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
 from google.appengine.runtime import DeadlineExceededError
+from mapreduce.lib import key_range
 
 KEY_FORMAT = "bulk_update_%s"
+SHARDS_KEY_FORMAT = "bulk_update_shards_%s"
+SHARDS_LEFT_KEY_FORMAT = "bulk_update_shards_left_%s"
+SHARD_STATUS_KEY_FORMAT = "bulk_update_shard_%s_%s"
+
+MAX_SHARDS = 64
+BATCH_SIZE = 100
+TASK_SECONDS = 25
 
 def start_task(task_path, task_params):
     if _is_in_progress(task_path):
@@ -109,6 +126,35 @@ def _set_in_progress(task_path, val):
 def _is_in_progress(task_path):
     result = memcache.get(KEY_FORMAT % task_path)
     return result
+
+def _split_key_range(kind_class, shard_count):
+    """Returns up to shard_count KeyRanges covering every key of kind_class.
+
+    Ranges are split in half by key, not by how many entities they hold, so
+    shards can be uneven.
+    """
+    query = db.Query(kind_class, keys_only=True)
+    first_key = query.order("__key__").get()
+    if first_key is None:
+        return []
+    last_key = db.Query(kind_class, keys_only=True).order("-__key__").get()
+
+    ranges = [key_range.KeyRange(key_start=first_key, key_end=last_key,
+                                 include_start=True, include_end=True)]
+    while len(ranges) < shard_count:
+        ranges.extend(ranges.pop(0).split_range())
+    return ranges
+
+def _shard_statuses(task_path):
+    """Returns the last reported status of each shard of the update."""
+    shard_count = memcache.get(SHARDS_KEY_FORMAT % task_path)
+    if not shard_count:
+        return []
+    keys = [SHARD_STATUS_KEY_FORMAT % (task_path, shard)
+            for shard in range(shard_count)]
+    statuses = memcache.get_multi(keys)
+    return [statuses.get(key, 'Shard %d: not started' % shard)
+            for shard, key in enumerate(keys)]
     
 class UpdateKind(webapp.RequestHandler):
     @user_util.manual_access_checking  # superuser-only via app.yaml (/admin)
@@ -118,6 +164,8 @@ class UpdateKind(webapp.RequestHandler):
             self.response.out.write('Your request to interrupt has been filed.')
         elif _is_in_progress(self.request.path):
             self.response.out.write('Your request is already in progress.')
+            for status in _shard_statuses(self.request.path):
+                self.response.out.write('<br>%s' % cgi.escape(status))
         else:
             if start_task(self.request.path, self.request.params):
                 self.response.out.write('Your request has been added to task queue.  Monitor the log for status updates. ')
@@ -137,6 +185,12 @@ class UpdateKind(webapp.RequestHandler):
         if not _is_in_progress(self.request.path):
             logging.info('Cancelled.')
             return
+        if self.request.get('key_range'):
+            self.update_shard()
+            return
+        if self.request.get('shards'):
+            self.start_shards()
+            return
         cursor = self.request.get('cursor')
         count = self.request.get('count')
         if not count:
@@ -186,6 +240,118 @@ class UpdateKind(webapp.RequestHandler):
                 new_params['count']= count
                 taskqueue.add(url=self.request.path, params=new_params)
                 
+    def start_shards(self):
+        """Splits the kind's keys into ranges and starts a task chain for each"""
+        kind = self.request.get('kind')
+        if self.get_keys_query.im_func is not UpdateKind.get_keys_query.im_func:
+            logging.error('Cannot shard %s: get_keys_query is overridden', kind)
+            _set_in_progress(self.request.path, False)
+            return
+
+        shard_count = min(int(self.request.get('shards')), MAX_SHARDS)
+        ranges = _split_key_range(db.class_for_kind(kind), shard_count)
+        if not ranges:
+            logging.info('Finished! No %s to process.', kind)
+            _set_in_progress(self.request.path, False)
+            return
+
+        progress = {
+            SHARDS_KEY_FORMAT % self.request.path: len(ranges),
+            SHARDS_LEFT_KEY_FORMAT % self.request.path: len(ranges),
+        }
+        for shard in range(len(ranges)):
+            progress[SHARD_STATUS_KEY_FORMAT % (self.request.path, shard)] = (
+                'Shard %d: not started' % shard)
+        memcache.set_multi(progress)
+        for shard, shard_range in enumerate(ranges):
+            self.continue_shard(shard, shard_range, 0, 0, 0.0)
+        logging.info('Updating %s in %d shards.', kind, len(ranges))
+
+    def continue_shard(self, shard, shard_range, count, updated, seconds):
+        new_params = {}
+        for name, value in self.request.params.items():
+            new_params[name] = value
+        new_params['shard'] = shard
+        new_params['key_range'] = shard_range.to_json()
+        new_params['count'] = count
+        new_params['updated'] = updated
+        new_params['seconds'] = seconds
+        taskqueue.add(url=self.request.path, params=new_params)
+
+    def update_shard(self):
+        """Updates the shard's key range BATCH_SIZE keys at a time until it's
+        done or TASK_SECONDS have passed, then continues in a new task.
+        """
+        kind = self.request.get('kind')
+        kind_class = db.class_for_kind(kind)
+        shard = int(self.request.get('shard'))
+        shard_range = key_range.KeyRange.from_json(self.request.get('key_range'))
+        start_count = count = int(self.request.get('count'))
+        updated = int(self.request.get('updated'))
+        seconds = float(self.request.get('seconds'))
+
+        start = time.time()
+        done = False
+        try:
+            while time.time() < start + TASK_SECONDS:
+                keys = shard_range.make_ascending_query(
+                    kind_class, keys_only=True).fetch(BATCH_SIZE)
+                if not keys:
+                    done = True
+                    break
+
+                if self.use_transaction():
+                    for key in keys:
+                        if db.run_in_transaction(self.update_key, key):
+                            updated += 1
+                        shard_range.advance(key)
+                        count += 1
+                else:
+                    entities = [entity for entity in db.get(keys)
+                                if entity and self.update(entity)]
+                    db.put(entities)
+                    updated += len(entities)
+                    shard_range.advance(keys[-1])
+                    count += len(keys)
+        except DeadlineExceededError:
+            pass
+        except:
+            logging.exception('Unexpected exception')
+
+        seconds += time.time() - start
+        status = 'Shard %d: %d %s processed, %d updated, %.1f per second' % (
+            shard, count, kind, updated, count / max(seconds, 0.001))
+        if done:
+            status += ', finished.'
+        else:
+            status += ', next after %s' % shard_range.key_start
+        logging.info(status)
+        memcache.set(SHARD_STATUS_KEY_FORMAT % (self.request.path, shard),
+                     status)
+
+        if done:
+            self.finish_shard()
+        elif count == start_count:
+            logging.error('Shard %d stopped due to lack of progress at %s',
+                          shard, shard_range)
+            self.finish_shard()
+        else:
+            self.continue_shard(shard, shard_range, count, updated, seconds)
+
+    def finish_shard(self):
+        shards_left = memcache.decr(SHARDS_LEFT_KEY_FORMAT % self.request.path)
+        if shards_left == 0:
+            _set_in_progress(self.request.path, False)
+            logging.info('Finished! All shards of %s are done.',
+                         self.request.get('kind'))
+
+    def update_key(self, key):
+        entity = db.get(key)
+        if entity and self.update(entity):
+            entity.put()
+            return True
+        return False
+
     def get_keys_query(self, kind):
         """Returns a keys-only query to get the keys of the entities to update"""
         return db.GqlQuery('select __key__ from %s' % kind)
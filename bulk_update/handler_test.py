@@ -0,0 +1,171 @@
+import base64
+import cgi
+import os
+import re
+
+from google.appengine.ext import db
+from google.appengine.ext import testbed
+from google.appengine.ext import webapp
+from mock import patch
+
+from bulk_update import handler
+from testutil import GAEModelTestCase
+
+PATH = "/admin/bulk_update_test"
+
+
+class FakeEntity(db.Model):
+    value = db.IntegerProperty()
+
+
+class SplitKeyRangeTest(GAEModelTestCase):
+    def keys_in(self, ranges):
+        keys = []
+        for shard_range in ranges:
+            keys.extend(shard_range.make_ascending_query(
+                FakeEntity, keys_only=True).fetch(1000))
+        return keys
+
+    def test_shards_cover_every_key_once(self):
+        keys = db.put([FakeEntity(value=i) for i in range(200)])
+
+        ranges = handler._split_key_range(FakeEntity, 4)
+        self.assertEqual(4, len(ranges))
+        self.assertEqual(sorted(keys), sorted(self.keys_in(ranges)))
+
+    def test_fewer_entities_than_shards(self):
+        self.assertEqual([], handler._split_key_range(FakeEntity, 4))
+
+        key = FakeEntity(value=1).put()
+        ranges = handler._split_key_range(FakeEntity, 4)
+        self.assertEqual([key], self.keys_in(ranges))
+
+
+class DoubleEvens(handler.UpdateKind):
+    def update(self, entity):
+        if entity.value % 2:
+            return False
+        entity.value *= 2
+        return True
+
+
+class BatchedDoubleEvens(DoubleEvens):
+    def use_transaction(self):
+        return False
+
+
+class EvensOnly(DoubleEvens):
+    def get_keys_query(self, kind):
+        return db.GqlQuery("select __key__ from %s where value = 0" % kind)
+
+
+class FakeClock(object):
+    """ Each call to time() is 10 seconds after the last, so each task
+    gets through two batches before TASK_SECONDS run out. """
+    def __init__(self):
+        self.now = 0
+
+    def time(self):
+        self.now += 10
+        return self.now
+
+
+class ShardedUpdateTest(GAEModelTestCase):
+    def setUp(self):
+        super(ShardedUpdateTest, self).setUp()
+        self.testbed.init_taskqueue_stub(root_path=os.path.dirname(
+            os.path.dirname(os.path.abspath(__file__))))
+        self.taskqueue_stub = self.testbed.get_stub(
+            testbed.TASKQUEUE_SERVICE_NAME)
+
+        self.keys = db.put([FakeEntity(value=i) for i in range(200)])
+
+        self.patchers = [
+            patch("bulk_update.handler.BATCH_SIZE", 10),
+            patch("bulk_update.handler.time", FakeClock()),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        super(ShardedUpdateTest, self).tearDown()
+
+    def post(self, handler_class, params):
+        request = webapp.Request.blank(PATH, POST=params,
+            headers={"X-AppEngine-QueueName": "default"})
+        update = handler_class()
+        update.initialize(request, webapp.Response())
+        update.post()
+
+    def run_update(self, handler_class, shards):
+        """ Runs the update's tasks until there are none left and returns
+        how many there were. """
+        handler.start_task(PATH, {"kind": "FakeEntity", "shards": shards})
+
+        tasks_run = 0
+        while True:
+            tasks = self.taskqueue_stub.GetTasks("default")
+            if not tasks:
+                return tasks_run
+            self.taskqueue_stub.FlushQueue("default")
+            for task in tasks:
+                self.post(handler_class,
+                          dict(cgi.parse_qsl(base64.b64decode(task["body"]))))
+                tasks_run += 1
+
+    def assert_evens_doubled(self):
+        self.assertEqual([i * 2 if i % 2 == 0 else i for i in range(200)],
+                         [entity.value for entity in db.get(self.keys)])
+
+    def assert_finished(self, shards):
+        self.assertFalse(handler._is_in_progress(PATH))
+        statuses = handler._shard_statuses(PATH)
+        self.assertEqual(shards, len(statuses))
+        for status in statuses:
+            self.assertTrue(status.endswith("finished."), status)
+
+    @patch("bulk_update.handler.db.run_in_transaction")
+    def test_batched_shards(self, run_in_transaction):
+        tasks_run = self.run_update(BatchedDoubleEvens, 4)
+
+        self.assert_evens_doubled()
+        self.assertEqual(0, run_in_transaction.call_count)
+        # The first task and then more than one per shard, so shards
+        # picked up where the task before them left off
+        self.assertTrue(tasks_run > 1 + 4)
+        self.assert_finished(4)
+
+        # Each key was processed by exactly one shard
+        processed = [
+            int(re.search(r"(\d+) FakeEntity processed", status).group(1))
+            for status in handler._shard_statuses(PATH)]
+        self.assertEqual(200, sum(processed))
+
+    @patch("bulk_update.handler.db.run_in_transaction")
+    def test_transactional_shards(self, run_in_transaction):
+        run_in_transaction.side_effect = db.run_in_transaction
+        self.run_update(DoubleEvens, 4)
+
+        self.assert_evens_doubled()
+        self.assertEqual(200, run_in_transaction.call_count)
+        self.assert_finished(4)
+
+    def test_in_progress_until_the_last_shard_finishes(self):
+        handler._set_in_progress(PATH, True)
+        handler.memcache.set(handler.SHARDS_LEFT_KEY_FORMAT % PATH, 2)
+        update = DoubleEvens()
+        update.initialize(webapp.Request.blank(PATH), webapp.Response())
+
+        update.finish_shard()
+        self.assertTrue(handler._is_in_progress(PATH))
+        update.finish_shard()
+        self.assertFalse(handler._is_in_progress(PATH))
+
+    def test_overridden_keys_query_is_not_sharded(self):
+        self.assertEqual(1, self.run_update(EvensOnly, 4))
+
+        self.assertEqual(range(200),
+                         [entity.value for entity in db.get(self.keys)])
+        self.assertFalse(handler._is_in_progress(PATH))
@@ -0,0 +1,235 @@
+"""Hit/miss/latency counters for layer_cache and request_cache.
+
+Every cached function gets a bucket named after its target ("module.func"),
+and layer_cache reads made without one, like a permanent_key_fxn fallback,
+get one named after their key's prefix. Each bucket counts hits per layer,
+misses, the time spent recomputing misses, the serialized size of the
+recomputed values and how many reads came back chunked vs. unchunked.
+Sizes are measured for one miss in BYTES_SAMPLE_RATE, each counting for
+BYTES_SAMPLE_RATE misses.
+
+Counters are kept twice: once for the current request, which
+gae_mini_profiler shows next to the RPCs, and once for the lifetime of the
+instance. The instance counters are added to memcache every
+FLUSH_INTERVAL_SECONDS with a single offset_multi, and /stats/cachestats
+reports the totals from all instances. The memcache keys are prefixed with a
+generation number that resetting bumps, so a reset drops every instance's
+old totals at once.
+
+Recording is a couple of dict operations per cache access, and only the
+sampled misses pay for pickling the value to measure it, so this stays on in
+production.
+"""
+
+import logging
+import pickle
+import random
+import re
+import time
+
+""" Flag to turn all recording off """
+ENABLED = True
+
+HITS_REQUEST = "hits_request"
+HITS_INAPP = "hits_inapp"
+HITS_MEMCACHE = "hits_memcache"
+HITS_DATASTORE = "hits_datastore"
+MISSES = "misses"
+RECOMPUTE_MS = "recompute_ms"
+BYTES = "bytes"
+CHUNKED = "chunked"
+UNCHUNKED = "unchunked"
+
+COUNTERS = [HITS_REQUEST, HITS_INAPP, HITS_MEMCACHE, HITS_DATASTORE, MISSES,
+            RECOMPUTE_MS, BYTES, CHUNKED, UNCHUNKED]
+
+REQUEST_STATS = {}
+INSTANCE_STATS = {}
+
+FLUSH_INTERVAL_SECONDS = 60
+
+""" Pickling a value to measure it costs about as much as caching it, so only
+about one recomputed value in this many is measured """
+BYTES_SAMPLE_RATE = 20
+LAST_FLUSH = time.time()
+
+MEMCACHE_NAMES_KEY = "cache_stats_names"
+MEMCACHE_GENERATION_KEY = "cache_stats_generation"
+MEMCACHE_NAMESPACE = "cache_stats"
+
+""" Bucket names this instance has already added to MEMCACHE_NAMES_KEY in
+REGISTERED_GENERATION """
+REGISTERED_NAMES = {}
+REGISTERED_GENERATION = None
+
+# Anything after the first digit or separator is assumed to vary per call
+_KEY_PREFIX_RE = re.compile(r"[0-9:=|,/\s]")
+
+
+def key_prefix(key):
+    """ Bucket name for a raw cache key, e.g. "user_data_12_34" ->
+    "user_data"
+    """
+    prefix = _KEY_PREFIX_RE.split(str(key), 1)[0].rstrip("_.-")
+    return prefix or str(key)[:32]
+
+
+def target_name(target):
+    return "%s.%s" % (target.__module__, target.__name__)
+
+
+def incr(name, counter, delta=1):
+    if not ENABLED:
+        return
+
+    for stats in (REQUEST_STATS, INSTANCE_STATS):
+        counters = stats.get(name)
+        if counters is None:
+            counters = stats[name] = {}
+        counters[counter] = counters.get(counter, 0) + delta
+
+
+def record_hit(name, counter, chunked=None):
+    """ Records a hit in the layer identified by counter (HITS_*).
+
+    For layers that store ChunkedResults, chunked says whether the value
+    read was one.
+    """
+    incr(name, counter)
+    if chunked is not None:
+        incr(name, CHUNKED if chunked else UNCHUNKED)
+
+
+def record_miss(name, start_time, result=None, misses=1):
+    """ Records misses whose recomputation started at start_time.
+
+    Pass the recomputed result to also record its pickled size, which is
+    only measured for about one call in BYTES_SAMPLE_RATE.
+    """
+    if not ENABLED:
+        return
+
+    incr(name, MISSES, misses)
+    incr(name, RECOMPUTE_MS, int((time.time() - start_time) * 1000))
+
+    if result is not None and random.random() * BYTES_SAMPLE_RATE < 1:
+        try:
+            size = len(pickle.dumps(result, pickle.HIGHEST_PROTOCOL))
+        except Exception:
+            size = 0
+        incr(name, BYTES, size * BYTES_SAMPLE_RATE)
+
+
+def request_stats():
+    """ Returns this request's counters as a list of dicts, costliest first """
+    return _sorted_rows(REQUEST_STATS)
+
+
+def reset_request_stats():
+    """ Called at the start of every request. Also periodically adds this
+    instance's counters to the memcache totals.
+    """
+    global REQUEST_STATS
+    REQUEST_STATS = {}
+
+    if time.time() - LAST_FLUSH > FLUSH_INTERVAL_SECONDS:
+        flush_to_memcache()
+
+
+def flush_to_memcache():
+    """ Adds the instance counters to the memcache totals and resets them """
+    global INSTANCE_STATS, LAST_FLUSH, REGISTERED_GENERATION
+
+    from google.appengine.api import memcache
+
+    LAST_FLUSH = time.time()
+    stats = INSTANCE_STATS
+    INSTANCE_STATS = {}
+
+    if not stats:
+        return
+
+    deltas = {}
+    for name, counters in stats.iteritems():
+        for counter, value in counters.iteritems():
+            if value:
+                deltas["%s:%s" % (name, counter)] = value
+
+    try:
+        prefix = _generation_prefix()
+        if prefix != REGISTERED_GENERATION:
+            # Reset since we last flushed, so register our names again
+            REGISTERED_NAMES.clear()
+            REGISTERED_GENERATION = prefix
+
+        memcache.offset_multi(deltas, key_prefix=prefix, initial_value=0,
+                              namespace=MEMCACHE_NAMESPACE)
+
+        new_names = [name for name in stats if name not in REGISTERED_NAMES]
+        if new_names:
+            names = memcache.get(prefix + MEMCACHE_NAMES_KEY,
+                                 namespace=MEMCACHE_NAMESPACE) or {}
+            for name in new_names:
+                names[name] = True
+                REGISTERED_NAMES[name] = True
+            memcache.set(prefix + MEMCACHE_NAMES_KEY, names,
+                         namespace=MEMCACHE_NAMESPACE)
+    except Exception, e:
+        # Losing a minute of stats isn't worth failing a request over
+        logging.warning("Failed to flush cache stats: %s" % e)
+
+
+def aggregated_stats():
+    """ Returns the counters summed over every instance, costliest first """
+    from google.appengine.api import memcache
+
+    prefix = _generation_prefix()
+    names = memcache.get(prefix + MEMCACHE_NAMES_KEY,
+                         namespace=MEMCACHE_NAMESPACE) or {}
+
+    keys = ["%s:%s" % (name, counter)
+            for name in names for counter in COUNTERS]
+    values = memcache.get_multi(keys, key_prefix=prefix,
+                                namespace=MEMCACHE_NAMESPACE)
+
+    stats = {}
+    for name in names:
+        stats[name] = dict(
+            (counter, values.get("%s:%s" % (name, counter), 0))
+            for counter in COUNTERS)
+
+    return _sorted_rows(stats)
+
+
+def reset_aggregated_stats():
+    """ Starts the totals over for every instance by moving to a new
+    generation of keys. The old ones are left for memcache to evict.
+    """
+    from google.appengine.api import memcache
+    memcache.incr(MEMCACHE_GENERATION_KEY, initial_value=0,
+                  namespace=MEMCACHE_NAMESPACE)
+
+
+def _generation_prefix():
+    from google.appengine.api import memcache
+    generation = memcache.get(MEMCACHE_GENERATION_KEY,
+                              namespace=MEMCACHE_NAMESPACE) or 0
+    return "%s:" % generation
+
+
+def _sorted_rows(stats):
+    """ Turns {name: {counter: value}} into rows sorted by the number of
+    RPCs they likely cost (memcache and datastore hits plus misses), with
+    the time spent recomputing as a tie breaker.
+    """
+    rows = []
+    for name, counters in stats.iteritems():
+        row = dict((counter, counters.get(counter, 0))
+                   for counter in COUNTERS)
+        row["name"] = name
+        row["rpcs"] = (row[HITS_MEMCACHE] + row[HITS_DATASTORE] +
+                       row[MISSES])
+        rows.append(row)
+
+    rows.sort(key=lambda row: (row["rpcs"], row[RECOMPUTE_MS]), reverse=True)
+    return rows
@@ -0,0 +1,78 @@
+from mock import patch
+
+import cache_stats
+import request_cache
+from testutil import GAEModelTestCase
+
+
+@request_cache.cache()
+def cached_func():
+    return "a"
+
+
+class CacheStatsTest(GAEModelTestCase):
+    def setUp(self):
+        super(CacheStatsTest, self).setUp()
+        cache_stats.REQUEST_STATS.clear()
+        cache_stats.INSTANCE_STATS.clear()
+        cache_stats.REGISTERED_NAMES.clear()
+        cache_stats.REGISTERED_GENERATION = None
+
+    def app(self, environ, start_response):
+        cached_func()
+        cached_func()
+        return ["ok"]
+
+    def request(self):
+        middleware = request_cache.RequestCacheMiddleware(self.app)
+        middleware({}, lambda status, headers: None)
+
+    def stats(self, rows):
+        return [row for row in rows
+                if row["name"] == "cache_stats_test.cached_func"]
+
+    def test_middleware_resets_request_stats(self):
+        self.request()
+        self.request()
+
+        rows = self.stats(cache_stats.request_stats())
+        self.assertEqual(1, rows[0]["misses"])
+        self.assertEqual(1, rows[0]["hits_request"])
+
+    @patch("cache_stats.FLUSH_INTERVAL_SECONDS", -1)
+    def test_middleware_flushes_instance_stats(self):
+        self.request()
+        self.request()
+        self.request()
+
+        # Each request flushes the ones before it
+        rows = self.stats(cache_stats.aggregated_stats())
+        self.assertEqual(2, rows[0]["misses"])
+        self.assertEqual(2, rows[0]["hits_request"])
+
+    @patch("cache_stats.FLUSH_INTERVAL_SECONDS", -1)
+    def test_reset_starts_every_instance_over(self):
+        self.request()
+        self.request()
+        cache_stats.reset_aggregated_stats()
+        self.assertEqual([], self.stats(cache_stats.aggregated_stats()))
+
+        # The name is already registered with this instance, but not with
+        # the new generation
+        self.request()
+        rows = self.stats(cache_stats.aggregated_stats())
+        self.assertEqual(1, rows[0]["misses"])
+
+    @patch("cache_stats.random.random")
+    def test_sizes_are_sampled(self, mock_random):
+        start_time = cache_stats.time.time()
+        mock_random.return_value = 0.5
+        cache_stats.record_miss("sampled", start_time, "x" * 1000)
+        self.assertEqual(0, cache_stats.request_stats()[0]["bytes"])
+
+        # A measured size stands for the misses that weren't measured
+        mock_random.return_value = 0.0
+        cache_stats.record_miss("sampled", start_time, "x" * 1000)
+        [row] = cache_stats.request_stats()
+        self.assertEqual(2, row["misses"])
+        self.assertTrue(row["bytes"] >= 1000 * cache_stats.BYTES_SAMPLE_RATE)
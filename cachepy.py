@@ -20,11 +20,25 @@ Not everything are upsides. You can not use it on every case because:
 import time
 import logging
 import os
+import __builtin__
 
 CACHE = {}
 STATS_HITS = 0
 STATS_MISSES = 0
 STATS_KEYS_COUNT = 0
+STATS_EVICTIONS = 0
+STATS_EXPIRATIONS = 0
+
+""" Estimated size in bytes of every entry, and of all of them together. """
+SIZES = {}
+STATS_BYTES = 0
+
+""" 
+Least-recently-used bookkeeping: each get/set stamps the key with an 
+ever-increasing tick, and eviction drops the keys with the oldest ticks.
+"""
+LAST_USED = {}
+TICK = 0
 
 """ Flag to deactivate it on local environment. """
 ACTIVE = False if os.environ.get('SERVER_SOFTWARE').startswith('Devel') else True
@@ -35,6 +49,36 @@ Value in seconds.
 """
 DEFAULT_CACHING_TIME = None
 
+"""
+Memory budget for everything stored in this instance, in bytes. When a set
+would go over it, least recently used keys are evicted until the cache is
+back under EVICTION_LOW_WATER_MARK of the budget, so that we don't have to
+evict again on the very next set. Values bigger than the whole budget are
+not cached at all.
+"""
+MAX_BYTES = 48 * 1024 * 1024
+EVICTION_LOW_WATER_MARK = 0.9
+
+"""
+Expired entries are otherwise only removed when they're read, so every
+SWEEP_INTERVAL_SECONDS the next set also drops everything that has expired.
+"""
+SWEEP_INTERVAL_SECONDS = 60
+LAST_SWEEP = time.time()
+
+"""
+estimate_size looks at about SIZE_ESTIMATE_BUDGET values in all, splitting
+that between the items of each container it walks into and extrapolating
+from the ones it looks at to the rest. Once the budget is spent it still
+looks at one item of each list and every field of each record, dicts with
+at most SIZE_ESTIMATE_RECORD_FIELDS keys, so deep structures are sized
+without walking all of them or cutting them off. Objects it can't look
+into, like datetimes, count as LEAF_VALUE_SIZE.
+"""
+SIZE_ESTIMATE_BUDGET = 1000
+SIZE_ESTIMATE_RECORD_FIELDS = 16
+LEAF_VALUE_SIZE = 64
+
 URL_KEY = 'URL_%s'
 
 """
@@ -42,12 +86,80 @@ Curious thing: A dictionary in the global scope can be referenced and changed in
 but it can not be redefined.
 """
 
+def estimate_size( value, budget = SIZE_ESTIMATE_BUDGET, path = None ):
+    """ 
+    Default sizing hook: a rough estimate of the memory value holds, from
+    the length of its strings and how many items its containers hold. It
+    samples big containers rather than walking or pickling all of them, as
+    it's paid on every set. Can be replaced by assigning cachepy.SIZE_FXN or
+    bypassed per call with set(..., size=n), e.g. with the length a value
+    was read from memcache at.
+    """
+    if value is None or isinstance( value, ( bool, int, long, float ) ):
+        return 24
+
+    if isinstance( value, basestring ):
+        return 40 + len( value )
+
+    size = 64
+    if hasattr( value, '__dict__' ) and not isinstance( value, type ):
+        value = value.__dict__
+        size += 64
+
+    if isinstance( value, dict ):
+        items = value.items()
+    elif isinstance( value, ( list, tuple ) ):
+        items = value
+    elif isinstance( value, ( __builtin__.set, frozenset ) ):
+        # set() here is cachepy.set, hence __builtin__
+        items = list( value )
+    else:
+        return LEAF_VALUE_SIZE
+
+    # Something above already holds this container, so it's only a pointer
+    if path is None:
+        path = __builtin__.set()
+    if id( value ) in path:
+        return 8
+    path.add( id( value ) )
+
+    count = len( items )
+    if isinstance( value, dict ) and count <= SIZE_ESTIMATE_RECORD_FIELDS:
+        # A record's fields are all different, so they're all looked at
+        sample = count
+    else:
+        sample = max( 1, min( count, int( budget ) ) )
+
+    sample_size = 0
+    for n in xrange( sample ):
+        # Spread over the container, as the first items are often alike
+        item = items[ n * count / sample ]
+        if isinstance( value, dict ):
+            sample_size += ( estimate_size( item[0], budget / sample, path ) +
+                             estimate_size( item[1], budget / sample, path ) )
+        else:
+            sample_size += estimate_size( item, budget / sample, path )
+
+    path.remove( id( value ) )
+
+    size += 8 * count
+    if sample:
+        size += sample_size * count / sample
+    return size
+
+SIZE_FXN = estimate_size
+
+def _touch( key ):
+    global TICK
+    TICK += 1
+    LAST_USED[key] = TICK
+
 def get( key ):
     """ Gets the data associated to the key or a None """
     if ACTIVE is False:
         return None
         
-    global CACHE, STATS_MISSES, STATS_HITS
+    global CACHE, STATS_MISSES, STATS_HITS, STATS_EXPIRATIONS
         
     """ Return a key stored in the python instance cache or a None if it has expired or it doesn't exist """
     if key not in CACHE:
@@ -58,42 +170,101 @@ def get( key ):
     current_timestamp = time.time()
     if expiry == None or current_timestamp < expiry:
         STATS_HITS += 1
+        _touch( key )
         return value
     else:
         STATS_MISSES += 1
+        STATS_EXPIRATIONS += 1
         delete( key )
         return None
 
-def set( key, value, expiry = DEFAULT_CACHING_TIME ):
+def set( key, value, expiry = DEFAULT_CACHING_TIME, size = None ):
     """
     Sets a key in the current instance
-    key, value, expiry seconds till it expires 
+    key, value, expiry seconds till it expires, or None or 0 for never, like
+    memcache and layer_cache's KeyValueCache
+    size is the estimated number of bytes the value takes up, computed with
+    SIZE_FXN if not given
     """
     if ACTIVE is False:
         return None
     
-    global CACHE, STATS_KEYS_COUNT
-    if key not in CACHE:
+    global CACHE, STATS_KEYS_COUNT, STATS_BYTES
+
+    if size is None:
+        size = SIZE_FXN( value )
+
+    if size > MAX_BYTES:
+        logging.warning( "%s not caching key '%s': %i bytes is over the %i "
+                         "byte budget" % ( __name__, key, size, MAX_BYTES ) )
+        delete( key )
+        return None
+
+    if time.time() - LAST_SWEEP > SWEEP_INTERVAL_SECONDS:
+        sweep()
+
+    if key in CACHE:
+        STATS_BYTES -= SIZES.get( key, 0 )
+    else:
         STATS_KEYS_COUNT += 1
-    if expiry != None:
+    if expiry:
         expiry = time.time() + int( expiry )
+    else:
+        expiry = None
     
     try:
         CACHE[key] = ( value, expiry )
+        SIZES[key] = size
+        STATS_BYTES += size
+        _touch( key )
     except MemoryError:
         """ It doesn't seems to catch the exception, something in the GAE's python runtime probably """
         logging.info( "%s memory error setting key '%s'" % ( __name__, key ) )
+
+    if STATS_BYTES > MAX_BYTES:
+        evict( int( MAX_BYTES * EVICTION_LOW_WATER_MARK ) )
  
 def delete( key ):
     """ 
     Deletes the key stored in the cache of the current instance, not all the instances.
     There's no reason to use it except for debugging when developing, use expiry when setting a value instead.
     """
-    global CACHE, STATS_KEYS_COUNT
+    global CACHE, STATS_KEYS_COUNT, STATS_BYTES
     if key in CACHE:
         STATS_KEYS_COUNT -= 1
+        STATS_BYTES -= SIZES.pop( key, 0 )
+        LAST_USED.pop( key, None )
         del CACHE[key]
 
+def evict( max_bytes ):
+    """
+    Evicts least recently used keys until the cache holds at most max_bytes.
+    """
+    global STATS_EVICTIONS
+    if STATS_BYTES <= max_bytes:
+        return
+
+    by_last_use = [ ( tick, key ) for key, tick in LAST_USED.iteritems() ]
+    by_last_use.sort()
+    for tick, key in by_last_use:
+        if STATS_BYTES <= max_bytes:
+            break
+        delete( key )
+        STATS_EVICTIONS += 1
+
+def sweep():
+    """
+    Removes every expired entry from the cache of the current instance.
+    """
+    global LAST_SWEEP, STATS_EXPIRATIONS
+    current_timestamp = time.time()
+    LAST_SWEEP = current_timestamp
+    expired = [ key for key, ( value, expiry ) in CACHE.iteritems()
+                if expiry != None and current_timestamp >= expiry ]
+    for key in expired:
+        delete( key )
+    STATS_EXPIRATIONS += len( expired )
+
 def dump():
     """
     Returns the cache dictionary with all the data of the current instance, not all the instances.
@@ -107,9 +278,12 @@ def flush():
     Resets the cache of the current instance, not all the instances.
     There's no reason to use it except for debugging when developing.
     """
-    global CACHE, STATS_KEYS_COUNT
+    global CACHE, SIZES, LAST_USED, STATS_KEYS_COUNT, STATS_BYTES
     CACHE = {}
+    SIZES = {}
+    LAST_USED = {}
     STATS_KEYS_COUNT = 0
+    STATS_BYTES = 0
     
 def stats():
     """ Return the hits and misses stats, the number of keys and the cache memory address of the current instance, not all the instances."""
@@ -119,7 +293,18 @@ def stats():
             'hits': STATS_HITS,
             'misses': STATS_MISSES ,
             'keys_count': STATS_KEYS_COUNT,
+            'evictions': STATS_EVICTIONS,
+            'expirations': STATS_EXPIRATIONS,
+            'bytes': STATS_BYTES,
+            'max_bytes': MAX_BYTES,
             }
+
+def largest_keys( count = 20 ):
+    """ Returns the count biggest (estimated bytes, key) pairs of the current instance, biggest first. """
+    by_size = [ ( size, key ) for key, size in SIZES.iteritems() ]
+    by_size.sort()
+    by_size.reverse()
+    return by_size[:count]
     
 def cacheit( keyformat, expiry=DEFAULT_CACHING_TIME ):
     """ Decorator to memoize functions in the current instance cache, not all the instances. """
@@ -0,0 +1,128 @@
+import datetime
+import pickle
+import time
+
+import cachepy
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+class CachepyTest(unittest.TestCase):
+
+    def setUp(self):
+        super(CachepyTest, self).setUp()
+        # cachepy turns itself off on the dev server (and so in tests)
+        self.orig_active = cachepy.ACTIVE
+        self.orig_max_bytes = cachepy.MAX_BYTES
+        cachepy.ACTIVE = True
+        cachepy.MAX_BYTES = 100
+        cachepy.flush()
+
+    def tearDown(self):
+        cachepy.ACTIVE = self.orig_active
+        cachepy.MAX_BYTES = self.orig_max_bytes
+        cachepy.flush()
+        super(CachepyTest, self).tearDown()
+
+    def test_size_is_tracked_and_released(self):
+        cachepy.set("a", "x", size=10)
+        cachepy.set("b", "y", size=20)
+        self.assertEqual(30, cachepy.stats()["bytes"])
+
+        cachepy.set("a", "z", size=5)
+        self.assertEqual(25, cachepy.stats()["bytes"])
+
+        cachepy.delete("b")
+        self.assertEqual(5, cachepy.stats()["bytes"])
+        self.assertEqual(1, cachepy.stats()["keys_count"])
+
+    def test_least_recently_used_key_is_evicted(self):
+        cachepy.set("a", 1, size=40)
+        cachepy.set("b", 2, size=40)
+        # reading a makes b the least recently used
+        self.assertEqual(1, cachepy.get("a"))
+
+        cachepy.set("c", 3, size=40)
+
+        self.assertIsNone(cachepy.get("b"))
+        self.assertEqual(1, cachepy.get("a"))
+        self.assertEqual(3, cachepy.get("c"))
+        self.assertEqual(1, cachepy.stats()["evictions"])
+        self.assertTrue(cachepy.stats()["bytes"] <= cachepy.MAX_BYTES)
+
+    def test_value_over_budget_is_not_cached(self):
+        cachepy.set("a", "old", size=10)
+        cachepy.set("a", "huge", size=1000)
+        self.assertIsNone(cachepy.get("a"))
+        self.assertEqual(0, cachepy.stats()["bytes"])
+
+    def test_default_size_is_estimated(self):
+        cachepy.MAX_BYTES = 1024 * 1024
+        cachepy.set("a", "x" * 1000)
+        self.assertTrue(cachepy.stats()["bytes"] >= 1000)
+
+    def test_estimate_samples_big_containers(self):
+        value = [{"title": "x" * 100, "index": i} for i in xrange(10000)]
+        size = cachepy.estimate_size(value)
+        self.assertTrue(10000 * 100 <= size <= 10000 * 1000)
+
+    def test_estimate_follows_deep_values(self):
+        def tree(depth):
+            node = {"title": "Topic %s" % depth, "description": "x" * 200,
+                    "created": datetime.datetime(2012, 3, 1)}
+            if depth:
+                node["children"] = [tree(depth - 1) for i in xrange(3)]
+            return node
+
+        value = tree(8)
+        pickled_size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        size = cachepy.estimate_size(value)
+        self.assertTrue(pickled_size <= size <= 4 * pickled_size,
+                        "%s is not close to %s" % (size, pickled_size))
+
+    def test_estimate_counts_cycles_once(self):
+        class Node(object):
+            pass
+        node = Node()
+        node.title = "x" * 1000
+        node.parent = node
+
+        size = cachepy.estimate_size(node)
+        self.assertTrue(1000 <= size <= 2000)
+        self.assertEqual(cachepy.LEAF_VALUE_SIZE,
+                         cachepy.estimate_size(object()))
+
+    def test_sweep_removes_expired_entries(self):
+        cachepy.set("a", 1, expiry=60, size=10)
+        cachepy.set("b", 2, size=10)
+        cachepy.CACHE["a"] = (1, time.time() - 1)
+
+        cachepy.sweep()
+
+        self.assertFalse("a" in cachepy.dump())
+        self.assertTrue("b" in cachepy.dump())
+        self.assertEqual(10, cachepy.stats()["bytes"])
+        self.assertEqual(1, cachepy.stats()["expirations"])
+
+    def test_hits_and_misses_are_counted(self):
+        hits = cachepy.stats()["hits"]
+        misses = cachepy.stats()["misses"]
+        cachepy.set("a", 1, size=1)
+        cachepy.get("a")
+        cachepy.get("b")
+        self.assertEqual(hits + 1, cachepy.stats()["hits"])
+        self.assertEqual(misses + 1, cachepy.stats()["misses"])
+
+    def test_largest_keys(self):
+        cachepy.set("a", 1, size=10)
+        cachepy.set("b", 2, size=30)
+        cachepy.set("c", 3, size=20)
+        self.assertEqual([(30, "b"), (20, "c")], cachepy.largest_keys(2))
+
+    def test_zero_expiry_never_expires(self):
+        cachepy.set("a", 1, expiry=0, size=10)
+        self.assertEqual(1, cachepy.get("a"))
+        self.assertEqual(None, cachepy.CACHE["a"][1])
@@ -1,11 +1,23 @@
+import calendar
 import datetime
 import logging
 import copy
 
+from google.appengine.ext import db
+
 import util
 import exercise_models
 import video_models
-from summary_log_models import LogSummary, LogSummaryTypes
+from summary_log_models import LogSummary, LogSummaryTypes, ClassDailyActivityRollup
+
+# Indices stored in ClassDailyActivityRollup.activity_classes
+ACTIVITY_CLASSES = [None, "exercise", "video", "exercise_video", "videos"]
+
+def _dt_to_epoch(dt):
+    return calendar.timegm(dt.utctimetuple())
+
+def _epoch_to_dt(seconds):
+    return datetime.datetime.utcfromtimestamp(seconds)
 
 def dt_to_utc(dt, timezone_adjustment):
     return dt - timezone_adjustment
@@ -48,27 +60,10 @@ class ClassTimeAnalyzer:
         dt_start_utc1 = datetime.datetime(dt_start_utc.year, dt_start_utc.month, dt_start_utc.day)
         dt_end_utc1 = dt_start_utc1 + datetime.timedelta(days = 1)
 
-        # get the query to get the summary shards from the first day
-        log_summary_query_1 = LogSummary.get_by_name(LogSummary.get_name_by_dates(user_data_coach, LogSummaryTypes.CLASS_DAILY_ACTIVITY, dt_start_utc1, dt_end_utc1))
-        
-
         # find the second utc day that spans the teacher's day
         dt_start_utc2 = dt_end_utc1
-        dt_end_utc2 = dt_start_utc2 + datetime.timedelta(days = 1)
-
-        log_summary_query_2 = LogSummary.get_by_name(LogSummary.get_name_by_dates(user_data_coach, LogSummaryTypes.CLASS_DAILY_ACTIVITY, dt_start_utc2, dt_end_utc2))
 
-        results = util.async_queries([log_summary_query_1, log_summary_query_2], limit = 10000)
-
-        class_summary_shards = results[0].get_result()
-        class_summary = None
-        if class_summary_shards: 
-            class_summary = reduce(lambda x, y: x.merge_shard(y), map(lambda x: x.summary, class_summary_shards)) 
-
-        class_summary_day2_shards = results[1].get_result()
-        class_summary_day2 = None
-        if class_summary_day2_shards:
-            class_summary_day2 = reduce(lambda x, y: x.merge_shard(y), map(lambda x: x.summary, class_summary_day2_shards))
+        class_summary, class_summary_day2 = self.get_class_summaries_by_utc_day(user_data_coach, [dt_start_utc1, dt_start_utc2])
 
         if class_summary_day2 is not None:
             if class_summary is not None :        
@@ -84,15 +79,19 @@ class ClassTimeAnalyzer:
         for i, user_data_student in enumerate(students_data):
 
             # check to see if the current student has had any activity 
-            if class_summary.student_dict.has_key(user_data_student.user):
+            student_email = user_data_student.user.email()
+            if class_summary.student_dict.has_key(student_email):
                     
                 # loop over all chunks of that day
-                for adjacent_activity_summary in class_summary.student_dict[user_data_student.user]:
+                for adjacent_activity_summary in class_summary.student_dict[student_email]:
 
                     # make sure the chunk falls within the day specified by the coach's timezone
                     if adjacent_activity_summary.start > dt_start_utc and adjacent_activity_summary.start < dt_end_utc:
                     
                         rows += 1
+                        if adjacent_activity_summary.user_data_student is None:
+                            # Rolled up summaries don't keep the student's user
+                            adjacent_activity_summary.user_data_student = user_data_student.user
                         adjacent_activity_summary.setTimezoneOffset(self.timezone_offset)
 
                         classtime_table.drop_into_column(adjacent_activity_summary, i)      
@@ -101,6 +100,62 @@ class ClassTimeAnalyzer:
 
         return classtime_table 
 
+    def get_class_summaries_by_utc_day(self, user_data_coach, utc_days):
+        """ Returns the coach's ClassDailyActivitySummary for each UTC day, or
+        None for days without activity. Their student_dicts are keyed by
+        student email.
+
+        Days that have closed are read from their ClassDailyActivityRollup,
+        which is created from the day's LogSummary shards the first time
+        it's needed, and deleted if activities are folded into the day after
+        that. Other days merge the live shards.
+        """
+        summaries = [None] * len(utc_days)
+        found = [False] * len(utc_days)
+
+        closed_days = [i for i, day in enumerate(utc_days) if ClassDailyActivityRollup.is_closed(day)]
+        if closed_days:
+            rollups = ClassDailyActivityRollup.get_by_key_name(
+                    [ClassDailyActivityRollup.get_key_name(user_data_coach, utc_days[i]) for i in closed_days])
+            for i, rollup in zip(closed_days, rollups):
+                if rollup is not None:
+                    found[i] = True
+                    if rollup.starts:
+                        summaries[i] = ClassDailyActivitySummary.from_rollup(rollup)
+
+        missing_days = [i for i in range(len(utc_days)) if not found[i]]
+        queries = []
+        for i in missing_days:
+            dt_end_utc = utc_days[i] + datetime.timedelta(days = 1)
+            queries.append(LogSummary.get_by_name(LogSummary.get_name_by_dates(user_data_coach, LogSummaryTypes.CLASS_DAILY_ACTIVITY, utc_days[i], dt_end_utc)))
+
+        results = util.async_queries(queries, limit = 10000)
+
+        rollups = []
+        for i, result in zip(missing_days, results):
+            class_summary_shards = result.get_result()
+
+            class_summary = None
+            if class_summary_shards:
+                class_summary = reduce(lambda x, y: x.merge_shard(y), map(lambda x: x.summary, class_summary_shards))
+                class_summary.key_by_email()
+
+            # Days without any shards yet aren't rolled up, as activities
+            # can still be folded into them late
+            if i in closed_days and class_summary:
+                rollups.append(class_summary.to_rollup(ClassDailyActivityRollup.get_key_name(user_data_coach, utc_days[i])))
+
+            summaries[i] = class_summary
+
+        if rollups:
+            try:
+                db.put(rollups)
+            except Exception, e:
+                # The shards are still there to read from next time
+                logging.warning("Failed to store class time rollups: %s" % e)
+
+        return summaries
+
     def get_classtime_table_old(self, students_data, dt_start_utc):
 
         dt_start_ctz = self.dt_to_ctz(dt_start_utc)
@@ -460,6 +515,77 @@ class ClassDailyActivitySummary:
         return self
 
 
+    # rekeys student_dict by the students' emails rather than their users, which is how rolled up summaries are keyed
+    def key_by_email(self):
+        self.student_dict = dict((user.email(), summary_list) for user, summary_list in self.student_dict.iteritems())
+
+    # compacts a summary keyed by email into a ClassDailyActivityRollup
+    def to_rollup(self, key_name):
+        students = []
+        video_names = []
+        video_index = {}
+        exercise_names = []
+        exercise_index = {}
+
+        def refs(names, index, dict_names):
+            result = []
+            for name in dict_names:
+                if name not in index:
+                    index[name] = len(names)
+                    names.append(name)
+                result.append(index[name])
+            return result
+
+        columns = dict((column, []) for column in ["student_indices", "starts", "ends", "activity_classes", "video_counts", "video_refs", "exercise_counts", "exercise_refs"])
+
+        for email, summary_list in self.student_dict.iteritems():
+            students.append(email)
+            for summary in summary_list:
+                video_refs = refs(video_names, video_index, summary.dict_videos)
+                exercise_refs = refs(exercise_names, exercise_index, summary.dict_exercises)
+
+                columns["student_indices"].append(len(students) - 1)
+                columns["starts"].append(_dt_to_epoch(summary.start))
+                columns["ends"].append(_dt_to_epoch(summary.end))
+                columns["activity_classes"].append(ACTIVITY_CLASSES.index(summary.activity_class))
+                columns["video_counts"].append(len(video_refs))
+                columns["video_refs"].extend(video_refs)
+                columns["exercise_counts"].append(len(exercise_refs))
+                columns["exercise_refs"].extend(exercise_refs)
+
+        return ClassDailyActivityRollup(key_name=key_name, students=students, video_names=video_names, exercise_names=exercise_names, **columns)
+
+    # expands a ClassDailyActivityRollup back into a summary keyed by email, in a single pass over its columns
+    @staticmethod
+    def from_rollup(rollup):
+        class_summary = ClassDailyActivitySummary()
+        video_ref = 0
+        exercise_ref = 0
+
+        for i in xrange(len(rollup.starts)):
+            summary = UserAdjacentActivitySummary()
+            summary.start = _epoch_to_dt(rollup.starts[i])
+            summary.end = _epoch_to_dt(rollup.ends[i])
+            summary.activity_class = ACTIVITY_CLASSES[rollup.activity_classes[i]]
+
+            next_ref = video_ref + rollup.video_counts[i]
+            for ref in rollup.video_refs[video_ref:next_ref]:
+                summary.dict_videos[rollup.video_names[ref]] = True
+            video_ref = next_ref
+
+            next_ref = exercise_ref + rollup.exercise_counts[i]
+            for ref in rollup.exercise_refs[exercise_ref:next_ref]:
+                summary.dict_exercises[rollup.exercise_names[ref]] = True
+            exercise_ref = next_ref
+
+            email = rollup.students[rollup.student_indices[i]]
+            if email in class_summary.student_dict:
+                class_summary.student_dict[email].append(summary)
+            else:
+                class_summary.student_dict[email] = [summary]
+
+        return class_summary
+
     # merges two lists of adjacent activity summaries
     @staticmethod
     def _merge_lists(listA, listB):
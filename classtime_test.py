@@ -0,0 +1,147 @@
+import datetime
+
+import classtime
+from summary_log_models import ClassDailyActivityRollup, LogSummary
+from summary_log_models import LogSummaryTypes
+from testutil import GAEModelTestCase
+
+
+class FakeUser(object):
+    def __init__(self, email):
+        self._email = email
+
+    def email(self):
+        return self._email
+
+    # Compared like users.User, by email
+    def __eq__(self, other):
+        return self._email == other._email
+
+    def __hash__(self):
+        return hash(self._email)
+
+
+class FakeUserData(object):
+    def __init__(self, email):
+        self.key_email = email
+        self.user = FakeUser(email)
+
+
+def make_summary(start, minutes, videos=(), exercises=()):
+    summary = classtime.UserAdjacentActivitySummary()
+    summary.start = start
+    summary.end = start + datetime.timedelta(minutes=minutes)
+    for video in videos:
+        summary.dict_videos[video] = True
+    for exercise in exercises:
+        summary.dict_exercises[exercise] = True
+    if videos and exercises:
+        summary.activity_class = "exercise_video"
+    elif videos:
+        summary.activity_class = "video"
+    elif exercises:
+        summary.activity_class = "exercise"
+    return summary
+
+
+class ClassDailyActivityRollupTest(GAEModelTestCase):
+    def setUp(self):
+        super(ClassDailyActivityRollupTest, self).setUp()
+        self.coach = FakeUserData("coach@example.com")
+        self.day = datetime.datetime(2012, 3, 1)
+
+    def assert_same_summaries(self, expected, actual):
+        self.assertEqual(sorted(expected.keys()), sorted(actual.keys()))
+        for key in expected:
+            self.assertEqual(
+                [(s.start, s.end, s.activity_class, sorted(s.dict_videos),
+                  sorted(s.dict_exercises)) for s in expected[key]],
+                [(s.start, s.end, s.activity_class, sorted(s.dict_videos),
+                  sorted(s.dict_exercises)) for s in actual[key]])
+
+    def test_round_trip(self):
+        class_summary = classtime.ClassDailyActivitySummary()
+        class_summary.student_dict = {
+            "a@example.com": [
+                make_summary(self.day + datetime.timedelta(hours=9), 20,
+                             videos=["Addition"], exercises=["addition_1"]),
+                make_summary(self.day + datetime.timedelta(hours=13), 5,
+                             exercises=["addition_1", "subtraction_1"]),
+            ],
+            "b@example.com": [
+                make_summary(self.day + datetime.timedelta(hours=10), 45,
+                             videos=["Addition", "Subtraction"]),
+            ],
+        }
+
+        rollup = class_summary.to_rollup("key")
+        self.assertEqual(2, len(rollup.video_names))
+        self.assertEqual(2, len(rollup.exercise_names))
+        self.assertEqual(3, len(rollup.starts))
+
+        self.assert_same_summaries(
+            class_summary.student_dict,
+            classtime.ClassDailyActivitySummary.from_rollup(
+                rollup).student_dict)
+
+    def add_shard(self, index, email, summaries):
+        class_summary = classtime.ClassDailyActivitySummary()
+        class_summary.student_dict = {FakeUser(email): summaries}
+
+        name = LogSummary.get_name_by_dates(
+            self.coach, LogSummaryTypes.CLASS_DAILY_ACTIVITY, self.day,
+            self.day + datetime.timedelta(days=1))
+        LogSummary(key_name="%s:%s" % (index, name), name=name,
+                   summary=class_summary).put()
+
+    def test_closed_days_are_rolled_up(self):
+        morning = self.day + datetime.timedelta(hours=9)
+        self.add_shard(0, "a@example.com", [make_summary(morning, 10,
+                                                         videos=["A"])])
+        self.add_shard(1, "a@example.com", [make_summary(
+            morning + datetime.timedelta(minutes=15), 10, exercises=["e"])])
+        self.add_shard(2, "b@example.com", [make_summary(morning, 30,
+                                                         videos=["B"])])
+
+        analyzer = classtime.ClassTimeAnalyzer()
+        [merged] = analyzer.get_class_summaries_by_utc_day(self.coach,
+                                                           [self.day])
+        self.assertEqual(1, len(merged.student_dict["a@example.com"]))
+
+        rollup = ClassDailyActivityRollup.get_by_key_name(
+            ClassDailyActivityRollup.get_key_name(self.coach, self.day))
+        self.assertNotEqual(None, rollup)
+
+        # Later reads only need the rollup
+        for log_summary in LogSummary.all():
+            log_summary.delete()
+        [rolled_up] = analyzer.get_class_summaries_by_utc_day(self.coach,
+                                                              [self.day])
+        self.assert_same_summaries(merged.student_dict,
+                                   rolled_up.student_dict)
+
+    def test_open_days_are_not_rolled_up(self):
+        today = datetime.datetime.utcnow().replace(hour=0, minute=0,
+                                                   second=0, microsecond=0)
+        self.assertFalse(ClassDailyActivityRollup.is_closed(today))
+        self.assertTrue(ClassDailyActivityRollup.is_closed(self.day))
+
+        analyzer = classtime.ClassTimeAnalyzer()
+        self.assertEqual([None], analyzer.get_class_summaries_by_utc_day(
+            self.coach, [today]))
+        self.assertEqual(None, ClassDailyActivityRollup.get_by_key_name(
+            ClassDailyActivityRollup.get_key_name(self.coach, today)))
+
+    def test_closed_days_without_shards_are_not_rolled_up(self):
+        analyzer = classtime.ClassTimeAnalyzer()
+        self.assertEqual([None], analyzer.get_class_summaries_by_utc_day(
+            self.coach, [self.day]))
+        self.assertEqual(None, ClassDailyActivityRollup.get_by_key_name(
+            ClassDailyActivityRollup.get_key_name(self.coach, self.day)))
+
+        # So activities folded into the day late still show up
+        self.add_shard(0, "a@example.com", [make_summary(
+            self.day + datetime.timedelta(hours=9), 10, videos=["A"])])
+        [summary] = analyzer.get_class_summaries_by_utc_day(self.coach,
+                                                            [self.day])
+        self.assertEqual(["a@example.com"], summary.student_dict.keys())
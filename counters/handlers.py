@@ -0,0 +1,15 @@
+import request_handler
+import user_util
+from counters import user_counter
+
+
+class FoldPending(request_handler.RequestHandler):
+    """ Run by cron to move the pending adds of hybrid sharded counters from
+    memcache into their shards.
+    """
+
+    # The 'manual access checking' here is app.yaml: this is under /admin/
+    @user_util.manual_access_checking
+    def get(self):
+        user_counter.fold_pending()
+        self.response.out.write("Counters folded.")
@@ -18,13 +18,34 @@
 
 import random
 import logging
+import time
 
+from google.appengine.api import memcache
 from google.appengine.ext import db
 
 #
 # Sharded counters are useful for keeping a global count. See user_counter.py
 # for an example of their use.
 #
+# Counters that are also read often can be used in "hybrid" mode instead:
+# incr() only does a memcache.incr, fold_pending() moves what's pending in
+# memcache into the shards (from a cron job, see counters/handlers.py), and
+# get_cached_count() reads a cached total of the shards plus what's pending.
+# The cached total is refreshed on every fold and is never more than
+# CACHED_TOTAL_SECONDS old, so reads miss at most a few seconds of
+# increments. Pending increments that memcache evicts before they're folded
+# are lost, so hybrid counters are for statistics, not for anything that has
+# to be exact.
+#
+
+# How long the total of the shards is cached for get_cached_count
+CACHED_TOTAL_SECONDS = 60
+
+# add() first tries its transaction without retries, and counts it as
+# contention when that fails. fold_pending() doubles the number of shards,
+# up to MAX_SHARDS, once CONTENTION_THRESHOLD failures have been seen.
+CONTENTION_THRESHOLD = 10
+MAX_SHARDS = 200
 
 
 class ShardedCounterConfig(db.Model):
@@ -43,18 +64,122 @@ class ShardedCounter(db.Model):
     count = db.IntegerProperty(required=True, default=0)
 
 
+def _shard_key_name(name, index):
+    return name + str(index)
+
+
 def get_count(name):
     '''Get the count'''
     try:
+        # Shards are always numbered 0 to num_shards - 1 (see
+        # change_number_of_shards), so they can be fetched by key instead of
+        # by query
+        config = ShardedCounterConfig.get_by_key_name(name)
+        if not config:
+            return 0
+
+        key_names = [_shard_key_name(name, index)
+                     for index in range(config.num_shards)]
         total = 0
-        for counter in ShardedCounter.all().filter('name = ', name):
-            total += counter.count
+        for counter in ShardedCounter.get_by_key_name(key_names):
+            if counter:
+                total += counter.count
         return total
 
     except Exception, e:
         logging.error("Error in get_count: %s" % e)
         return 0
-    
+
+
+def _pending_keys(name):
+    """ memcache can't hold negative counters, so increments and decrements
+    are kept pending separately.
+    """
+    return ("sharded_counter_pending_%s" % name,
+            "sharded_counter_pending_negative_%s" % name)
+
+
+def _total_key(name):
+    return "sharded_counter_total_%s" % name
+
+
+def _contention_key(name):
+    return "sharded_counter_contention_%s" % name
+
+
+def incr(name, n):
+    '''Add n to a hybrid counter (n < 0 is valid). Only does a memcache
+    write, see fold_pending.
+    '''
+    if n == 0:
+        return
+
+    positive_key, negative_key = _pending_keys(name)
+    key = positive_key if n > 0 else negative_key
+
+    if memcache.incr(key, delta=abs(n), initial_value=0) is None:
+        logging.error("Error in incr: memcache.incr failed for %s" % name)
+
+
+def get_cached_count(name):
+    '''Get the count of a hybrid counter, including pending increments'''
+    positive_key, negative_key = _pending_keys(name)
+    total_key = _total_key(name)
+
+    values = memcache.get_multi([total_key, positive_key, negative_key])
+
+    total = values.get(total_key)
+    if total is None or time.time() - total[1] > CACHED_TOTAL_SECONDS:
+        total = _cache_total(name)
+
+    return (total[0] + long(values.get(positive_key) or 0) -
+            long(values.get(negative_key) or 0))
+
+
+def _cache_total(name):
+    total = (get_count(name), time.time())
+    memcache.set(_total_key(name), total)
+    return total
+
+
+def fold_pending(name):
+    '''Move a hybrid counter's pending increments into its shards, and grow
+    the number of shards if add() has seen a lot of contention.
+    '''
+    positive_key, negative_key = _pending_keys(name)
+    pending = memcache.get_multi([positive_key, negative_key])
+
+    n = 0
+    for key, sign in [(positive_key, 1), (negative_key, -1)]:
+        value = long(pending.get(key) or 0)
+        if value:
+            # Take what's been read out of memcache before adding it to a
+            # shard, so increments made in between stay pending. If the
+            # shard can't be updated it's put back below.
+            memcache.decr(key, delta=value)
+            n += sign * value
+
+    if n and not add(name, n):
+        incr(name, n)
+
+    _scale_shards(name)
+    _cache_total(name)
+
+
+def _scale_shards(name):
+    contention = memcache.get(_contention_key(name))
+    if not contention or contention < CONTENTION_THRESHOLD:
+        return
+
+    memcache.delete(_contention_key(name))
+
+    config = _get_config(name)
+    num = min(MAX_SHARDS, config.num_shards * 2)
+    if num > config.num_shards:
+        logging.info("Growing %s from %d to %d shards after %d contended "
+                     "adds" % (name, config.num_shards, num, contention))
+        change_number_of_shards(name, num)
+
 
 def _get_config(name):
     """ A safe way to do an atomic get_or_insert that can also be run
@@ -73,13 +198,13 @@ def _get_config(name):
 
 
 def add(name, n):
-    '''Add n to the counter (n < 0 is valid)'''
+    '''Add n to the counter (n < 0 is valid). Returns whether it worked.'''
     try:
         config = _get_config(name)
 
         def transaction():
             index = random.randint(0, config.num_shards - 1)
-            shard_name = name + str(index)
+            shard_name = _shard_key_name(name, index)
             counter = ShardedCounter.get_by_key_name(shard_name)
             if counter is None:
                 counter = ShardedCounter(key_name=shard_name, name=name)
@@ -88,11 +213,22 @@ def add(name, n):
 
         if db.is_in_transaction():
             transaction()
-        else:
+            return True
+
+        try:
+            # A failure on the first try means another add got to the same
+            # shard, which is how contention is measured for _scale_shards
+            db.run_in_transaction_options(
+                db.create_transaction_options(retries=0), transaction)
+        except db.TransactionFailedError:
+            memcache.incr(_contention_key(name), initial_value=0)
             db.run_in_transaction(transaction)
 
+        return True
+
     except Exception, e:
         logging.error("Error in add: %s" % e)
+        return False
 
 
 def change_number_of_shards(name, num):
@@ -103,12 +239,12 @@ def change_number_of_shards(name, num):
         def transaction():
             if config.num_shards > num:
                 for i in range(num, config.num_shards):
-                    del_shard_name = name + str(i)
+                    del_shard_name = _shard_key_name(name, i)
                     del_counter = ShardedCounter.get_by_key_name(
                         del_shard_name)
 
                     keep_index = random.randint(0, num - 1)
-                    keep_shard_name = name + str(keep_index)
+                    keep_shard_name = _shard_key_name(name, keep_index)
                     keep_counter = ShardedCounter.get_by_key_name(
                         keep_shard_name)
 
@@ -0,0 +1,125 @@
+import logging
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+from mock import patch
+
+from counters import sharded_counter
+from testutil import GAEModelTestCase
+from testutil import testsize
+
+
+class ShardedCounterTest(GAEModelTestCase):
+    def test_add(self):
+        for i in range(10):
+            sharded_counter.add("c", 2)
+        sharded_counter.add("c", -5)
+
+        self.assertEqual(15, sharded_counter.get_count("c"))
+        self.assertEqual(0, sharded_counter.get_count("missing"))
+
+    def test_incr_is_pending_until_folded(self):
+        sharded_counter.add("c", 10)
+        sharded_counter.incr("c", 5)
+        sharded_counter.incr("c", -2)
+
+        self.assertEqual(10, sharded_counter.get_count("c"))
+        self.assertEqual(13, sharded_counter.get_cached_count("c"))
+
+        sharded_counter.fold_pending("c")
+
+        self.assertEqual(13, sharded_counter.get_count("c"))
+        self.assertEqual(13, sharded_counter.get_cached_count("c"))
+
+        # Nothing is folded twice
+        sharded_counter.fold_pending("c")
+        self.assertEqual(13, sharded_counter.get_count("c"))
+
+    def test_negative_total(self):
+        sharded_counter.incr("c", -3)
+        self.assertEqual(-3, sharded_counter.get_cached_count("c"))
+        sharded_counter.fold_pending("c")
+        self.assertEqual(-3, sharded_counter.get_count("c"))
+
+    @patch("counters.sharded_counter.time.time")
+    def test_cached_total_staleness(self, mock_time):
+        mock_time.return_value = 1000.0
+        sharded_counter.add("c", 1)
+        self.assertEqual(1, sharded_counter.get_cached_count("c"))
+
+        # Shards written directly aren't seen until the cached total expires
+        sharded_counter.add("c", 1)
+        self.assertEqual(1, sharded_counter.get_cached_count("c"))
+
+        mock_time.return_value += sharded_counter.CACHED_TOTAL_SECONDS + 1
+        self.assertEqual(2, sharded_counter.get_cached_count("c"))
+
+    def test_contention_grows_shards(self):
+        sharded_counter.add("c", 1)
+        self.assertEqual(20, sharded_counter._get_config("c").num_shards)
+
+        # Below the threshold nothing changes
+        memcache.set(sharded_counter._contention_key("c"),
+                     sharded_counter.CONTENTION_THRESHOLD - 1)
+        sharded_counter.fold_pending("c")
+        self.assertEqual(20, sharded_counter._get_config("c").num_shards)
+
+        memcache.set(sharded_counter._contention_key("c"),
+                     sharded_counter.CONTENTION_THRESHOLD)
+        sharded_counter.fold_pending("c")
+        self.assertEqual(40, sharded_counter._get_config("c").num_shards)
+        self.assertEqual(None,
+                         memcache.get(sharded_counter._contention_key("c")))
+        self.assertEqual(1, sharded_counter.get_count("c"))
+
+    def count_rpc(self, service, call, request, response):
+        self.rpcs[service] = self.rpcs.get(service, 0) + 1
+
+    def timed(self, fxn, times):
+        """ Returns how long calling fxn times times took, and the RPCs it
+        made per service.
+        """
+        self.rpcs = {}
+        start = time.time()
+        for i in range(times):
+            fxn()
+        return time.time() - start, self.rpcs
+
+    @testsize.large()
+    def test_benchmark(self):
+        adds = 500
+        reads = 500
+
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            "rpc_counter", self.count_rpc)
+
+        add_time, add_rpcs = self.timed(
+            lambda: sharded_counter.add("datastore", 1), adds)
+        read_time, read_rpcs = self.timed(
+            lambda: sharded_counter.get_count("datastore"), reads)
+        incr_time, incr_rpcs = self.timed(
+            lambda: sharded_counter.incr("hybrid", 1), adds)
+        cached_read_time, cached_read_rpcs = self.timed(
+            lambda: sharded_counter.get_cached_count("hybrid"), reads)
+
+        sharded_counter.fold_pending("hybrid")
+        self.assertEqual(adds, sharded_counter.get_count("datastore"))
+        self.assertEqual(adds, sharded_counter.get_count("hybrid"))
+
+        logging.info("%d adds: %.0f/s with add, %.0f/s with incr. "
+                     "%d reads: %.0f/s with get_count, %.0f/s with "
+                     "get_cached_count" % (
+                         adds, adds / add_time, adds / incr_time,
+                         reads, reads / read_time,
+                         reads / cached_read_time))
+
+        # Timings vary too much from machine to machine to compare, but the
+        # hybrid counter's speed comes from skipping the datastore
+        self.assertTrue(add_rpcs["datastore_v3"] >= adds)
+        self.assertEqual(2 * reads, read_rpcs["datastore_v3"])
+        self.assertEqual({"memcache": adds}, incr_rpcs)
+
+        # Only the first read caches the total from the datastore
+        self.assertEqual(2, cached_read_rpcs["datastore_v3"])
+        self.assertEqual(reads + 1, cached_read_rpcs["memcache"])
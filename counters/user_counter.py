@@ -1,18 +1,27 @@
 import sharded_counter
 
-# Keep a global count of registered users
+# Keep a global count of registered users. This is a hybrid sharded counter:
+# adds only touch memcache and are folded into the shards by a cron job
+# calling fold_pending (see counters/handlers.py).
+
+NAME = 'user_counter'
 
 
 def get_count():
     '''Get the number of registered users'''
-    return sharded_counter.get_count('user_counter')
+    return sharded_counter.get_cached_count(NAME)
 
 
 def add(n):
     '''Add n to the counter (n < 0 is valid)'''
-    sharded_counter.add('user_counter', n)
+    sharded_counter.incr(NAME, n)
+
+
+def fold_pending():
+    '''Move pending adds into the counter's shards'''
+    sharded_counter.fold_pending(NAME)
 
 
 def change_number_of_shards(num):
     '''Change the number of shards to num'''
-    sharded_counter.change_number_of_shards('user_counter', num)
+    sharded_counter.change_number_of_shards(NAME, num)
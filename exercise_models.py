@@ -17,6 +17,7 @@ import itertools
 import logging
 import math
 import random
+import struct
 
 from google.appengine.ext import db
 
@@ -478,9 +479,9 @@ class UserExercise(db.Model):
 
         self.proficient_date = datetime.datetime.now()
 
+        # Left for the caller to put along with everything else it changed
         user_data.proficient_exercises.append(self.exercise)
         user_data.need_to_reassess = True
-        user_data.put()
 
         phantom_users.util_notify.update(user_data, self, False, True)
 
@@ -558,7 +559,7 @@ class UserExercise(db.Model):
         if len(stack_dicts) < n:
             # Now get all boundary exercises (those that aren't proficient and
             # aren't covered by other boundary exercises)
-            frontier = UserExerciseGraph.get_boundary_names(graph.graph)
+            frontier = graph.boundary_names()
             frontier_dicts = [graph.graph_dict(exid) for exid in frontier]
 
             # If we don't have *any* boundary exercises, fill things out with the other
@@ -639,40 +640,173 @@ class UserExerciseCache(db.Model):
 
     This cache is optimized for read and deserialization.
     It can be reconstituted at any time via UserExercise objects.
+
+    The states are stored as one fixed-width binary record per exercise, in
+    the same order as exercise_names, and are only decoded into dicts when
+    asked for.
     """
 
     # Bump this whenever you change the structure of the cached UserExercises
     # and need to invalidate all old caches
-    CURRENT_VERSION = 9
+    CURRENT_VERSION = 10
+
+    # streak, longest_streak, progress, struggling, total_done, last_done,
+    # last_review, review_interval_secs, proficient_date. Dates are
+    # microseconds since the epoch, or NO_DATE for None.
+    RECORD_FORMAT = "<iidBiqqqq"
+    RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+    NO_DATE = -(1 << 63)
+    EPOCH = datetime.datetime(1970, 1, 1)
 
     version = db.IntegerProperty()
-    dicts = object_property.UnvalidatedObjectProperty()
+    exercise_names = object_property.TsvProperty()
+    records = db.BlobProperty()
+
+    def __init__(self, *args, **kwargs):
+        super(UserExerciseCache, self).__init__(*args, **kwargs)
+        # exercise name -> decoded dict, and -> record index
+        self._dicts = {}
+        self._indices = None
+
+    def _index(self, exercise_name):
+        if self._indices is None:
+            self._indices = dict((name, i) for i, name in
+                                 enumerate(self.exercise_names))
+        return self._indices.get(exercise_name)
+
+    @property
+    def dicts(self):
+        """ {exercise name: user exercise dict} for every exercise """
+        return dict((name, self.user_exercise_dict(name))
+                    for name in self.exercise_names)
 
     def user_exercise_dict(self, exercise_name):
-        return self.dicts.get(exercise_name) or UserExerciseCache.dict_from_user_exercise(None)
+        user_exercise_dict = self._dicts.get(exercise_name)
+
+        if user_exercise_dict is None:
+            i = self._index(exercise_name)
+            if i is None:
+                return UserExerciseCache.dict_from_user_exercise(None)
+
+            user_exercise_dict = UserExerciseCache.decode_record(
+                self.records, i * UserExerciseCache.RECORD_SIZE)
+            self._dicts[exercise_name] = user_exercise_dict
+
+        return user_exercise_dict
 
     def update(self, user_exercise):
-        self.dicts[user_exercise.exercise] = UserExerciseCache.dict_from_user_exercise(user_exercise)
+        self.set_dicts({
+            user_exercise.exercise:
+                UserExerciseCache.dict_from_user_exercise(user_exercise)
+        })
+
+    def set_dicts(self, dicts):
+        """ Stores the given {exercise name: user exercise dict}, keeping
+        the other exercises' records as they are.
+        """
+        size = UserExerciseCache.RECORD_SIZE
+        blob = self.records or ""
+        records = [blob[i:i + size] for i in xrange(0, len(blob), size)]
+
+        for exercise_name, user_exercise_dict in dicts.iteritems():
+            record = UserExerciseCache.encode_record(user_exercise_dict)
+
+            i = self._index(exercise_name)
+            if i is None:
+                i = len(self.exercise_names)
+                # Never append to the list in place: it may be the
+                # property's default, which other caches can share
+                self.exercise_names = self.exercise_names + [exercise_name]
+                self._indices[exercise_name] = i
+                records.append(record)
+            else:
+                records[i] = record
+
+            self._dicts[exercise_name] = user_exercise_dict
+
+        self.records = db.Blob("".join(records))
+
+    @staticmethod
+    def encode_date(date):
+        # dict_from_user_exercise(None) uses 0 for no proficient_date
+        if not date:
+            return UserExerciseCache.NO_DATE
+        delta = date - UserExerciseCache.EPOCH
+        return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+    @staticmethod
+    def decode_date(microseconds):
+        if microseconds == UserExerciseCache.NO_DATE:
+            return None
+        return UserExerciseCache.EPOCH + datetime.timedelta(
+            microseconds=microseconds)
+
+    @staticmethod
+    def encode_record(user_exercise_dict):
+        encode_date = UserExerciseCache.encode_date
+        return struct.pack(UserExerciseCache.RECORD_FORMAT,
+            user_exercise_dict["streak"] or 0,
+            user_exercise_dict["longest_streak"] or 0,
+            user_exercise_dict["progress"] or 0.0,
+            user_exercise_dict["struggling"] and 1 or 0,
+            user_exercise_dict["total_done"] or 0,
+            encode_date(user_exercise_dict["last_done"]),
+            encode_date(user_exercise_dict["last_review"]),
+            user_exercise_dict["review_interval_secs"] or 0,
+            encode_date(user_exercise_dict["proficient_date"]))
+
+    @staticmethod
+    def decode_record(records, offset):
+        (streak, longest_streak, progress, struggling, total_done, last_done,
+         last_review, review_interval_secs, proficient_date) = \
+            struct.unpack_from(UserExerciseCache.RECORD_FORMAT, records,
+                               offset)
+
+        decode_date = UserExerciseCache.decode_date
+        return {
+                "streak": streak,
+                "longest_streak": longest_streak,
+                "progress": progress,
+                "struggling": bool(struggling),
+                "total_done": total_done,
+                "last_done": decode_date(last_done),
+                "last_review": decode_date(last_review),
+                "review_interval_secs": review_interval_secs,
+                "proficient_date": decode_date(proficient_date),
+                }
 
     @staticmethod
     def key_for_user_data(user_data):
         return "UserExerciseCache:%s" % user_data.key_email
 
     @staticmethod
-    def get(user_data_or_list):
+    def get_async(user_data):
+        """ Starts getting a user's UserExerciseCache entity. Pass [the rpc's
+        result] to get as prefetched. """
+        return db.get_async(
+                db.Key.from_path(UserExerciseCache.kind(),
+                                 UserExerciseCache.key_for_user_data(user_data)),
+                config=db.create_config(read_policy=db.EVENTUAL_CONSISTENCY))
+
+    @staticmethod
+    def get(user_data_or_list, prefetched=None):
         if not user_data_or_list:
             raise Exception("Must provide UserData when loading UserExerciseCache")
 
         # We can grab a single UserExerciseCache or do an optimized grab of a bunch of 'em
         user_data_list = user_data_or_list if type(user_data_or_list) == list else [user_data_or_list]
 
-        # Try to get 'em all by key name
-        user_exercise_caches = UserExerciseCache.get_by_key_name(
-                map(
-                    lambda user_data: UserExerciseCache.key_for_user_data(user_data),
-                    user_data_list),
-                config=db.create_config(read_policy=db.EVENTUAL_CONSISTENCY)
-                )
+        if prefetched is not None:
+            # Already got, e.g. with get_async, with None for missing ones
+            user_exercise_caches = list(prefetched)
+        else:
+            # Try to get 'em all by key name
+            user_exercise_caches = UserExerciseCache.get_by_key_name(
+                    map(
+                        lambda user_data: UserExerciseCache.key_for_user_data(user_data),
+                        user_data_list),
+                    config=db.create_config(read_policy=db.EVENTUAL_CONSISTENCY)
+                    )
 
         # For any that are missing or are out of date,
         # build up asynchronous queries to repopulate their data
@@ -776,26 +910,153 @@ class UserExerciseCache(db.Model):
             if user_exercise.exercise not in dicts or dicts[user_exercise.exercise]["total_done"] < user_exercise_dict["total_done"]:
                 dicts[user_exercise.exercise] = user_exercise_dict
 
-        return UserExerciseCache(
+        user_exercise_cache = UserExerciseCache(
                 key_name=UserExerciseCache.key_for_user_data(user_data),
                 version=UserExerciseCache.CURRENT_VERSION,
-                dicts=dicts,
+                exercise_names=[],
             )
+        user_exercise_cache.set_dicts(dicts)
+
+        return user_exercise_cache
+
+
+class ExerciseGraphTemplate(object):
+    """The part of a UserExerciseGraph that is the same for every user.
+
+    Exercises are numbered in the order they were given, and the covers and
+    prerequisites relations are kept as lists of those numbers. Users'
+    graphs are then computed with one pass over an order in which every
+    exercise comes after the exercises covering it, so nothing needs to
+    recurse or re-link dicts per user.
+
+    Templates are shared between users and must not be modified.
+    """
+
+    def __init__(self, exercise_dicts):
+        # Per exercise: its UserExerciseGraph.dict_from_exercise dict, the
+        # exercises that cover it and its prerequisites
+        self.exercise_dicts = []
+        self.index = {}
+
+        for exercise_dict in exercise_dicts:
+            # Only the first of several exercises with the same name is used
+            if exercise_dict["name"] not in self.index:
+                self.index[exercise_dict["name"]] = len(self.exercise_dicts)
+                self.exercise_dicts.append(exercise_dict)
+
+        count = len(self.exercise_dicts)
+        self.coverers = [[] for i in xrange(count)]
+        self.prerequisites = [[] for i in xrange(count)]
+
+        for i, exercise_dict in enumerate(self.exercise_dicts):
+            for covered_exercise_name in exercise_dict["covers"]:
+                j = self.index.get(covered_exercise_name)
+                if j is not None:
+                    self.coverers[j].append(i)
+
+            for prerequisite in exercise_dict["prerequisites"]:
+                j = self.index.get(prerequisite["name"])
+                if j is not None:
+                    self.prerequisites[i].append(j)
+
+        # Covering exercises first. Should the covers ever have a cycle, the
+        # edge that closes it is ignored.
+        self.order = []
+        visited = [False] * count
+
+        def visit(i):
+            visited[i] = True
+            for j in self.coverers[i]:
+                if not visited[j]:
+                    visit(j)
+            self.order.append(i)
+
+        for i in xrange(count):
+            if not visited[i]:
+                visit(i)
+
+        # Knowledge map order, which graph_dicts() returns
+        self.map_order = sorted(xrange(count),
+            key=lambda i: (self.exercise_dicts[i]["h_position"],
+                           self.exercise_dicts[i]["v_position"]))
+
+    @staticmethod
+    def get(exercises_allowed=None):
+        if exercises_allowed:
+            return ExerciseGraphTemplate(
+                UserExerciseGraph.exercise_dicts(exercises_allowed))
+        return ExerciseGraphTemplate._get_for_all_exercises()
+
+    @staticmethod
+    @layer_cache.cache_with_key_fxn(
+        lambda: "exercise_graph_template_%s_%s" % (
+            setting_model.Setting.cached_exercises_date(),
+            user_util.is_current_user_developer()),
+        layer=layer_cache.Layers.InAppMemory)
+    def _get_for_all_exercises():
+        return ExerciseGraphTemplate(UserExerciseGraph.exercise_dicts())
 
 
 class UserExerciseGraph(object):
-    """All the UserExercise data for a single user."""
-    def __init__(self, graph={}, cache=None):
-        self.graph = graph
+    """All the UserExercise data for a single user.
+
+    The per-user state is kept in lists indexed like the template's
+    exercises. Graph dicts, which merge the exercise's and the user's data,
+    are only built when asked for, and the same dict is returned each time
+    so callers can annotate them.
+    """
+    def __init__(self, template, user_exercise_dicts, cache=None):
+        self.template = template
+        self.user_exercise_dicts = user_exercise_dicts
         self.cache = cache
 
+        count = len(user_exercise_dicts)
+        self.proficient = [False] * count
+        self.explicitly_proficient = [None] * count
+        self.suggested = [False] * count
+        self.reviewing = [False] * count
+        self.next_review = [datetime.datetime.min] * count
+        self.boundary = [False] * count
+
+        self._graph_dicts = {}
+
+    @property
+    def graph(self):
+        """ {exercise name: graph dict} for every exercise """
+        return dict((self.template.exercise_dicts[i]["name"],
+                     self._graph_dict_at(i))
+                    for i in xrange(len(self.user_exercise_dicts)))
+
+    def _graph_dict_at(self, i):
+        graph_dict = self._graph_dicts.get(i)
+
+        if graph_dict is None:
+            graph_dict = {}
+            graph_dict.update(self.user_exercise_dicts[i])
+            graph_dict.update(self.template.exercise_dicts[i])
+            graph_dict.update({
+                "proficient": self.proficient[i],
+                "explicitly_proficient": self.explicitly_proficient[i],
+                "suggested": self.suggested[i],
+                "reviewing": self.reviewing[i],
+                "next_review": self.next_review[i],
+            })
+            self._graph_dicts[i] = graph_dict
+
+        return graph_dict
+
+    def _graph_dicts_where(self, states):
+        return [self._graph_dict_at(i) for i in self.template.map_order
+                if states[i]]
+
     def graph_dict(self, exercise_name):
-        return self.graph.get(exercise_name)
+        i = self.template.index.get(exercise_name)
+        if i is None:
+            return None
+        return self._graph_dict_at(i)
 
     def graph_dicts(self):
-        return sorted(sorted(self.graph.values(),
-                             key=lambda graph_dict: graph_dict["v_position"]),
-                             key=lambda graph_dict: graph_dict["h_position"])
+        return [self._graph_dict_at(i) for i in self.template.map_order]
 
     def proficient_exercise_names(self):
         return [graph_dict["name"] for graph_dict in self.proficient_graph_dicts()]
@@ -809,22 +1070,22 @@ class UserExerciseGraph(object):
     def has_completed_review(self):
         # TODO(david): This should return whether the user has completed today's
         #     review session.
-        return not self.review_exercise_names()
+        return not any(self.reviewing)
 
     def reviews_left_count(self):
         # TODO(david): For future algorithms this should return # reviews left
         #     for today's review session.
         # TODO(david): Make it impossible to have >= 100 reviews.
-        return len(self.review_exercise_names())
+        return self.reviewing.count(True)
 
     def suggested_graph_dicts(self):
-        return [graph_dict for graph_dict in self.graph_dicts() if graph_dict["suggested"]]
+        return self._graph_dicts_where(self.suggested)
 
     def proficient_graph_dicts(self):
-        return [graph_dict for graph_dict in self.graph_dicts() if graph_dict["proficient"]]
+        return self._graph_dicts_where(self.proficient)
 
     def review_graph_dicts(self):
-        return [graph_dict for graph_dict in self.graph_dicts() if graph_dict["reviewing"]]
+        return self._graph_dicts_where(self.reviewing)
 
     def recent_graph_dicts(self, n_recent=2):
         return sorted(
@@ -833,10 +1094,92 @@ class UserExerciseGraph(object):
                 key=lambda graph_dict: graph_dict["last_done"],
                 )[0:n_recent]
 
-    @staticmethod
-    def mark_reviewing(graph):
-        """ Mark to-be-reviewed exercise dicts as reviewing, which is used by the knowledge map
+    def boundary_names(self):
+        """ Return the names of the live exercises that succeed the student's
+        proficient exercises, in knowledge map order.
+        """
+        template = self.template
+        return [template.exercise_dicts[i]["name"]
+                for i in template.map_order
+                if self.boundary[i] and template.exercise_dicts[i]["live"]]
+
+    def attempted_names(self):
+        """ Return the names of the exercises that the student has attempted.
+
+        Exact details, such as the threshold that marks a real attempt
+        or the relevance rankings of attempted exercises, TBD.
+        """
+        progress_threshold = 0.5
+
+        attempted = [i for i in xrange(len(self.user_exercise_dicts))
+                     if (self.user_exercise_dicts[i]["progress"] > progress_threshold
+                         and not self.proficient[i])]
+
+        attempted = sorted(attempted,
+                           reverse=True,
+                           key=lambda i: self.user_exercise_dicts[i]["progress"])
+
+        return [self.template.exercise_dicts[i]["name"] for i in attempted]
+
+    def mark_proficient(self, user_data):
+        template = self.template
+
+        # Set explicit proficiencies
+        for exercise_name in user_data.proficient_exercises:
+            i = template.index.get(exercise_name)
+            if i is not None:
+                self.proficient[i] = self.explicitly_proficient[i] = True
+
+        # Consider an exercise implicitly proficient if the user has
+        # never missed a problem and a covering ancestor is proficient
+        for i in template.order:
+            if self.proficient[i]:
+                continue
+
+            user_exercise_dict = self.user_exercise_dicts[i]
+            if user_exercise_dict["streak"] == user_exercise_dict["total_done"]:
+                for j in template.coverers[i]:
+                    if self.proficient[j]:
+                        self.proficient[i] = True
+                        break
+
+    def mark_boundary(self):
+        """ Mark the exercises that succeed the student's proficient
+        exercises: those the student isn't proficient at, isn't missing
+        prerequisites for and that aren't covered by another boundary
+        exercise.
+        """
+        template = self.template
+
+        for i in template.order:
+            self.boundary[i] = (
+                not self.proficient[i] and
+                not any(self.boundary[j] for j in template.coverers[i]) and
+                all(self.proficient[j] for j in template.prerequisites[i]))
+
+    def mark_suggested(self):
+        """ Mark 5 exercises as suggested, which are used by the knowledge map
         and the profile page.
+
+        Attempted but not proficient exercises are suggested first,
+        then padded with exercises just beyond the proficiency boundary.
+
+        TODO: Although exercises might be marked in a particular order,
+        they will always be returned by suggested_graph_dicts()
+        sorted by knowledge map position. We might want to change that.
+        """
+        num_to_suggest = 5
+        suggested_names = self.attempted_names()
+
+        if len(suggested_names) < num_to_suggest:
+            suggested_names.extend(self.boundary_names())
+
+        for exercise_name in suggested_names[:num_to_suggest]:
+            self.suggested[self.template.index[exercise_name]] = True
+
+    def mark_reviewing(self):
+        """ Mark to-be-reviewed exercises as reviewing, which is used by the
+        knowledge map and the profile page.
         """
 
         # an exercise ex should be reviewed iff all of the following are true:
@@ -846,80 +1189,65 @@ class UserExerciseGraph(object):
         #   * none of ex's covering ancestors should be reviewed or ex was
         #     previously incorrectly answered (ex.streak == 0)
         #   * the user is proficient at ex
-        # the algorithm:
-        #   for each exercise:
-        #     traverse it's ancestors, computing and storing the next review time (if not already done),
-        #     using now as the next review time if proficient and streak==0
-        #   select and mark the exercises in which the user is proficient but with next review times in the past as review candidates
-        #   for each of those candidates:
-        #     traverse it's ancestors, computing and storing whether an ancestor is also a candidate
+        # the algorithm, in an order where covering ancestors come first:
+        #   compute each exercise's next review time from its own and its
+        #   ancestors', using now as the next review time if proficient and
+        #   streak==0
+        #   mark the exercises in which the user is proficient but with next
+        #   review times in the past as review candidates, and whether any
+        #   ancestor is a candidate
         #   all exercises that are candidates but do not have ancestors as
         #   candidates should be listed for review. Covering ancestors are not
         #   considered for incorrectly answered review questions
         #   (streak == 0 and proficient).
 
         now = datetime.datetime.now()
+        template = self.template
 
-        def compute_next_review(graph_dict):
-            if graph_dict.get("next_review") is None:
-                graph_dict["next_review"] = datetime.datetime.min
+        count = len(self.user_exercise_dicts)
+        is_review_candidate = [False] * count
+        is_ancestor_review_candidate = [False] * count
 
-                if graph_dict["total_done"] > 0 and graph_dict["last_review"] and graph_dict["last_review"] > datetime.datetime.min:
-                    next_review = graph_dict["last_review"] + UserExercise.get_review_interval_from_seconds(graph_dict["review_interval_secs"])
+        for i in template.order:
+            user_exercise_dict = self.user_exercise_dicts[i]
+            next_review = datetime.datetime.min
 
-                    if next_review > now and graph_dict["proficient"] and graph_dict["streak"] == 0:
-                        next_review = now
+            if user_exercise_dict["total_done"] > 0 and user_exercise_dict["last_review"] and user_exercise_dict["last_review"] > datetime.datetime.min:
+                own_next_review = user_exercise_dict["last_review"] + UserExercise.get_review_interval_from_seconds(user_exercise_dict["review_interval_secs"])
 
-                    if next_review > graph_dict["next_review"]:
-                        graph_dict["next_review"] = next_review
+                if own_next_review > now and self.proficient[i] and user_exercise_dict["streak"] == 0:
+                    own_next_review = now
 
-                for covering_graph_dict in graph_dict["coverer_dicts"]:
-                    covering_next_review = compute_next_review(covering_graph_dict)
-                    if (covering_next_review > graph_dict["next_review"] and
-                            graph_dict["streak"] != 0):
-                        graph_dict["next_review"] = covering_next_review
+                if own_next_review > next_review:
+                    next_review = own_next_review
 
-            return graph_dict["next_review"]
+            for j in template.coverers[i]:
+                if (self.next_review[j] > next_review and
+                        user_exercise_dict["streak"] != 0):
+                    next_review = self.next_review[j]
 
-        def compute_is_ancestor_review_candidate(graph_dict):
-            if graph_dict.get("is_ancestor_review_candidate") is None:
+            self.next_review[i] = next_review
 
-                graph_dict["is_ancestor_review_candidate"] = False
+            is_review_candidate[i] = (self.proficient[i] and
+                                      next_review <= now and
+                                      user_exercise_dict["total_done"] > 0)
 
-                for covering_graph_dict in graph_dict["coverer_dicts"]:
-                    graph_dict["is_ancestor_review_candidate"] = (graph_dict["is_ancestor_review_candidate"] or
-                            covering_graph_dict["is_review_candidate"] or
-                            compute_is_ancestor_review_candidate(covering_graph_dict))
-
-            return graph_dict["is_ancestor_review_candidate"]
-
-        for graph_dict in graph.values():
-            graph_dict["reviewing"] = False # Assume false at first
-            compute_next_review(graph_dict)
-
-        candidate_dicts = []
-        for graph_dict in graph.values():
-            if (graph_dict["proficient"] and
-                    graph_dict["next_review"] <= now and
-                    graph_dict["total_done"] > 0):
-                graph_dict["is_review_candidate"] = True
-                candidate_dicts.append(graph_dict)
-            else:
-                graph_dict["is_review_candidate"] = False
+            is_ancestor_review_candidate[i] = any(
+                is_review_candidate[j] or is_ancestor_review_candidate[j]
+                for j in template.coverers[i])
 
-        for graph_dict in candidate_dicts:
-            if (not compute_is_ancestor_review_candidate(graph_dict) or
-                    graph_dict["streak"] == 0):
-                graph_dict["reviewing"] = True
+            self.reviewing[i] = is_review_candidate[i] and (
+                not is_ancestor_review_candidate[i] or
+                user_exercise_dict["streak"] == 0)
 
     def states(self, exercise_name):
-        graph_dict = self.graph_dict(exercise_name)
+        i = self.template.index[exercise_name]
 
         return {
-            "proficient": graph_dict["proficient"],
-            "suggested": graph_dict["suggested"],
-            "struggling": graph_dict["struggling"],
-            "reviewing": graph_dict["reviewing"]
+            "proficient": self.proficient[i],
+            "suggested": self.suggested[i],
+            "struggling": self.user_exercise_dicts[i]["struggling"],
+            "reviewing": self.reviewing[i]
         }
 
     @staticmethod
@@ -938,10 +1266,10 @@ class UserExerciseGraph(object):
         if not user_exercise_cache_list:
             return [] if type(user_data_or_list) == list else None
 
-        exercise_dicts = UserExerciseGraph.exercise_dicts(exercises_allowed)
+        template = ExerciseGraphTemplate.get(exercises_allowed)
 
         user_exercise_graphs = map(
-                lambda (user_data, user_exercise_cache): UserExerciseGraph.generate(user_data, user_exercise_cache, exercise_dicts),
+                lambda (user_data, user_exercise_cache): UserExerciseGraph.generate(user_data, user_exercise_cache, template),
                 itertools.izip(user_data_list, user_exercise_cache_list))
 
         # Return list of graphs if a list was passed in,
@@ -975,172 +1303,25 @@ class UserExerciseGraph(object):
     def get_and_update(user_data, user_exercise):
         user_exercise_cache = UserExerciseCache.get(user_data)
         user_exercise_cache.update(user_exercise)
-        return UserExerciseGraph.generate(user_data, user_exercise_cache, UserExerciseGraph.exercise_dicts())
-
-    @staticmethod
-    def get_boundary_names(graph):
-        """ Return the names of the exercises that succeed
-        the student's proficient exercises.
-        """
-        all_exercises_dict = {}
-
-        def is_boundary(graph_dict):
-            name = graph_dict["name"]
-
-            if name in all_exercises_dict:
-                return all_exercises_dict[name]
-
-            # Don't suggest already-proficient exercises
-            if graph_dict["proficient"]:
-                all_exercises_dict.update({name: False})
-                return False
-
-            # First, assume we're suggesting this exercise
-            is_suggested = True
-
-            # Don't suggest exercises that are covered by other suggested exercises
-            for covering_graph_dict in graph_dict["coverer_dicts"]:
-                if is_boundary(covering_graph_dict):
-                    all_exercises_dict.update({name: False})
-                    return False
-
-            # Don't suggest exercises if the user isn't proficient in all prerequisites
-            for prerequisite_graph_dict in graph_dict["prerequisite_dicts"]:
-                if not prerequisite_graph_dict["proficient"]:
-                    all_exercises_dict.update({name: False})
-                    return False
-
-            all_exercises_dict.update({name: True})
-            return True
-
-        boundary_graph_dicts = []
-        for exercise_name in graph:
-            graph_dict = graph[exercise_name]
-            if graph_dict["live"] and is_boundary(graph_dict):
-                boundary_graph_dicts.append(graph_dict)
-
-        boundary_graph_dicts = sorted(sorted(boundary_graph_dicts,
-                             key=lambda graph_dict: graph_dict["v_position"]),
-                             key=lambda graph_dict: graph_dict["h_position"])
-
-        return [graph_dict["name"]
-                    for graph_dict in boundary_graph_dicts]
-
-    @staticmethod
-    def get_attempted_names(graph):
-        """ Return the names of the exercises that the student has attempted.
-
-        Exact details, such as the threshold that marks a real attempt
-        or the relevance rankings of attempted exercises, TBD.
-        """
-        progress_threshold = 0.5
-
-        attempted_graph_dicts = filter(
-                                    lambda graph_dict:
-                                        (graph_dict["progress"] > progress_threshold
-                                            and not graph_dict["proficient"]),
-                                    graph.values())
-
-        attempted_graph_dicts = sorted(attempted_graph_dicts,
-                            reverse=True,
-                            key=lambda graph_dict: graph_dict["progress"])
-
-        return [graph_dict["name"] for graph_dict in attempted_graph_dicts]
-
-    @staticmethod
-    def mark_suggested(graph):
-        """ Mark 5 exercises as suggested, which are used by the knowledge map
-        and the profile page.
-
-        Attempted but not proficient exercises are suggested first,
-        then padded with exercises just beyond the proficiency boundary.
-
-        TODO: Although exercises might be marked in a particular order,
-        they will always be returned by suggested_graph_dicts()
-        sorted by knowledge map position. We might want to change that.
-        """
-        num_to_suggest = 5
-        suggested_names = UserExerciseGraph.get_attempted_names(graph)
-
-        if len(suggested_names) < num_to_suggest:
-            boundary_names = UserExerciseGraph.get_boundary_names(graph)
-            suggested_names.extend(boundary_names)
-
-        suggested_names = suggested_names[:num_to_suggest]
-
-        for exercise_name in graph:
-            is_suggested = exercise_name in suggested_names
-            graph[exercise_name]["suggested"] = is_suggested
+        return UserExerciseGraph.generate(user_data, user_exercise_cache, ExerciseGraphTemplate.get())
 
     @staticmethod
-    def generate(user_data, user_exercise_cache, exercise_dicts):
-
-        graph = {}
-
-        # Build up base of graph
-        for exercise_dict in exercise_dicts:
-
-            user_exercise_dict = user_exercise_cache.user_exercise_dict(exercise_dict["name"])
-
-            graph_dict = {}
-
-            graph_dict.update(user_exercise_dict)
-            graph_dict.update(exercise_dict)
-            graph_dict.update({
-                "coverer_dicts": [],
-                "prerequisite_dicts": [],
-            })
-
-            # In case user has multiple UserExercise mappings for a specific exercise,
-            # always prefer the one w/ more problems done
-            if graph_dict["name"] not in graph or graph[graph_dict["name"]]["total_done"] < graph_dict["total_done"]:
-                graph[graph_dict["name"]] = graph_dict
-
-        # Cache coverers and prereqs for later
-        for graph_dict in graph.values():
-            # Cache coverers
-            for covered_exercise_name in graph_dict["covers"]:
-                covered_graph_dict = graph.get(covered_exercise_name)
-                if covered_graph_dict:
-                    covered_graph_dict["coverer_dicts"].append(graph_dict)
-
-            # Cache prereqs
-            for prerequisite_exercise_name in graph_dict["prerequisites"]:
-                prerequisite_graph_dict = graph.get(prerequisite_exercise_name["name"])
-                if prerequisite_graph_dict:
-                    graph_dict["prerequisite_dicts"].append(prerequisite_graph_dict)
-
-        # Set explicit proficiencies
-        for exercise_name in user_data.proficient_exercises:
-            graph_dict = graph.get(exercise_name)
-            if graph_dict:
-                graph_dict["proficient"] = graph_dict["explicitly_proficient"] = True
-
-        # Calculate implicit proficiencies
-        def set_implicit_proficiency(graph_dict):
-            if graph_dict["proficient"] is not None:
-                return graph_dict["proficient"]
-
-            graph_dict["proficient"] = False
-
-            # Consider an exercise implicitly proficient if the user has
-            # never missed a problem and a covering ancestor is proficient
-            if graph_dict["streak"] == graph_dict["total_done"]:
-                for covering_graph_dict in graph_dict["coverer_dicts"]:
-                    if set_implicit_proficiency(covering_graph_dict):
-                        graph_dict["proficient"] = True
-                        break
+    def generate(user_data, user_exercise_cache, template):
+        user_exercise_dicts = [
+            user_exercise_cache.user_exercise_dict(exercise_dict["name"])
+            for exercise_dict in template.exercise_dicts]
 
-            return graph_dict["proficient"]
+        graph = UserExerciseGraph(template, user_exercise_dicts,
+                                  cache=user_exercise_cache)
 
-        for exercise_name in graph:
-            set_implicit_proficiency(graph[exercise_name])
+        graph.mark_proficient(user_data)
 
         # Calculate suggested and reviewing
-        UserExerciseGraph.mark_suggested(graph)
-        UserExerciseGraph.mark_reviewing(graph)
+        graph.mark_boundary()
+        graph.mark_suggested()
+        graph.mark_reviewing()
 
-        return UserExerciseGraph(graph=graph, cache=user_exercise_cache)
+        return graph
 
 
 # This probably should have been called ExerciseLog.  Ah well.
@@ -19,16 +19,79 @@ MAX_HISTORY_KEPT = 20
 MAX_HISTORY_BIT_MASK = (1 << MAX_HISTORY_KEPT) - 1
 
 
+# Everything predict needs from a history is looked up in tables indexed by
+# one byte of the history at a time.
+HISTORY_BYTES = (MAX_HISTORY_KEPT + 7) // 8
+
+# Number of 1s in every byte
+BYTE_BIT_COUNTS = [0] * 256
+for i in xrange(1, 256):
+    BYTE_BIT_COUNTS[i] = BYTE_BIT_COUNTS[i >> 1] + (i & 1)
+
+# Maps the lowest 0 bit of a history, isolated, to the streak it ends
+STREAK_BY_LOWEST_ZERO_BIT = dict((1 << i, i)
+                                 for i in xrange(MAX_HISTORY_KEPT + 1))
+
+
 def bit_count(num):
-    # TODO(david): This uses Kerninghan's method, which would not be very quick
-    #     for dense 1s. Use numpy or some library.
     count = 0
     while num:
-        num &= num - 1
-        count += 1
+        count += BYTE_BIT_COUNTS[num & 0xFF]
+        num >>= 8
     return count
 
 
+def _ewma_answer_weights(weight):
+    """ How much the answer at each index of the history contributes to
+    exp_moving_avg(weight), which unrolls to
+    (1 - weight) ** total_done * EWMA_SEED
+        + sum(weight * (1 - weight) ** i * answer_at(i) for i < total_done)
+    """
+    return [weight * (1 - weight) ** i for i in xrange(MAX_HISTORY_KEPT)]
+
+
+def _build_answer_tables():
+    """ For each byte of the history and each value it can take, the sum of
+    the weighted EWMA terms of the correct answers in that byte.
+    """
+    answer_weights = [
+        params.EWMA_3 * ewma_3 + params.EWMA_10 * ewma_10
+        for ewma_3, ewma_10 in zip(_ewma_answer_weights(0.333),
+                                   _ewma_answer_weights(0.1))]
+    answer_weights.extend([0.0] * (HISTORY_BYTES * 8 - MAX_HISTORY_KEPT))
+
+    tables = []
+    for byte_index in xrange(HISTORY_BYTES):
+        byte_weights = answer_weights[byte_index * 8:(byte_index + 1) * 8]
+        tables.append([
+            sum(w for bit, w in enumerate(byte_weights) if value >> bit & 1)
+            for value in xrange(256)])
+    return tables
+
+
+def _build_count_table():
+    """ For every total_done and number correct, the weighted terms that
+    only depend on those two counts, plus the intercept.
+    """
+    table = [None]
+    for total_done in xrange(1, MAX_HISTORY_KEPT + 1):
+        base = (params.INTERCEPT +
+                params.EWMA_3 * (1 - 0.333) ** total_done * EWMA_SEED +
+                params.EWMA_10 * (1 - 0.1) ** total_done * EWMA_SEED +
+                params.LOG_NUM_DONE * math.log(total_done))
+        table.append([
+            base +
+            params.LOG_NUM_MISSED * math.log(total_done - correct + 1) +
+            params.PERCENT_CORRECT * float(correct) / total_done
+            for correct in xrange(total_done + 1)])
+    return table
+
+
+ANSWER_TABLES = _build_answer_tables()
+COUNT_TABLE = _build_count_table()
+CURRENT_STREAK_WEIGHT = params.CURRENT_STREAK
+
+
 class AccuracyModel(object):
     """
     Predicts the probabilty of the next problem correct using logistic
@@ -112,6 +175,81 @@ class AccuracyModel(object):
         logistic regression.
         """
 
+        if self.version != AccuracyModel.CURRENT_VERSION:
+            self.update_to_new_version()
+
+        return AccuracyModel.predict_from_state(self.answer_history,
+                                                self.total_done)
+
+    @staticmethod
+    def predict_from_state(answer_history, total_done):
+        """ predict() for a model in the given state, from lookup tables
+        built at import time instead of computing each feature.
+        """
+        # We don't try to predict the first problem (no user-exercise history)
+        if total_done == 0:
+            return PROBABILITY_FIRST_PROBLEM_CORRECT
+
+        history = answer_history & ((1 << total_done) - 1)
+
+        z = CURRENT_STREAK_WEIGHT * STREAK_BY_LOWEST_ZERO_BIT[
+            ~history & (history + 1)]
+        correct = 0
+        for table in ANSWER_TABLES:
+            byte = history & 0xFF
+            z += table[byte]
+            correct += BYTE_BIT_COUNTS[byte]
+            history >>= 8
+
+        z += COUNT_TABLE[total_done][correct]
+
+        return 1.0 / (1.0 + math.exp(-z))
+
+    @staticmethod
+    def predict_many(models):
+        """ Returns predict() for each of the given models.
+
+        Meant for reports scoring many user-exercises at once, so the tables
+        are only looked up once for the whole list.
+        """
+        answer_tables = ANSWER_TABLES
+        count_table = COUNT_TABLE
+        bit_counts = BYTE_BIT_COUNTS
+        streaks = STREAK_BY_LOWEST_ZERO_BIT
+        streak_weight = CURRENT_STREAK_WEIGHT
+        exp = math.exp
+
+        predictions = []
+        for model in models:
+            if model.version != AccuracyModel.CURRENT_VERSION:
+                model.update_to_new_version()
+
+            total_done = model.total_done
+            if total_done == 0:
+                predictions.append(PROBABILITY_FIRST_PROBLEM_CORRECT)
+                continue
+
+            history = model.answer_history & ((1 << total_done) - 1)
+
+            z = streak_weight * streaks[~history & (history + 1)]
+            correct = 0
+            for table in answer_tables:
+                byte = history & 0xFF
+                z += table[byte]
+                correct += bit_counts[byte]
+                history >>= 8
+
+            z += count_table[total_done][correct]
+            predictions.append(1.0 / (1.0 + exp(-z)))
+
+        return predictions
+
+    def predict_from_features(self):
+        """ The same as predict, computing the features from the history one
+        answer at a time. Much slower, kept as the reference predict's
+        tables are checked against.
+        """
+
         if self.version != AccuracyModel.CURRENT_VERSION:
             self.update_to_new_version()
 
@@ -4,9 +4,15 @@ tests for correct behavior expected of an accuracy model. Tries not to be
 flaky.
 """
 
+import logging
+import time
 import unittest
 
+from mock import patch
+
+from exercises import accuracy_model
 from exercises.accuracy_model import AccuracyModel
+from testutil import testsize
 
 
 class TestSequenceFunctions(unittest.TestCase):
@@ -110,5 +116,94 @@ class TestSequenceFunctions(unittest.TestCase):
             self.assertTrue(self.is_struggling('110' * i),
                             msg="Should be struggling on %s" % ('110' * i))
 
+
+class TestLookupTables(unittest.TestCase):
+    """ predict() reads the features off of lookup tables. These check it
+    against predict_from_features(), which computes them answer by answer.
+    """
+
+    @staticmethod
+    def models(max_total_done):
+        for total_done in xrange(max_total_done + 1):
+            for answer_history in xrange(1 << total_done):
+                model = AccuracyModel()
+                model.answer_history = answer_history
+                model.total_done = total_done
+                yield model
+
+    def assert_predictions_match(self, max_total_done):
+        for model in self.models(max_total_done):
+            self.assertAlmostEqual(model.predict_from_features(),
+                                   model.predict(), places=12,
+                                   msg="history %x of %s" % (
+                                       model.answer_history,
+                                       model.total_done))
+
+    def test_bit_count(self):
+        for num, count in [(0, 0), (1, 1), (3, 2), (255, 8), (256, 1),
+                           (0xF0F0F, 12), ((1 << 20) - 1, 20), (1 << 40, 1)]:
+            self.assertEqual(count, accuracy_model.bit_count(num))
+
+    def test_short_histories_match_features(self):
+        self.assert_predictions_match(12)
+
+    def test_ignores_history_past_total_done(self):
+        model = AccuracyModel()
+        model.update([True, False, True])
+        model.answer_history |= 1 << 10
+        self.assertAlmostEqual(model.predict_from_features(),
+                               model.predict(), places=12)
+
+    def test_predict_many(self):
+        models = list(self.models(8))
+        self.assertEqual([model.predict() for model in models],
+                         AccuracyModel.predict_many(models))
+
+    @testsize.large()
+    def test_all_histories_match_features(self):
+        self.assert_predictions_match(accuracy_model.MAX_HISTORY_KEPT)
+
+    @testsize.large()
+    def test_benchmark(self):
+        models = list(self.models(16))
+
+        def timed(predict):
+            """ Runs predict and returns how long it took and how many times
+            it walked a model's answer history.
+            """
+            walks = []
+            real_exp_moving_avg = AccuracyModel.exp_moving_avg
+
+            def exp_moving_avg(model, weight):
+                walks.append(weight)
+                return real_exp_moving_avg(model, weight)
+
+            patcher = patch.object(AccuracyModel, "exp_moving_avg",
+                                   exp_moving_avg)
+            patcher.start()
+            try:
+                start = time.time()
+                predict()
+                return time.time() - start, len(walks)
+            finally:
+                patcher.stop()
+
+        features_time, features_walks = timed(
+            lambda: [model.predict_from_features() for model in models])
+        tables_time, tables_walks = timed(
+            lambda: [model.predict() for model in models])
+        many_time, many_walks = timed(
+            lambda: AccuracyModel.predict_many(models))
+
+        # Timings vary too much from machine to machine to compare, so they
+        # are only logged; the tables should spare every walk of the history.
+        logging.info("%d predictions: %.2fs from features, %.2fs from tables, "
+                     "%.2fs with predict_many" % (
+                         len(models), features_time, tables_time, many_time))
+        scored = len([model for model in models if model.total_done])
+        self.assertEqual(2 * scored, features_walks)
+        self.assertEqual(0, tables_walks)
+        self.assertEqual(0, many_walks)
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,6 +2,7 @@
 
 import urllib
 
+from google.appengine.api import memcache
 from google.appengine.ext import db
 from google.appengine.ext import deferred
 
@@ -25,6 +26,8 @@ import badges.util_badges
 import phantom_users
 import custom_exceptions
 
+import gae_bingo.cache
+from asynctools import AsyncMultiTask, QueryTask
 from gae_bingo.gae_bingo import bingo
 from goals.models import GoalList
 from experiments import StrugglingExperiment
@@ -108,6 +111,46 @@ def make_wrong_attempt(user_data, user_exercise):
 
         return user_exercise
 
+def prefetch_attempt_data(user_data):
+    """ Reads everything attempt_problem needs at once: the user's
+    UserExerciseCache and current goals from the datastore in parallel, and
+    the LastActionCache and gae_bingo's request cache in one memcache
+    get_multi while those are in flight.
+
+    Returns (UserExerciseCache, LastActionCache, list of current goals).
+    """
+    user_exercise_cache_rpc = exercise_models.UserExerciseCache.get_async(
+        user_data)
+
+    goals_task = None
+    goal_rpcs = AsyncMultiTask()
+    if user_data.has_current_goals:
+        goals_task = QueryTask(
+            GoalList.get_current_goals_query(user_data), limit=100)
+        goal_rpcs.append(goals_task)
+        goals_task.make_call()
+
+    cached = memcache.get_multi(
+        badges.last_action_cache.LastActionCache.memcache_keys(user_data) +
+        gae_bingo.cache.request_cache_keys())
+    action_cache = badges.last_action_cache.LastActionCache.from_cached(
+        user_data, cached)
+    gae_bingo.cache.init_request_cache_from_memcache(cached)
+
+    # The query's callback appends an rpc to goal_rpcs for each further
+    # batch of results, so this also waits on those
+    for rpc in goal_rpcs:
+        rpc.wait()
+
+    goals = []
+    if goals_task:
+        goals = goals_task.get_result()
+
+    user_exercise_cache = exercise_models.UserExerciseCache.get(
+        user_data, prefetched=[user_exercise_cache_rpc.get_result()])
+
+    return user_exercise_cache, action_cache, goals
+
 def attempt_problem(user_data, user_exercise, problem_number, attempt_number,
     attempt_content, sha1, seed, completed, count_hints, time_taken,
     review_mode, topic_mode, problem_type, ip_address,
@@ -117,8 +160,6 @@ def attempt_problem(user_data, user_exercise, problem_number, attempt_number,
         dt_now = datetime.datetime.now()
         exercise = user_exercise.exercise_model
 
-        old_graph = user_exercise.get_user_exercise_graph()
-
         user_exercise.last_done = dt_now
         user_exercise.seconds_per_fast_problem = exercise.seconds_per_fast_problem
 
@@ -138,6 +179,17 @@ def attempt_problem(user_data, user_exercise, problem_number, attempt_number,
         if len(attempt_content) > 500:
             raise Exception("Attempt content exceeded maximum length.")
 
+        user_exercise_cache, action_cache, goals = prefetch_attempt_data(user_data)
+        template = exercise_models.ExerciseGraphTemplate.get()
+
+        def reassess_if_necessary():
+            # From the prefetched cache, as it was before this attempt,
+            # rather than getting the graph again
+            if user_data.need_to_reassess:
+                user_data.reassess_if_necessary(
+                    exercise_models.UserExerciseGraph.generate(
+                        user_data, user_exercise_cache, template))
+
         # Build up problem log for deferred put
         problem_log = exercise_models.ProblemLog(
                 key_name=exercise_models.ProblemLog.key_for(user_data, user_exercise.exercise, problem_number),
@@ -176,6 +228,7 @@ def attempt_problem(user_data, user_exercise, problem_number, attempt_number,
 
             if problem_log.correct:
 
+                reassess_if_necessary()
                 proficient = user_data.is_proficient_at(user_exercise.exercise)
                 explicitly_proficient = user_data.is_explicitly_proficient_at(user_exercise.exercise)
                 suggested = user_data.is_suggested(user_exercise.exercise)
@@ -207,16 +260,26 @@ def attempt_problem(user_data, user_exercise, problem_number, attempt_number,
                         bingo('struggling_gained_proficiency_post_struggling')
 
                     user_exercise.set_proficient(user_data)
-                    user_data.reassess_if_necessary()
+                    reassess_if_necessary()
 
                     just_earned_proficiency = True
                     problem_log.earned_proficiency = True
 
+            badge_signals = [badges.badges.BadgeSignal.PROBLEM]
+            if problem_log.points_earned:
+                badge_signals.append(badges.badges.BadgeSignal.POINTS)
+            if just_earned_proficiency:
+                badge_signals.append(badges.badges.BadgeSignal.PROFICIENCY)
+
+            # Stored along with everything else below
+            action_cache.push_problem_log(problem_log, store=False)
+
             badges.util_badges.update_with_user_exercise(
                 user_data,
                 user_exercise,
                 include_other_badges=True,
-                action_cache=badges.last_action_cache.LastActionCache.get_cache_and_push_problem_log(user_data, problem_log))
+                action_cache=action_cache,
+                signals=badge_signals)
 
             # Update phantom user notifications
             phantom_users.util_notify.update(user_data, user_exercise)
@@ -242,14 +305,24 @@ def attempt_problem(user_data, user_exercise, problem_number, attempt_number,
         if attempt_number == 1:
             user_exercise.schedule_review(completed)
 
-        user_exercise_graph = exercise_models.UserExerciseGraph.get_and_update(user_data, user_exercise)
-
-        goals_updated = GoalList.update_goals(user_data,
-            lambda goal: goal.just_did_exercise(user_data, user_exercise,
-                just_earned_proficiency))
-
-        # Bulk put
-        db.put([user_data, user_exercise, user_exercise_graph.cache])
+        user_exercise_cache.update(user_exercise)
+        user_exercise_graph = exercise_models.UserExerciseGraph.generate(
+            user_data, user_exercise_cache, template)
+
+        goals_updated = False
+        if user_data.has_current_goals:
+            goals_updated = GoalList.apply_activity(user_data, goals,
+                lambda goal: goal.just_did_exercise(user_data, user_exercise,
+                    just_earned_proficiency))
+
+        # Bulk put, overlapping with the memcache write
+        put_rpc = db.put_async([user_data, user_exercise,
+                                user_exercise_graph.cache] +
+                               (goals_updated or []))
+        unstored = action_cache.take_unstored()
+        if unstored:
+            memcache.set_multi(unstored)
+        put_rpc.get_result()
 
         if async_problem_log_put:
             # Defer the put of ProblemLog for now, as we think it might be causing hot tablets
@@ -262,9 +335,6 @@ def attempt_problem(user_data, user_exercise, problem_number, attempt_number,
             exercise_models.commit_problem_log(problem_log)
 
         if user_data is not None and user_data.coaches:
-            # Making a separate queue for the log summaries so we can clearly see how much they are getting used
-            deferred.defer(video_models.commit_log_summary_coaches, problem_log, user_data.coaches,
-                       _queue="log-summary-queue",
-                       _url="/_ah/queue/deferred_log_summary")
+            video_models.queue_log_summary_coaches(problem_log, user_data.coaches)
 
         return user_exercise, user_exercise_graph, goals_updated
@@ -0,0 +1,110 @@
+import os
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.ext import testbed
+from mock import patch
+
+import exercise_models
+import gae_bingo.cache
+import user_models
+import video_models
+from exercises import exercise_util
+from testutil import GAEModelTestCase
+
+
+class AttemptProblemRpcTest(GAEModelTestCase):
+    """ attempt_problem reads everything it needs in one batch and writes in
+    another, so an attempt should cost the same few RPCs however much state
+    it touches. """
+    def setUp(self):
+        super(AttemptProblemRpcTest, self).setUp()
+        exercise = exercise_models.Exercise(name="addition_1",
+                                            prerequisites=[], covers=[],
+                                            author=None, live=True)
+        exercise.put()
+
+        self.user_data = user_models.UserData.insert_for(
+            "student", "student@example.com")
+        self.user_exercise = self.user_data.get_or_insert_exercise(exercise)
+
+        self.rpcs = {}
+        self.patchers = [
+            patch("badges.badges.Badge.award_to"),
+            patch("exercises.exercise_util.bingo"),
+            patch("exercises.exercise_util.deferred.defer"),
+            patch("experiments.StrugglingExperiment.get_alternative_for_user"),
+        ]
+        mocks = [patcher.start() for patcher in self.patchers]
+        self.mock_defer = mocks[2]
+        mocks[3].return_value = None
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        super(AttemptProblemRpcTest, self).tearDown()
+
+    def count_rpc(self, service, call, request, response):
+        name = "%s.%s" % (service, call)
+        self.rpcs[name] = self.rpcs.get(name, 0) + 1
+
+    def attempt(self):
+        self.user_exercise = exercise_util.attempt_problem(
+            self.user_data, self.user_exercise,
+            problem_number=self.user_exercise.total_done + 1,
+            attempt_number=1, attempt_content="TEST", sha1="TEST",
+            seed="TEST", completed=True, count_hints=0, time_taken=1,
+            review_mode=False, topic_mode=False, problem_type="TEST",
+            ip_address="0.0.0.0", async_problem_log_put=True)[0]
+
+        # End the request, as gae_bingo's middleware would
+        gae_bingo.cache.store_if_dirty()
+        gae_bingo.cache.flush_request_cache()
+
+    def count_attempt_rpcs(self):
+        # Warm up the instance caches a real instance would already have
+        self.attempt()
+        self.attempt()
+
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            "rpc_counter", self.count_rpc)
+        self.attempt()
+        return self.rpcs
+
+    def test_attempt_batches_reads_and_writes(self):
+        rpcs = self.count_attempt_rpcs()
+
+        self.assertEqual(1, rpcs.get("datastore_v3.Get"))
+        self.assertEqual(None, rpcs.get("datastore_v3.RunQuery"))
+        self.assertEqual(1, rpcs.get("datastore_v3.Put"))
+        self.assertEqual(1, rpcs.get("memcache.Get"))
+        self.assertEqual(1, rpcs.get("memcache.Set"))
+        self.assertEqual(3, self.mock_defer.call_count)
+
+    def test_goals_are_read_with_everything_else(self):
+        self.user_data.has_current_goals = True
+        rpcs = self.count_attempt_rpcs()
+
+        self.assertEqual(1, rpcs.get("datastore_v3.Get"))
+        self.assertEqual(1, rpcs.get("datastore_v3.RunQuery"))
+        self.assertEqual(1, rpcs.get("datastore_v3.Put"))
+        self.assertEqual(1, rpcs.get("memcache.Get"))
+        self.assertEqual(1, rpcs.get("memcache.Set"))
+
+    @patch("time.time")
+    def test_coaches_are_queued_with_one_taskqueue_rpc(self, mock_time):
+        mock_time.return_value = 1330592400.0
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.testbed.init_taskqueue_stub(root_path=root)
+        taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        video_models._last_scheduled_fold_interval = None
+        self.user_data.coaches = ["coach@example.com"]
+
+        rpcs = self.count_attempt_rpcs()
+
+        # The fold was scheduled by the first attempt, so every later one
+        # only adds its activity to the pull queue
+        self.assertEqual(1, rpcs.get("taskqueue.BulkAdd"))
+        self.assertEqual(1, rpcs.get("datastore_v3.Put"))
+        self.assertEqual(4, self.mock_defer.call_count)
+        self.assertEqual(3, len(taskqueue_stub.GetTasks(
+            video_models.LOG_SUMMARY_PULL_QUEUE)))
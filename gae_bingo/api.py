@@ -5,10 +5,12 @@ from google.appengine.ext.webapp import RequestHandler
 
 from .gae_bingo import choose_alternative, delete_experiment, resume_experiment, modulo_choose
 from .cache import BingoCache
-from .stats import describe_result_in_words
+from .stats import describe_result_in_words, compare_alternatives, describe_comparison
 from .config import can_control_experiments, retrieve_identity
 from .jsonify import jsonify
 from .plots import get_experiment_timeline_data
+from .models import ConversionTypes
+from . import snapshots
 from .identity import identity
 
 class Experiments(RequestHandler):
@@ -101,6 +103,16 @@ class ExperimentConversions(RequestHandler):
             alternative.is_short_circuited = (not experiment.live) and (experiment.short_circuit_content == alternative.content)
             alternative.load_latest_counts()
 
+        rows = snapshots.get_series([experiment])[experiment.name]
+        counting = experiment.conversion_type == ConversionTypes.Counting
+        results = compare_alternatives(
+                [(alternative.number, alternative.participants, alternative.conversions) for alternative in alternatives],
+                counting=counting,
+                history=snapshots.history(rows))
+
+        for comparison in results["comparisons"]:
+            comparison["description"] = describe_comparison(comparison, counting)
+
         context = {
                 "canonical_name": experiment.canonical_name,
                 "live": experiment.live,
@@ -108,8 +120,9 @@ class ExperimentConversions(RequestHandler):
                 "total_conversions": reduce(lambda a, b: a + b, map(lambda alternative: alternative.conversions, alternatives)),
                 "alternatives": alternatives,
                 "significance_test_results": describe_result_in_words(alternatives),
+                "comparisons": results["comparisons"],
                 "y_axis_title": experiment.y_axis_title,
-                "timeline_series": get_experiment_timeline_data(experiment),
+                "timeline_series": get_experiment_timeline_data(experiment, rows),
         }
 
         self.response.headers["Content-Type"] = "application/json"
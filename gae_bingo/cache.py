@@ -1,5 +1,7 @@
 import cPickle as pickle
 import hashlib
+import random
+import time
 
 from google.appengine.ext import db
 from google.appengine.ext import deferred
@@ -9,6 +11,7 @@ from google.appengine.ext.webapp import RequestHandler
 
 from .models import _GAEBingoExperiment, _GAEBingoAlternative, _GAEBingoIdentityRecord, _GAEBingoSnapshotLog
 from identity import identity
+from . import snapshots
 from config import QUEUE_NAME
 
 # gae_bingo relies on the deferred library,
@@ -25,32 +28,101 @@ from config import QUEUE_NAME
 # NOTE: this request caching will need a bit of a touchup once Python 2.7 is released for GAE and concurrent requests are enabled.
 REQUEST_CACHE = {}
 
+# Experiment definitions rarely change, so each instance keeps its own BingoCache
+# across requests. Every request only reads BingoCache.VERSION_KEY, a small counter
+# that's bumped whenever an experiment is added, changed or deleted, and the
+# instance copy is refreshed when the counter has moved. See BingoCache.load.
+INSTANCE_CACHE = None
+
 def flush_request_cache():
     global REQUEST_CACHE
     REQUEST_CACHE = {}
 
-def init_request_cache_from_memcache():
+def flush_instance_cache():
+    global INSTANCE_CACHE
+    INSTANCE_CACHE = None
+
+def request_cache_keys():
+    """ The memcache keys the request cache starts out with, for callers that
+    read them along with their own keys in one get_multi. """
+    return [BingoCache.VERSION_KEY, BingoIdentityCache.key_for_identity(identity())]
+
+def init_request_cache_from_memcache(prefetched=None):
+    """ Loads the request cache, from prefetched, the result of a get_multi
+    including request_cache_keys(), if given. """
     global REQUEST_CACHE
 
     if not REQUEST_CACHE.get("loaded_from_memcache"):
-        REQUEST_CACHE = memcache.get_multi([BingoCache.MEMCACHE_KEY, BingoIdentityCache.key_for_identity(identity())])
+        if prefetched is None:
+            REQUEST_CACHE = memcache.get_multi(request_cache_keys())
+        else:
+            REQUEST_CACHE = dict((key, prefetched[key])
+                                 for key in request_cache_keys()
+                                 if key in prefetched)
         REQUEST_CACHE["loaded_from_memcache"] = True
 
 class BingoCache(object):
 
+    # Memcache holds one entry per experiment, with the experiment and its
+    # alternatives' protobufs, under EXPERIMENT_KEY. Each write of an experiment
+    # gets a new token, so entries are never modified in place.
+    #
+    # MEMCACHE_KEY is the index of experiment names to their current tokens, and
+    # VERSION_KEY is bumped after every change to the index.
     MEMCACHE_KEY = "_gae_bingo_cache"
+    VERSION_KEY = "_gae_bingo_cache_version"
+    EXPERIMENT_KEY = "_gae_bingo_experiment:%s:%s"
 
     @staticmethod
     def get():
         init_request_cache_from_memcache()
 
         if not REQUEST_CACHE.get(BingoCache.MEMCACHE_KEY):
-            REQUEST_CACHE[BingoCache.MEMCACHE_KEY] = BingoCache.load_from_datastore()
+            REQUEST_CACHE[BingoCache.MEMCACHE_KEY] = BingoCache.load(REQUEST_CACHE.get(BingoCache.VERSION_KEY))
 
         return REQUEST_CACHE[BingoCache.MEMCACHE_KEY]
 
+    @staticmethod
+    def load(version):
+        """ Returns this instance's BingoCache, brought up to date with version,
+        the current value of VERSION_KEY.
+
+        """
+        global INSTANCE_CACHE
+
+        if INSTANCE_CACHE is None:
+            INSTANCE_CACHE = BingoCache()
+
+        if version is not None and INSTANCE_CACHE.version == version:
+            return INSTANCE_CACHE
+
+        if INSTANCE_CACHE.refresh(version):
+            if version is None:
+                # The version counter was evicted, but the index is still around
+                memcache.add(BingoCache.VERSION_KEY, BingoCache.initial_version())
+            return INSTANCE_CACHE
+
+        INSTANCE_CACHE = BingoCache.load_from_datastore()
+        return INSTANCE_CACHE
+
+    @staticmethod
+    def initial_version():
+        # Counters restart from the current time rather than 0 so an evicted counter
+        # can't come back to a value that some instance has already seen.
+        return int(time.time())
+
+    @staticmethod
+    def new_token():
+        return "%s.%s" % (int(time.time() * 1000), random.randint(0, 1 << 30))
+
+    @staticmethod
+    def experiment_key(experiment_name, token):
+        return BingoCache.EXPERIMENT_KEY % (experiment_name, token)
+
     def __init__(self):
-        self.dirty = False
+        self.version = None # Value of VERSION_KEY this cache is known to be current with
+        self.tokens = {} # Mapping of experiment names to the tokens of their memcache entries
+        self.dirty_experiment_names = set() # Experiments added, changed or deleted since the last store
 
         self.experiments = {} # Protobuf version of experiments for extremely fast (de)serialization
         self.experiment_models = {} # Deserialized experiment models
@@ -61,26 +133,99 @@ class BingoCache(object):
         self.experiment_names_by_conversion_name = {} # Mapping of conversion names to experiment names
         self.experiment_names_by_canonical_name = {} # Mapping of canonical names to experiment names
 
-    def store_if_dirty(self):
+    def refresh(self, version=None):
+        """ Fetches the experiments that have changed since this cache was last
+        refreshed. Returns False if anything needed wasn't in memcache.
+
+        """
+        index = memcache.get(BingoCache.MEMCACHE_KEY)
+        if index is None:
+            return False
+
+        changed_names = [name for name, token in index.iteritems() if self.tokens.get(name) != token]
+        deleted_names = [name for name in self.tokens if name not in index]
+
+        keys = [BingoCache.experiment_key(name, index[name]) for name in changed_names]
+        if keys:
+            entries = memcache.get_multi(keys)
+            if len(entries) != len(keys):
+                return False
+
+        for experiment_name in deleted_names:
+            self.remove_experiment(experiment_name)
+
+        for experiment_name, key in zip(changed_names, keys):
+            self.remove_experiment(experiment_name)
+
+            experiment, alternatives = entries[key]
+            self.set_experiment_protobufs(experiment_name, experiment, alternatives)
+            self.tokens[experiment_name] = index[experiment_name]
+
+        self.version = version
+        return True
+
+    def store_if_dirty(self, replace_index=False):
 
         # Only write to memcache if a change has been made
-        if not self.dirty:
+        if not self.dirty_experiment_names and not replace_index:
             return
 
-        # Wipe out deserialized models before serialization for speed
-        self.experiment_models = {}
-        self.alternative_models = {}
+        experiment_names = self.dirty_experiment_names
 
         # No longer dirty
-        self.dirty = False
+        self.dirty_experiment_names = set()
+
+        entries = {}
+        for experiment_name in experiment_names:
+            if experiment_name in self.experiments:
+                token = BingoCache.new_token()
+                self.tokens[experiment_name] = token
+                entries[BingoCache.experiment_key(experiment_name, token)] = (self.experiments[experiment_name], self.alternatives.get(experiment_name, {}))
+            elif experiment_name in self.tokens:
+                del self.tokens[experiment_name]
+
+        memcache.set_multi(entries)
+
+        if replace_index:
+            memcache.set(BingoCache.MEMCACHE_KEY, dict(self.tokens))
+        else:
+            self.update_index(experiment_names)
+
+        # This cache's own version is left alone, so the next request still refreshes
+        # it from the index and picks up any concurrent changes made elsewhere.
+        memcache.incr(BingoCache.VERSION_KEY, initial_value=BingoCache.initial_version())
+
+    def update_index(self, experiment_names):
+        client = memcache.Client()
 
-        memcache.set(BingoCache.MEMCACHE_KEY, self)
+        for attempt in range(10):
+            index = client.gets(BingoCache.MEMCACHE_KEY)
+
+            if index is None:
+                # Index has been evicted, this cache has every experiment in it anyway
+                memcache.set(BingoCache.MEMCACHE_KEY, dict(self.tokens))
+                return
+
+            for experiment_name in experiment_names:
+                if experiment_name in self.tokens:
+                    index[experiment_name] = self.tokens[experiment_name]
+                elif experiment_name in index:
+                    del index[experiment_name]
+
+            if client.cas(BingoCache.MEMCACHE_KEY, index):
+                return
+
+        # Give up on the index and let every instance reload from the datastore
+        memcache.delete(BingoCache.MEMCACHE_KEY)
 
     def persist_to_datastore(self):
         """ Persist current state of experiment and alternative models to
         datastore. Their sums might be slightly out-of-date during any
         given persist, but not by much.
 
+        Counts are only persisted, not written back to the cached alternatives,
+        so this doesn't force every instance to refresh its BingoCache.
+
         """
 
         for experiment_name in self.experiments:
@@ -94,24 +239,23 @@ class BingoCache(object):
                 # When persisting to datastore, we want to store the most recent value we've got
                 alternative_model.load_latest_counts()
                 alternative_model.put()
-                self.update_alternative(alternative_model)
-
-        # When periodically persisting to datastore, also make sure memcache
-        # has relatively up-to-date participant/conversion counts for each alternative.
-        self.dirty = True
-        self.store_if_dirty()
 
     def log_cache_snapshot(self):
 
         # Log current data on live experiments to the datastore
         log_entries = []
+        log_entries_by_experiment_name = {}
 
         for experiment_name in self.experiments:
             experiment_model = self.get_experiment(experiment_name)
             if experiment_model and experiment_model.live:
-                log_entries += self.log_experiment_snapshot(experiment_model)
+                log_entries_by_experiment_name[experiment_name] = self.log_experiment_snapshot(experiment_model)
+                log_entries += log_entries_by_experiment_name[experiment_name]
 
         db.put(log_entries)
+
+        # Keep the cached snapshot histories the dashboard reads up to date
+        snapshots.append_snapshots(log_entries_by_experiment_name)
             
     def log_experiment_snapshot(self, experiment_model):
 
@@ -151,8 +295,9 @@ class BingoCache(object):
         for experiment_name in experiment_dict:
             bingo_cache.add_experiment(experiment_dict.get(experiment_name), alternatives_dict.get(experiment_name))
 
-        # Immediately store in memcache as soon as possible after loading from datastore to minimize # of datastore loads
-        bingo_cache.store_if_dirty()
+        # Immediately store in memcache as soon as possible after loading from datastore to minimize # of datastore loads.
+        # The datastore is authoritative, so this replaces the index entirely.
+        bingo_cache.store_if_dirty(replace_index=True)
 
         return bingo_cache
 
@@ -163,7 +308,14 @@ class BingoCache(object):
 
         self.experiment_models[experiment.name] = experiment
         self.experiments[experiment.name] = db.model_to_protobuf(experiment).Encode()
+        self.add_experiment_names(experiment)
+
+        for alternative in alternatives:
+            self.update_alternative(alternative)
+
+        self.dirty_experiment_names.add(experiment.name)
 
+    def add_experiment_names(self, experiment):
         if not experiment.conversion_name in self.experiment_names_by_conversion_name:
             self.experiment_names_by_conversion_name[experiment.conversion_name] = []
         self.experiment_names_by_conversion_name[experiment.conversion_name].append(experiment.name)
@@ -172,16 +324,17 @@ class BingoCache(object):
             self.experiment_names_by_canonical_name[experiment.canonical_name] = []
         self.experiment_names_by_canonical_name[experiment.canonical_name].append(experiment.name)
 
-        for alternative in alternatives:
-            self.update_alternative(alternative)
-
-        self.dirty = True
+    def set_experiment_protobufs(self, experiment_name, experiment, alternatives):
+        """ Adds an experiment and its alternatives as read from memcache """
+        self.experiments[experiment_name] = experiment
+        self.alternatives[experiment_name] = alternatives
+        self.add_experiment_names(self.get_experiment(experiment_name))
 
     def update_experiment(self, experiment):
         self.experiment_models[experiment.name] = experiment
         self.experiments[experiment.name] = db.model_to_protobuf(experiment).Encode()
 
-        self.dirty = True
+        self.dirty_experiment_names.add(experiment.name)
 
     def update_alternative(self, alternative):
         if not alternative.experiment_name in self.alternatives:
@@ -193,7 +346,23 @@ class BingoCache(object):
         if alternative.experiment_name in self.alternative_models:
             del self.alternative_models[alternative.experiment_name]
 
-        self.dirty = True
+        self.dirty_experiment_names.add(alternative.experiment_name)
+
+    def remove_experiment(self, experiment_name):
+        """ Removes an experiment and its alternatives from this cache only """
+        experiment = self.get_experiment(experiment_name)
+        if not experiment:
+            return
+
+        if experiment.conversion_name in self.experiment_names_by_conversion_name:
+            self.experiment_names_by_conversion_name[experiment.conversion_name].remove(experiment_name)
+
+        if experiment.canonical_name in self.experiment_names_by_canonical_name:
+            self.experiment_names_by_canonical_name[experiment.canonical_name].remove(experiment_name)
+
+        for cache in [self.experiments, self.experiment_models, self.alternatives, self.alternative_models, self.tokens]:
+            if experiment_name in cache:
+                del cache[experiment_name]
 
     def delete_experiment_and_alternatives(self, experiment):
 
@@ -208,25 +377,9 @@ class BingoCache(object):
             alternative.delete()
 
         # Remove from current cache
-        if experiment.name in self.experiments:
-            del self.experiments[experiment.name]
-
-        if experiment.name in self.experiment_models:
-            del self.experiment_models[experiment.name]
-
-        if experiment.name in self.alternatives:
-            del self.alternatives[experiment.name]
+        self.remove_experiment(experiment.name)
 
-        if experiment.name in self.alternative_models:
-            del self.alternative_models[experiment.name]
-
-        if experiment.conversion_name in self.experiment_names_by_conversion_name:
-            self.experiment_names_by_conversion_name[experiment.conversion_name].remove(experiment.name)
-
-        if experiment.canonical_name in self.experiment_names_by_canonical_name:
-            self.experiment_names_by_canonical_name[experiment.canonical_name].remove(experiment.name)
-
-        self.dirty = True
+        self.dirty_experiment_names.add(experiment.name)
 
         # Immediately store in memcache as soon as possible after deleting from datastore
         self.store_if_dirty()
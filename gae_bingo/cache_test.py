@@ -0,0 +1,140 @@
+from google.appengine.api import memcache
+from google.appengine.ext import db
+from mock import patch
+
+from gae_bingo import cache
+from gae_bingo import counter_buffer
+from gae_bingo.cache import BingoCache
+from gae_bingo.models import _GAEBingoAlternative, _GAEBingoExperiment
+from gae_bingo.models import create_experiment_and_alternatives
+from testutil import GAEModelTestCase
+
+REAL_GET_MULTI = memcache.get_multi
+
+
+class BingoCacheTest(GAEModelTestCase):
+    def setUp(self):
+        super(BingoCacheTest, self).setUp()
+        cache.flush_instance_cache()
+        counter_buffer.BUFFER.clear()
+
+        for name in ["monkeys", "chimps"]:
+            experiment, alternatives = create_experiment_and_alternatives(
+                name, name)
+            db.put([experiment] + alternatives)
+
+    def tearDown(self):
+        cache.flush_instance_cache()
+        super(BingoCacheTest, self).tearDown()
+
+    def version(self):
+        return memcache.get(BingoCache.VERSION_KEY)
+
+    def test_load_from_datastore_fills_memcache(self):
+        bingo_cache = BingoCache.load(None)
+
+        self.assertEqual(["chimps", "monkeys"],
+                         sorted(bingo_cache.experiments.keys()))
+        self.assertNotEqual(None, self.version())
+        self.assertEqual(bingo_cache.tokens,
+                         memcache.get(BingoCache.MEMCACHE_KEY))
+
+        # Another instance can now load everything from memcache
+        cache.flush_instance_cache()
+        db.delete(_GAEBingoExperiment.all(keys_only=True).fetch(10) +
+                  _GAEBingoAlternative.all(keys_only=True).fetch(10))
+        other_cache = BingoCache.load(self.version())
+
+        self.assertEqual(["chimps", "monkeys"],
+                         sorted(other_cache.experiments.keys()))
+        self.assertEqual(2, len(other_cache.get_alternatives("monkeys")))
+        self.assertEqual(["monkeys"],
+            other_cache.get_experiment_names_by_canonical_name("monkeys"))
+
+    @patch("google.appengine.api.memcache.get_multi")
+    def test_unchanged_version_is_not_refetched(self, mock_get_multi):
+        mock_get_multi.side_effect = REAL_GET_MULTI
+        bingo_cache = BingoCache.load(None)
+        BingoCache.load(self.version())
+        mock_get_multi.reset_mock()
+
+        self.assertTrue(bingo_cache is BingoCache.load(self.version()))
+        self.assertEqual(0, mock_get_multi.call_count)
+
+    @patch("google.appengine.api.memcache.get_multi")
+    def test_only_changed_experiments_are_refetched(self, mock_get_multi):
+        mock_get_multi.side_effect = REAL_GET_MULTI
+        bingo_cache = BingoCache.load(None)
+        BingoCache.load(self.version())
+
+        # Another instance changes one experiment and deletes the other
+        other_cache = BingoCache()
+        other_cache.refresh()
+        experiment = other_cache.get_experiment("monkeys")
+        experiment.live = False
+        other_cache.update_experiment(experiment)
+        other_cache.store_if_dirty()
+        other_cache.delete_experiment_and_alternatives(
+            other_cache.get_experiment("chimps"))
+
+        mock_get_multi.reset_mock()
+        self.assertTrue(bingo_cache is BingoCache.load(self.version()))
+
+        self.assertEqual(1, mock_get_multi.call_count)
+        keys = mock_get_multi.call_args[0][0]
+        self.assertEqual(1, len(keys))
+        self.assertTrue(keys[0].startswith("_gae_bingo_experiment:monkeys:"))
+
+        self.assertEqual(["monkeys"], bingo_cache.experiments.keys())
+        self.assertFalse(bingo_cache.get_experiment("monkeys").live)
+        self.assertEqual([],
+            bingo_cache.get_experiment_names_by_canonical_name("chimps"))
+
+    def test_missing_experiment_entry_reloads_from_datastore(self):
+        bingo_cache = BingoCache.load(None)
+        cache.flush_instance_cache()
+        memcache.delete(BingoCache.experiment_key("monkeys",
+                                                  bingo_cache.tokens["monkeys"]))
+
+        other_cache = BingoCache.load(self.version())
+        self.assertEqual(["chimps", "monkeys"],
+                         sorted(other_cache.experiments.keys()))
+
+    def test_counts_do_not_change_the_version(self):
+        bingo_cache = BingoCache.load(None)
+        version = self.version()
+
+        for alternative in bingo_cache.get_alternatives("monkeys"):
+            alternative.increment_participants()
+        bingo_cache.persist_to_datastore()
+        bingo_cache.store_if_dirty()
+
+        self.assertEqual(version, self.version())
+        for alternative in bingo_cache.get_alternatives("monkeys"):
+            self.assertEqual(1, db.get(alternative.key()).participants)
+
+    def test_missing_counters_are_not_counted_twice(self):
+        bingo_cache = BingoCache.load(None)
+        alternative = bingo_cache.get_alternatives("monkeys")[0]
+
+        # The alternative stays cached in the instance across requests, and
+        # counts every increment as it's buffered
+        for i in xrange(5):
+            alternative.increment_participants()
+        self.assertEqual(5, alternative.participants)
+
+        counter_buffer.flush()
+        self.assertEqual(5, memcache.get(alternative.participants_key()))
+
+        # After an eviction, counting restarts from the stored count
+        alternative.participants = 3
+        alternative.put()
+        memcache.delete(alternative.participants_key())
+        alternative.participants = 5
+        for i in xrange(4):
+            alternative.increment_participants()
+        counter_buffer.flush()
+
+        self.assertEqual(9, memcache.get(alternative.participants_key()))
+        alternative.load_latest_counts()
+        self.assertEqual(9, alternative.participants)
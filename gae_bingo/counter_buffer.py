@@ -0,0 +1,97 @@
+import logging
+import time
+
+from google.appengine.api import memcache
+
+# Participation and conversion counts are memcache counters. Rather than
+# one memcache.incr per event, increments are added up in this instance and
+# sent with a single memcache.offset_multi when the buffer is flushed.
+#
+# The middleware calls flush_if_due() at the end of every request, which
+# flushes once FLUSH_INTERVAL_SECONDS have passed since the last flush or
+# MAX_BUFFERED_EVENTS events are waiting. If an instance is shut down with
+# increments in its buffer they are lost, so at most that many seconds or
+# events worth of one instance's counts can go missing. Like the rest of
+# gae_bingo's statistics, that's acceptable as long as the loss isn't
+# correlated with the alternatives.
+#
+# NOTE: this assumes one request at a time per instance, like the request
+# cache in cache.py.
+
+FLUSH_INTERVAL_SECONDS = 5
+MAX_BUFFERED_EVENTS = 200
+
+# memcache key -> [delta, initial value]
+BUFFER = {}
+BUFFERED_EVENTS = 0
+LAST_FLUSH = time.time()
+
+def increment(key, initial_value=0, delta=1):
+    """ Buffers an increment of the memcache counter at key. If the counter
+    isn't in memcache when the buffer is flushed, it starts at initial_value
+    plus the buffered increments.
+
+    initial_value is the count before this increment. Only the one given
+    with the first increment buffered for a key is kept, as later ones
+    already include the increments buffered before them. It may also be a
+    function, which is then only called for counters that are actually
+    missing.
+    """
+    global BUFFERED_EVENTS
+
+    if key in BUFFER:
+        BUFFER[key][0] += delta
+    else:
+        BUFFER[key] = [delta, initial_value]
+
+    BUFFERED_EVENTS += 1
+
+def pending(key):
+    """ The increments to key that haven't been sent to memcache yet """
+    if key in BUFFER:
+        return BUFFER[key][0]
+    return 0
+
+def discard(keys):
+    """ Drops any buffered increments to keys, e.g. when they're reset """
+    for key in keys:
+        if key in BUFFER:
+            del BUFFER[key]
+
+def flush_if_due():
+    if not BUFFER:
+        return
+
+    if (BUFFERED_EVENTS >= MAX_BUFFERED_EVENTS or
+            time.time() - LAST_FLUSH >= FLUSH_INTERVAL_SECONDS):
+        flush()
+
+def flush():
+    """ Sends all buffered increments to memcache """
+    global BUFFER, BUFFERED_EVENTS, LAST_FLUSH
+
+    LAST_FLUSH = time.time()
+
+    if not BUFFER:
+        return
+
+    buffered = BUFFER
+    BUFFER = {}
+    BUFFERED_EVENTS = 0
+
+    deltas = dict((key, delta) for key, (delta, initial_value) in buffered.iteritems())
+
+    try:
+        results = memcache.offset_multi(deltas)
+    except Exception, e:
+        logging.error("Failed to flush gae_bingo counters: %s" % e)
+        return
+
+    # Counters that weren't in memcache (evicted, or never incremented) are
+    # started from their initial values one by one. This is rare.
+    for key, result in results.iteritems():
+        if result is None:
+            delta, initial_value = buffered[key]
+            if callable(initial_value):
+                initial_value = initial_value()
+            memcache.incr(key, delta=delta, initial_value=initial_value)
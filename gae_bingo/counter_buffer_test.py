@@ -0,0 +1,121 @@
+import time
+
+from google.appengine.api import memcache
+from mock import patch
+
+from gae_bingo import counter_buffer
+from testutil import GAEModelTestCase
+from testutil import testsize
+
+REAL_OFFSET_MULTI = memcache.offset_multi
+REAL_INCR = memcache.incr
+REAL_GET_MULTI = memcache.get_multi
+
+
+class CounterBufferTest(GAEModelTestCase):
+    def setUp(self):
+        super(CounterBufferTest, self).setUp()
+        counter_buffer.BUFFER.clear()
+        counter_buffer.BUFFERED_EVENTS = 0
+        counter_buffer.LAST_FLUSH = time.time()
+
+    def test_increments_are_buffered_until_flushed(self):
+        counter_buffer.increment("a")
+        counter_buffer.increment("a")
+        counter_buffer.increment("b")
+
+        self.assertEqual(None, memcache.get("a"))
+        self.assertEqual(2, counter_buffer.pending("a"))
+
+        counter_buffer.flush()
+
+        self.assertEqual(2, memcache.get("a"))
+        self.assertEqual(1, memcache.get("b"))
+        self.assertEqual(0, counter_buffer.pending("a"))
+
+    def test_missing_counters_start_at_initial_value(self):
+        memcache.set("a", 10)
+        counter_buffer.increment("a", initial_value=5)
+        counter_buffer.increment("b", initial_value=5)
+        counter_buffer.increment("b", initial_value=5)
+        counter_buffer.flush()
+
+        self.assertEqual(11, memcache.get("a"))
+        self.assertEqual(7, memcache.get("b"))
+
+    def test_first_initial_value_is_kept(self):
+        # Each initial value is the count before its increment
+        for count in xrange(3):
+            counter_buffer.increment("a", initial_value=5 + count)
+        counter_buffer.flush()
+
+        self.assertEqual(8, memcache.get("a"))
+
+    def test_initial_value_function_only_called_when_missing(self):
+        calls = []
+        def initial_value():
+            calls.append(True)
+            return 5
+
+        memcache.set("a", 10)
+        counter_buffer.increment("a", initial_value=initial_value)
+        counter_buffer.increment("b", initial_value=initial_value)
+        counter_buffer.flush()
+
+        self.assertEqual(11, memcache.get("a"))
+        self.assertEqual(6, memcache.get("b"))
+        self.assertEqual(1, len(calls))
+
+    def test_flush_if_due(self):
+        counter_buffer.increment("a")
+        counter_buffer.flush_if_due()
+        self.assertEqual(None, memcache.get("a"))
+
+        counter_buffer.LAST_FLUSH -= counter_buffer.FLUSH_INTERVAL_SECONDS
+        counter_buffer.flush_if_due()
+        self.assertEqual(1, memcache.get("a"))
+
+        for i in xrange(counter_buffer.MAX_BUFFERED_EVENTS):
+            counter_buffer.increment("a")
+        counter_buffer.flush_if_due()
+        self.assertEqual(1 + counter_buffer.MAX_BUFFERED_EVENTS,
+                         memcache.get("a"))
+
+    def test_discard(self):
+        counter_buffer.increment("a")
+        counter_buffer.increment("b")
+        counter_buffer.discard(["a"])
+        counter_buffer.flush()
+
+        self.assertEqual(None, memcache.get("a"))
+        self.assertEqual(1, memcache.get("b"))
+
+    @testsize.medium()
+    @patch("google.appengine.api.memcache.incr")
+    @patch("google.appengine.api.memcache.offset_multi")
+    def test_load(self, mock_offset_multi, mock_incr):
+        mock_offset_multi.side_effect = REAL_OFFSET_MULTI
+        mock_incr.side_effect = REAL_INCR
+
+        requests = 2000
+        increments_per_request = 5
+        keys = ["alternative:%s:participants" % i for i in xrange(20)]
+        expected = dict((key, 0) for key in keys)
+
+        for request in xrange(requests):
+            for i in xrange(increments_per_request):
+                key = keys[(request * 7 + i) % len(keys)]
+                counter_buffer.increment(key)
+                expected[key] += 1
+            counter_buffer.flush_if_due()
+        counter_buffer.flush()
+
+        self.assertEqual(expected, REAL_GET_MULTI(keys))
+
+        # Without the buffer, each event was its own memcache.incr
+        events = requests * increments_per_request
+        self.assertTrue(mock_offset_multi.call_count <=
+                        events / counter_buffer.MAX_BUFFERED_EVENTS + 5)
+
+        # Each counter is only missing from memcache the first time
+        self.assertEqual(len(keys), mock_incr.call_count)
@@ -7,7 +7,8 @@ import urllib
 from google.appengine.ext.webapp import RequestHandler
 from .config import can_control_experiments
 from .cache import BingoCache
-from .stats import describe_result_in_words
+from .stats import describe_result_in_words, compare_alternatives, describe_comparison
+from .models import ConversionTypes
 
 class Dashboard(RequestHandler):
 
@@ -60,6 +61,11 @@ class Export(RequestHandler):
                 writer.writerow(["CONVERSION NAME: %s" % experiment.conversion_name])
                 writer.writerow([])
 
+                # The cached alternatives only have the counts they were
+                # created with
+                for alternative in alternatives:
+                    alternative.load_latest_counts()
+
                 writer.writerow(["ALTERNATIVE NUMBER", "CONTENT", "PARTICIPANTS", "CONVERSIONS", "CONVERSION RATE"])
                 for alternative in alternatives:
                     writer.writerow([alternative.number, alternative.content, alternative.participants, alternative.conversions, alternative.conversion_rate])
@@ -68,6 +74,14 @@ class Export(RequestHandler):
                 writer.writerow(["SIGNIFICANCE TEST RESULTS: %s" % describe_result_in_words(alternatives)])
                 writer.writerow([])
 
+                counting = experiment.conversion_type == ConversionTypes.Counting
+                results = compare_alternatives(
+                        [(alternative.number, alternative.participants, alternative.conversions) for alternative in alternatives],
+                        counting=counting)
+                for comparison in results["comparisons"]:
+                    writer.writerow([describe_comparison(comparison, counting)])
+                writer.writerow([])
+
                 writer.writerow([])
                 writer.writerow([])
 
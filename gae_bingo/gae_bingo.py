@@ -46,8 +46,10 @@ def ab_test(canonical_name,
                     # If we didn't get it, wait a bit and try again
                     time.sleep(0.1)
 
-            # We have the lock, go ahead and create the experiment if still necessary
-            if canonical_name not in BingoCache.get().experiments:
+            # We have the lock, go ahead and create the experiment if still necessary.
+            # Another instance may have created it since this instance's cache was refreshed.
+            bingo_cache.refresh()
+            if canonical_name not in bingo_cache.experiments:
 
                 # Handle multiple conversions for a single experiment by just quietly
                 # creating multiple experiments for each conversion
@@ -1,4 +1,5 @@
 from cache import flush_request_cache, store_if_dirty
+import counter_buffer
 from identity import identity, get_identity_cookie_value, set_identity_cookie_header, delete_identity_cookie_header, using_logged_in_bingo_identity, flush_identity_cache
 
 class GAEBingoWSGIMiddleware(object):
@@ -33,6 +34,7 @@ class GAEBingoWSGIMiddleware(object):
 
         # Persist any changed GAEBingo data to memcache
         store_if_dirty()
+        counter_buffer.flush_if_due()
 
         # We probably don't need to do this b/c we clear the cache at the start of each request,
         # but what the heck, cache bugs are just the worst.
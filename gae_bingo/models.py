@@ -4,6 +4,8 @@ import datetime
 from google.appengine.ext import db
 from google.appengine.api import memcache
 
+import counter_buffer
+
 # If you use a datastore model to uniquely identify each user,
 # let it inherit from this class, like so...
 #
@@ -118,28 +120,72 @@ class _GAEBingoAlternative(db.Model):
     def key_for_self(self):
         return _GAEBingoAlternative.key_for_experiment_name_and_number(self.experiment_name, self.number)
 
+    def participants_key(self):
+        return "%s:participants" % self.key_for_self()
+
+    def conversions_key(self):
+        return "%s:conversions" % self.key_for_self()
+
     def increment_participants(self):
-        # Use a memcache.incr-backed counter to keep track of increments in a scalable fashion.
+        # Use a memcache-backed counter to keep track of increments in a scalable fashion.
         # It's possible that the cached _GAEBingoAlternative entities will fall a bit behind
-        # due to concurrency issues, but the memcache.incr'd version should stay up-to-date and
-        # be persisted.
-        self.participants = long(memcache.incr("%s:participants" % self.key_for_self(), initial_value=self.participants))
+        # due to concurrency issues, but the memcache version should stay up-to-date and
+        # be persisted. Increments are buffered in the instance and sent to memcache in
+        # batches, see counter_buffer.py.
+        counter_buffer.increment(self.participants_key(), initial_value=self.initial_count("participants"))
+        self.participants += 1
 
     def increment_conversions(self):
-        # Use a memcache.incr-backed counter to keep track of increments in a scalable fashion.
-        # It's possible that the cached _GAEBingoAlternative entities will fall a bit behind
-        # due to concurrency issues, but the memcache.incr'd version should stay up-to-date and
-        # be persisted.
-        self.conversions = long(memcache.incr("%s:conversions" % self.key_for_self(), initial_value=self.conversions))
+        # See increment_participants
+        counter_buffer.increment(self.conversions_key(), initial_value=self.initial_count("conversions"))
+        self.conversions += 1
+
+    def initial_count(self, count_name):
+        # What a missing memcache counter should start from before an increment
+        # that is about to be buffered. This alternative's own count already
+        # includes increments buffered earlier, so it's read now, before the
+        # increment, while the datastore is only read if the counter is missing.
+        count = getattr(self, count_name)
+        def initial_value():
+            stored = db.get(self.key())
+            if not stored:
+                return count
+            return max(count, getattr(stored, count_name))
+        return initial_value
+
+    def stored_participants_count(self):
+        return self.stored_counts()[0]
+
+    def stored_conversions_count(self):
+        return self.stored_counts()[1]
+
+    def stored_counts(self):
+        # Cached alternatives keep the counts they had when their experiment was
+        # cached (see BingoCache), so when a memcache counter has been evicted the
+        # last counts persisted to the datastore are a much better starting point.
+        stored = db.get(self.key())
+        if not stored:
+            return self.participants, self.conversions
+        return max(self.participants, stored.participants), max(self.conversions, stored.conversions)
 
     def latest_participants_count(self):
-        return max(self.participants, long(memcache.get("%s:participants" % self.key_for_self()) or 0))
+        counter_buffer.flush()
+        running_count = memcache.get(self.participants_key())
+        if running_count is None:
+            return self.stored_participants_count()
+        return max(self.participants, long(running_count))
 
     def latest_conversions_count(self):
-        return max(self.conversions, long(memcache.get("%s:conversions" % self.key_for_self()) or 0))
+        counter_buffer.flush()
+        running_count = memcache.get(self.conversions_key())
+        if running_count is None:
+            return self.stored_conversions_count()
+        return max(self.conversions, long(running_count))
 
     def reset_counts(self):
-        memcache.delete_multi(["%s:participants" % self.key_for_self(), "%s:conversions" % self.key_for_self()])
+        keys = [self.participants_key(), self.conversions_key()]
+        counter_buffer.discard(keys)
+        memcache.delete_multi(keys)
 
     def load_latest_counts(self):
         # When persisting to datastore, we want to store the most recent value we've got
@@ -0,0 +1,71 @@
+import time
+
+from google.appengine.api import memcache
+
+from .models import _GAEBingoSnapshotLog
+
+# The snapshot history of each experiment is kept in memcache as a list of
+# [time in ms, alternative number, participants, conversions] rows, oldest
+# first, so the dashboard and stats don't have to query _GAEBingoSnapshotLog
+# every time they're shown. BingoCache.log_cache_snapshot appends new rows
+# as it logs them, and a missing history is reloaded from the datastore.
+
+MEMCACHE_KEY = "_gae_bingo_snapshot_series:%s"
+
+# Most recent rows kept per experiment, same as the dashboard always fetched
+MAX_ROWS = 1000
+
+def key_for_experiment_name(experiment_name):
+    return MEMCACHE_KEY % experiment_name
+
+def snapshot_row(snapshot):
+    utc_time = time.mktime(snapshot.time_recorded.timetuple()) * 1000
+    return [utc_time, snapshot.alternative_number, snapshot.participants, snapshot.conversions]
+
+def load_series(experiment):
+    query = _GAEBingoSnapshotLog.all().ancestor(experiment)
+    query.order('-time_recorded')
+    snapshots = query.fetch(MAX_ROWS)
+
+    rows = [snapshot_row(snapshot) for snapshot in snapshots]
+    rows.reverse()
+    return rows
+
+def get_series(experiments):
+    """ Returns {experiment name: snapshot rows} for all the experiments with
+    one memcache round trip, loading any that are missing. """
+    keys = dict((experiment.name, key_for_experiment_name(experiment.name)) for experiment in experiments)
+    cached = memcache.get_multi(keys.values())
+
+    series = {}
+    missing = {}
+    for experiment in experiments:
+        key = keys[experiment.name]
+        if key in cached:
+            series[experiment.name] = cached[key]
+        else:
+            series[experiment.name] = missing[key] = load_series(experiment)
+
+    if missing:
+        memcache.set_multi(missing)
+
+    return series
+
+def append_snapshots(snapshots_by_experiment_name):
+    """ Adds newly logged snapshots to the cached histories. Histories that
+    aren't cached are left alone, they'll be loaded with the new snapshots
+    the next time they're needed. """
+    keys = dict((key_for_experiment_name(name), name) for name in snapshots_by_experiment_name)
+    cached = memcache.get_multi(keys.keys())
+
+    for key, rows in cached.iteritems():
+        rows.extend([snapshot_row(snapshot) for snapshot in snapshots_by_experiment_name[keys[key]]])
+        if len(rows) > MAX_ROWS:
+            del rows[:len(rows) - MAX_ROWS]
+
+    if cached:
+        memcache.set_multi(cached)
+
+def history(rows):
+    """ (number, participants, conversions) observations for gae_bingo.stats """
+    return [(number, participants, conversions) for utc_time, number, participants, conversions in rows]
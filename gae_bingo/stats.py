@@ -1,4 +1,5 @@
 import logging
+import math
 
 # This file in particular is almost a direct port from Patrick McKenzie's A/Bingo's abingo/lib/abingo/statistics.rb
 
@@ -99,3 +100,223 @@ def describe_result_in_words(alternatives):
 
     return words
 
+
+# The functions below compare any number of alternatives at once. They take
+# alternatives as (number, participants, conversions) triples so they can be
+# run over live counts or logged snapshots alike, and return plain dicts that
+# jsonify can send straight to the dashboard.
+
+# Variance of the prior on the true difference in conversion rates used by the
+# sequential test below. Roughly, differences around sqrt(MIXTURE_VARIANCE) are
+# the ones it's most sensitive to.
+MIXTURE_VARIANCE = 0.0001
+
+def erfc(x):
+    """ Complementary error function, with fractional error below 1.2e-7.
+    Numerical Recipes' Chebyshev fit, since python 2.5's math has no erfc.
+    """
+    z = abs(x)
+    t = 1.0 / (1.0 + 0.5 * z)
+    r = t * math.exp(-z * z - 1.26551223 + t * (1.00002368 + t * (0.37409196 +
+            t * (0.09678418 + t * (-0.18628806 + t * (0.27886807 +
+            t * (-1.13520398 + t * (1.48851587 + t * (-0.82215223 +
+            t * 0.17087277)))))))))
+    if x >= 0:
+        return r
+    return 2.0 - r
+
+def two_sided_p_value(z):
+    return min(1.0, erfc(abs(z) / math.sqrt(2.0)))
+
+def z_for_confidence(confidence):
+    """ The z such that a normal variable is within +-z with probability
+    confidence, e.g. 1.96 for 0.95 """
+    low, high = 0.0, 40.0
+    for i in range(60):
+        mid = (low + high) / 2.0
+        if two_sided_p_value(mid) > 1.0 - confidence:
+            low = mid
+        else:
+            high = mid
+    return (low + high) / 2.0
+
+def rate_and_variance(participants, conversions, counting=False):
+    """ Conversion rate and the variance of its estimate. Counting
+    conversions are treated as Poisson, binary ones as Bernoulli. """
+    if participants <= 0:
+        return 0.0, 0.0
+
+    rate = float(conversions) / participants
+    if counting:
+        return rate, rate / participants
+    return rate, max(0.0, rate * (1 - rate)) / participants
+
+def confidence_interval(participants, conversions, counting=False, confidence=0.95):
+    """ [low, high] bounds on the true conversion rate. Binary conversions use
+    the Wilson score interval, which behaves at rates near 0 or 1. """
+    if participants <= 0:
+        return [0.0, 0.0]
+
+    z = z_for_confidence(confidence)
+
+    if counting:
+        rate, variance = rate_and_variance(participants, conversions, counting)
+        margin = z * math.sqrt(variance)
+        return [max(0.0, rate - margin), rate + margin]
+
+    n = float(participants)
+    rate = conversions / n
+    center = (rate + z * z / (2 * n)) / (1 + z * z / n)
+    margin = (z / (1 + z * z / n)) * math.sqrt(
+            max(0.0, rate * (1 - rate)) / n + z * z / (4 * n * n))
+    return [max(0.0, center - margin), min(1.0, center + margin)]
+
+def comparison_pairs(numbers, control_number=None):
+    """ Every pair of alternative numbers, or the control against each of the
+    others if control_number is given. """
+    if control_number is not None:
+        return [(control_number, number) for number in numbers if number != control_number]
+
+    pairs = []
+    for i in range(len(numbers)):
+        for j in range(i + 1, len(numbers)):
+            pairs.append((numbers[i], numbers[j]))
+    return pairs
+
+def mixture_likelihood_ratio(difference, variance, mixture_variance=MIXTURE_VARIANCE):
+    """ Likelihood ratio of the mixture sequential probability ratio test for a
+    normally distributed difference with the given variance. """
+    if variance <= 0:
+        return 1.0
+
+    total = variance + mixture_variance
+    exponent = mixture_variance * difference * difference / (2 * variance * total)
+    # Anything this large is conclusive, and exp() would overflow
+    exponent = min(exponent, 700.0)
+    return math.sqrt(variance / total) * math.exp(exponent)
+
+def always_valid_p_values(history, pairs, counting=False, mixture_variance=MIXTURE_VARIANCE):
+    """ Sequential p-values for each pair, which stay valid no matter how often
+    the results are looked at or when the experiment is stopped.
+
+    history is a list of (number, participants, conversions) observations,
+    oldest first, e.g. rows from gae_bingo.snapshots. The p-value after each
+    observation is the smallest 1 / likelihood ratio seen so far.
+
+    Returns {(number, number): p-value}.
+    """
+    p_values = dict((pair, 1.0) for pair in pairs)
+
+    pairs_by_number = {}
+    for pair in pairs:
+        for number in pair:
+            pairs_by_number.setdefault(number, []).append(pair)
+
+    estimates = {}
+    for number, participants, conversions in history:
+        if number not in pairs_by_number:
+            continue
+
+        estimates[number] = rate_and_variance(participants, conversions, counting)
+
+        # Only the comparisons involving this alternative have changed
+        for pair in pairs_by_number[number]:
+            a, b = pair
+            if a not in estimates or b not in estimates:
+                continue
+
+            rate_a, variance_a = estimates[a]
+            rate_b, variance_b = estimates[b]
+            ratio = mixture_likelihood_ratio(rate_b - rate_a, variance_a + variance_b, mixture_variance)
+            if ratio > 1.0:
+                p_values[pair] = min(p_values[pair], 1.0 / ratio)
+
+    return p_values
+
+def compare_alternatives(counts, control_number=None, counting=False, confidence=0.95, history=None):
+    """ Tests all pairs of alternatives, or the control against the rest, in one pass.
+
+    counts is a list of (number, participants, conversions). If the history of
+    the counts is given (see always_valid_p_values), each comparison also gets
+    a sequential p-value, with the current counts as the latest observation.
+
+    Returns {"alternatives": [...], "comparisons": [...]}. The comparisons'
+    adjusted_p_value is Bonferroni corrected for the number of comparisons,
+    and significant is whether that's below 1 - confidence.
+    """
+    z = z_for_confidence(confidence)
+
+    summaries = []
+    estimates = {}
+    for number, participants, conversions in counts:
+        rate, variance = rate_and_variance(participants, conversions, counting)
+        estimates[number] = (rate, variance)
+        summaries.append({
+            "number": number,
+            "participants": participants,
+            "conversions": conversions,
+            "conversion_rate": rate,
+            "confidence_interval": confidence_interval(participants, conversions, counting, confidence),
+        })
+
+    pairs = comparison_pairs([summary["number"] for summary in summaries], control_number)
+
+    sequential_p_values = None
+    if history is not None:
+        sequential_p_values = always_valid_p_values(list(history) + list(counts), pairs, counting)
+
+    comparisons = []
+    for a, b in pairs:
+        rate_a, variance_a = estimates[a]
+        rate_b, variance_b = estimates[b]
+
+        difference = rate_b - rate_a
+        standard_error = math.sqrt(variance_a + variance_b)
+
+        if standard_error > 0:
+            z_score = difference / standard_error
+        else:
+            z_score = 0.0
+
+        p = two_sided_p_value(z_score)
+        adjusted_p = min(1.0, p * len(pairs))
+
+        comparison = {
+            "a": a,
+            "b": b,
+            "difference": difference,
+            "confidence_interval": [difference - z * standard_error, difference + z * standard_error],
+            "z_score": z_score,
+            "p_value": p,
+            "adjusted_p_value": adjusted_p,
+            "significant": adjusted_p < 1.0 - confidence,
+        }
+
+        if sequential_p_values is not None:
+            comparison["sequential_p_value"] = sequential_p_values[(a, b)]
+
+        comparisons.append(comparison)
+
+    return {"alternatives": summaries, "comparisons": comparisons}
+
+def describe_comparison(comparison, counting=False, confidence=0.95):
+    """ One line summary of a comparison from compare_alternatives """
+    if counting:
+        scale, unit = 1.0, ""
+    else:
+        scale, unit = 100.0, "%"
+
+    low, high = comparison["confidence_interval"]
+    words = "Alternative #%s vs. #%s: %+.2f%s (%d%% confidence interval %+.2f%s to %+.2f%s), p = %.3f" % (
+            comparison["b"], comparison["a"],
+            comparison["difference"] * scale, unit,
+            round(confidence * 100), low * scale, unit, high * scale, unit,
+            comparison["adjusted_p_value"])
+
+    if "sequential_p_value" in comparison:
+        words += ", always-valid p = %.3f" % comparison["sequential_p_value"]
+
+    if comparison["significant"]:
+        words += ", significant"
+
+    return words
@@ -0,0 +1,121 @@
+import math
+import unittest
+
+from gae_bingo import stats
+
+
+class StatsTest(unittest.TestCase):
+    def test_two_sided_p_value(self):
+        self.assertAlmostEqual(1.0, stats.two_sided_p_value(0), 6)
+        self.assertAlmostEqual(0.05, stats.two_sided_p_value(1.959964), 6)
+        self.assertAlmostEqual(0.05, stats.two_sided_p_value(-1.959964), 6)
+        self.assertAlmostEqual(0.001, stats.two_sided_p_value(3.290527), 6)
+
+    def test_z_for_confidence(self):
+        self.assertAlmostEqual(1.959964, stats.z_for_confidence(0.95), 5)
+        self.assertAlmostEqual(2.575829, stats.z_for_confidence(0.99), 5)
+
+    def test_confidence_interval(self):
+        low, high = stats.confidence_interval(100, 50)
+        self.assertTrue(low < 0.5 < high)
+        self.assertAlmostEqual(0.404, low, 3)
+        self.assertAlmostEqual(0.596, high, 3)
+
+        # Wilson intervals stay inside [0, 1] and aren't empty at the edges
+        low, high = stats.confidence_interval(10, 0)
+        self.assertEqual(0.0, low)
+        self.assertTrue(high > 0)
+
+        self.assertEqual([0.0, 0.0], stats.confidence_interval(0, 0))
+
+    def test_pairs(self):
+        self.assertEqual([(0, 1), (0, 2), (1, 2)],
+                         stats.comparison_pairs([0, 1, 2]))
+        self.assertEqual([(1, 0), (1, 2)],
+                         stats.comparison_pairs([0, 1, 2], control_number=1))
+
+    def test_matches_pairwise_zscore(self):
+        class Alternative(object):
+            def __init__(self, participants, conversions):
+                self.participants = participants
+                self.conversions = conversions
+                self.conversion_rate = float(conversions) / participants
+
+        results = stats.compare_alternatives([(0, 1000, 100), (1, 1200, 150)])
+        comparison = results["comparisons"][0]
+
+        z = stats.zscore([Alternative(1000, 100), Alternative(1200, 150)])
+        self.assertAlmostEqual(-z, comparison["z_score"], 9)
+        self.assertAlmostEqual(0.025, comparison["difference"], 9)
+        self.assertEqual(comparison["p_value"], comparison["adjusted_p_value"])
+
+    def test_all_pairs(self):
+        counts = [(0, 1000, 100), (1, 1000, 100), (2, 1000, 200)]
+        results = stats.compare_alternatives(counts)
+
+        self.assertEqual(3, len(results["alternatives"]))
+        comparisons = dict(((c["a"], c["b"]), c)
+                           for c in results["comparisons"])
+        self.assertEqual(3, len(comparisons))
+
+        self.assertEqual(0, comparisons[(0, 1)]["z_score"])
+        self.assertFalse(comparisons[(0, 1)]["significant"])
+        self.assertTrue(comparisons[(0, 2)]["significant"])
+        self.assertTrue(comparisons[(1, 2)]["significant"])
+
+        # Bonferroni correction for the three comparisons
+        self.assertAlmostEqual(
+            min(1.0, 3 * comparisons[(0, 2)]["p_value"]),
+            comparisons[(0, 2)]["adjusted_p_value"], 12)
+
+        low, high = comparisons[(0, 2)]["confidence_interval"]
+        self.assertTrue(low < 0.1 < high)
+
+        self.assertEqual(2, len(stats.compare_alternatives(
+            counts, control_number=0)["comparisons"]))
+
+    def test_counting_conversions(self):
+        results = stats.compare_alternatives(
+            [(0, 100, 300), (1, 100, 360)], counting=True)
+        comparison = results["comparisons"][0]
+
+        self.assertAlmostEqual(0.6, comparison["difference"], 9)
+        self.assertAlmostEqual(0.6 / math.sqrt(0.03 + 0.036),
+                               comparison["z_score"], 9)
+
+    def test_always_valid_p_values(self):
+        pairs = [(0, 1)]
+
+        # No difference: the sequential p-value stays high
+        history = []
+        for n in range(100, 10001, 100):
+            history.append((0, n, n / 10))
+            history.append((1, n, n / 10))
+        p_values = stats.always_valid_p_values(history, pairs)
+        self.assertEqual(1.0, p_values[(0, 1)])
+
+        # A clear difference is found, and stays found
+        history = []
+        for n in range(100, 10001, 100):
+            history.append((0, n, n / 10))
+            history.append((1, n, n / 5))
+        p_values = stats.always_valid_p_values(history, pairs)
+        self.assertTrue(p_values[(0, 1)] < 0.001)
+
+        history.append((1, 10000, 1000))
+        self.assertEqual(p_values, stats.always_valid_p_values(history, pairs))
+
+    def test_sequential_p_value_is_conservative(self):
+        results = stats.compare_alternatives(
+            [(0, 1000, 100), (1, 1000, 130)], history=[])
+        comparison = results["comparisons"][0]
+        self.assertTrue(comparison["p_value"] < 0.05)
+        self.assertTrue(comparison["sequential_p_value"] >=
+                        comparison["p_value"])
+
+    def test_describe_comparison(self):
+        results = stats.compare_alternatives(
+            [(0, 1000, 100), (1, 1000, 200)], history=[])
+        words = stats.describe_comparison(results["comparisons"][0])
+        self.assertTrue(words.startswith("Alternative #1 vs. #0: +10.00%"))
+        self.assertTrue("significant" in words)
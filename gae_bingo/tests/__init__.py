@@ -11,7 +11,7 @@ from google.appengine.ext.webapp import RequestHandler
 from google.appengine.api import memcache
 
 from gae_bingo.gae_bingo import ab_test, bingo, choose_alternative, create_redirect_url
-from gae_bingo.cache import BingoCache, BingoIdentityCache
+from gae_bingo.cache import BingoCache, BingoIdentityCache, flush_instance_cache
 from gae_bingo.config import can_control_experiments
 from gae_bingo.api import ControlExperiment
 from gae_bingo.models import ConversionTypes
@@ -145,9 +145,11 @@ class RunStep(RequestHandler):
         return True
 
     def flush_bingo_memcache(self):
-        memcache.delete(BingoCache.MEMCACHE_KEY)
+        memcache.delete_multi([BingoCache.MEMCACHE_KEY, BingoCache.VERSION_KEY])
+        flush_instance_cache()
         return True
 
     def flush_all_memcache(self):
         memcache.flush_all()
+        flush_instance_cache()
         return True
@@ -37,3 +37,10 @@ class ProfilerConfigDevelopment:
     @staticmethod
     def should_profile(environ):
         return users.is_current_user_admin()
+
+# Customize get_cache_stats to return a list of per-request cache counter
+# dicts (see cache_stats.request_stats) to show in the "Caches" section, or
+# None to hide it. This runs once per profiled request.
+def get_cache_stats():
+    import cache_stats
+    return cache_stats.request_stats()
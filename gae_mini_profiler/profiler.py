@@ -86,7 +86,7 @@ class RequestStats(object):
 
     serialized_properties = ["request_id", "url", "url_short", "s_dt",
                              "profiler_results", "appstats_results", "simple_timing",
-                             "temporary_redirect", "logs"]
+                             "temporary_redirect", "logs", "cache_stats"]
 
     def __init__(self, request_id, environ, middleware):
         self.request_id = request_id
@@ -105,6 +105,7 @@ class RequestStats(object):
         self.profiler_results = RequestStats.calc_profiler_results(middleware)
         self.appstats_results = RequestStats.calc_appstats_results(middleware)
         self.logs = middleware.logs
+        self.cache_stats = RequestStats.calc_cache_stats()
 
         self.temporary_redirect = middleware.temporary_redirect
         self.disabled = False
@@ -200,6 +201,14 @@ class RequestStats(object):
 
         return results
 
+    @staticmethod
+    def calc_cache_stats():
+        try:
+            return gae_mini_profiler.config.get_cache_stats()
+        except Exception, e:
+            logging.warning("Collecting cache stats failed.\n%s", e)
+            return None
+
     @staticmethod
     def calc_appstats_results(middleware):
         if middleware.recorder:
@@ -105,6 +105,8 @@ var GaeMiniProfiler = {
                 .click(function() { GaeMiniProfiler.toggleSection(this, ".profiler-details"); return false; }).end()
             .find(".rpc-link")
                 .click(function() { GaeMiniProfiler.toggleSection(this, ".rpc-details"); return false; }).end()
+            .find(".cache-link")
+                .click(function() { GaeMiniProfiler.toggleSection(this, ".cache-details"); return false; }).end()
             .find(".logs-link")
                 .click(function() { GaeMiniProfiler.toggleSection(this, ".logs-details"); return false; }).end()
             .find(".callers-link")
@@ -149,12 +149,16 @@ class GoalList(object):
     @staticmethod
     def get_current_goals(user_data):
         if user_data and user_data.has_current_goals:
-            query = GoalList.get_goals_query(user_data)
-            query.filter('completed = ', False)
-            return query.fetch(100)
+            return GoalList.get_current_goals_query(user_data).fetch(100)
         else:
             return []
 
+    @staticmethod
+    def get_current_goals_query(user_data):
+        query = GoalList.get_goals_query(user_data)
+        query.filter('completed = ', False)
+        return query
+
     @staticmethod
     def get_all_goals(user_data):
         if user_data:
@@ -196,17 +200,27 @@ class GoalList(object):
             return False
 
         goals = GoalList.get_current_goals(user_data)
+        changes = GoalList.apply_activity(user_data, goals, activity_fn)
+        if changes:
+            user_changes = []
+            if not user_data.has_current_goals:
+                user_changes = [user_data]
+            db.put(changes + user_changes)
+        return changes
+
+    @staticmethod
+    def apply_activity(user_data, goals, activity_fn):
+        """ Like update_goals, on already fetched current goals, leaving the
+        changed goals, and user_data if it no longer has current goals, for
+        the caller to put. """
         changes = []
         for goal in goals:
             if activity_fn(goal):
                 changes.append(goal)
         if changes:
             # check to see if all goals are closed
-            user_changes = []
             if all([g.completed for g in goals]):
                 user_data.has_current_goals = False
-                user_changes = [user_data]
-            db.put(changes + user_changes)
         return changes
 
     @staticmethod
@@ -227,6 +227,10 @@ var ClassProfile = {
             '/api/v1/user/students/progressreport': ClassProfile.renderStudentProgressReport,
             '/api/v1/user/students/progress/summary': this.ProgressSummaryView.render
         };
+        // Extra query params the API callbacks above expect
+        var apiParamsTable = {
+            '/api/v1/user/students/progressreport': {format: 'matrix'}
+        };
         if (!href) return;
 
         if (this.fLoadingGraph) {
@@ -239,15 +243,17 @@ var ClassProfile = {
         this.fLoadedGraph = true;
 
         var apiCallback = null;
+        var apiParams = {};
         for (var uri in apiCallbacksTable) {
             if (href.indexOf(uri) > -1) {
                 apiCallback = apiCallbacksTable[uri];
+                apiParams = apiParamsTable[uri] || {};
             }
         }
         $.ajax({
             type: "GET",
             url: Timezone.append_tz_offset_query_param(href),
-            data: {},
+            data: apiParams,
             dataType: apiCallback ? 'json' : 'html',
             success: function(data){
                 ClassProfile.finishLoadGraph(data, href, fNoHistoryEntry, apiCallback);
@@ -392,16 +398,49 @@ var ClassProfile = {
         $('#energy-points .energy-points-badge').text(energyPoints);
     },
 
+    /**
+     * Expands a student's sparse row of [exercise index, status, progress,
+     * total done, last done, last done ago] cells from the progress report
+     * API into one exercise per column.
+     */
+    expandProgressReportRow: function(data, columns, student_row) {
+        var exercises = [];
+        $.each(data.exercise_names, function(idx, exercise) {
+            exercises.push({"name": exercise.name, "status": ""});
+        });
+
+        $.each(student_row.cells, function(idx, cell) {
+            var column = columns[cell[0]];
+            if (column === undefined) {
+                return;
+            }
+            exercises[column] = {
+                "status": data.statuses[cell[1]],
+                "progress": cell[2],
+                "total_done": cell[3],
+                "last_done": cell[4],
+                "last_done_ago": cell[5]
+            };
+        });
+
+        student_row.exercises = exercises;
+        delete student_row.cells;
+    },
+
     renderStudentProgressReport: function(data, href) {
         ClassProfile.updateStudentInfo(data.exercise_data.length, data.c_points);
 
+        // Exercise index in the report -> column
+        var columns = {};
         $.each(data.exercise_names, function(idx, exercise) {
             exercise.display_name_lower = exercise.display_name.toLowerCase();
             exercise.idx = idx;
+            columns[exercise.index] = idx;
         });
 
         data.exercise_list = [];
         $.each(data.exercise_data, function(idx, student_row) {
+            ClassProfile.expandProgressReportRow(data, columns, student_row);
             data.exercise_list.push(student_row);
         });
         data.exercise_list.sort(function(a, b) { if (a.nickname < b.nickname) return -1; else if (b.nickname < a.nickname) return 1; return 0; });
@@ -4,6 +4,7 @@ from __future__ import with_statement
 import datetime
 import logging
 import pickle
+import time
 import zlib
 import os
 
@@ -13,6 +14,7 @@ from google.appengine.runtime.apiproxy_errors import RequestTooLargeError
 from google.appengine.api.datastore_errors import BadRequestError
                                             
 from app import App
+import cache_stats
 import request_cache
 
 if App.is_dev_server:
@@ -80,6 +82,20 @@ else:
 #   ... do lots of long-running work...
 #   return result_for_cache
 #
+# Cache many results at once, one key per argument. The target is called with
+# a list of arguments and must return a list of results in the same order.
+# Only the arguments whose keys missed in every layer are passed to the 
+# target, and all the layers are probed and back-filled with a single
+# get_multi/set_multi each instead of one round trip per argument:
+#
+# @layer_cache.cache_multi_with_key_fxn(
+#     lambda user_data: "student_report_%s" % user_data.key())
+# def calculate_student_reports(user_data_list):
+#   ... do lots of long-running work...
+#   return [report_for_user_data, ...]
+#
+# reports = calculate_student_reports(students)
+#
 # _____Manually busting the cache:_____
 #
 # When you call your cached function, just pass a special "bust_cache"
@@ -121,6 +137,18 @@ else:
 # compression and decompression time 
 # @layer_cache.cache(... compress_chunks=False)
 #
+# _____Stampede protection:_____
+#
+# When a hot key expires, every instance that misses at the same moment would
+# otherwise re-run the (expensive) target and race to set the result. Passing
+# stale_while_revalidate keeps a second copy of the result around for that
+# many seconds past its expiration and hands out a memcache lease, so only
+# one caller recomputes while everybody else is served the stale copy:
+# @layer_cache.cache(... expiration=60, stale_while_revalidate=60 * 5)
+#
+# The lease is held for at most DEFAULT_RECOMPUTE_LEASE_SECONDS, after which
+# another caller is allowed to try recomputing (in case the first one died).
+#
 # _____Disabling:_____
 #
 # You can disable layer_cache for the rest of the request by calling:
@@ -142,6 +170,10 @@ CHUNK_GENERATION_LENGTH = 16
 # Expire after 25 days by default
 DEFAULT_LAYER_CACHE_EXPIRATION_SECONDS = 60 * 60 * 24 * 25 
 
+# How long a single caller may hold the recompute lease for a key when
+# stale_while_revalidate is in use
+DEFAULT_RECOMPUTE_LEASE_SECONDS = 30
+
 class Layers:
     Datastore = 1
     Memcache = 2
@@ -161,14 +193,15 @@ def cache(
         layer = Layers.Memcache | Layers.InAppMemory,
         persist_across_app_versions = False,
         use_chunks = False,
-        compress_chunks = True):
+        compress_chunks = True,
+        stale_while_revalidate = 0):
     def decorator(target):
         key = "__layer_cache_%s.%s__" % (target.__module__, target.__name__)
         def wrapper(*args, **kwargs):
             return layer_cache_check_set_return(target, 
                 lambda *args, **kwargs: key, expiration, layer,
                     persist_across_app_versions, None, use_chunks, 
-                    compress_chunks, *args, **kwargs)
+                    compress_chunks, stale_while_revalidate, *args, **kwargs)
         return wrapper
     return decorator
 
@@ -179,132 +212,168 @@ def cache_with_key_fxn(
         persist_across_app_versions = False,
         permanent_key_fxn = None,
         use_chunks = False,
-        compress_chunks = True):
+        compress_chunks = True,
+        stale_while_revalidate = 0):
     def decorator(target):
         def wrapper(*args, **kwargs):
             return layer_cache_check_set_return(target, key_fxn, expiration, 
                 layer, persist_across_app_versions, permanent_key_fxn, 
-                use_chunks, compress_chunks, *args, **kwargs)
+                use_chunks, compress_chunks, stale_while_revalidate, 
+                *args, **kwargs)
         return wrapper
     return decorator
 
-def layer_cache_check_set_return(
-        target,
+def cache_multi_with_key_fxn(
         key_fxn,
         expiration = DEFAULT_LAYER_CACHE_EXPIRATION_SECONDS,
         layer = Layers.Memcache | Layers.InAppMemory,
         persist_across_app_versions = False,
-        permanent_key_fxn = None,
         use_chunks = False,
-        compress_chunks = True,
-        *args,
-        **kwargs):
+        compress_chunks = True):
+    def decorator(target):
+        def wrapper(arg_list, bust_cache = False):
+            return layer_cache_multi_check_set_return(target, key_fxn,
+                arg_list, expiration, layer, persist_across_app_versions,
+                use_chunks, compress_chunks, bust_cache)
+        return wrapper
+    return decorator
 
-    def get_cached_result(key, namespace, expiration, layer):
+def get_cached_result(key, namespace, expiration, layer, stats_name=None):
 
-        if layer & Layers.InAppMemory:
-            result = cachepy.get(key)
-            if result is not None:
-                return result
+    if stats_name is None:
+        stats_name = cache_stats.key_prefix(key)
 
-        if layer & Layers.Memcache:
-            maybe_chunked_result = memcache.get(key, namespace=namespace)
-            if maybe_chunked_result is not None:
-                if isinstance(maybe_chunked_result, ChunkedResult):
-                    result = maybe_chunked_result.get_result(memcache, 
-                                                            namespace=namespace)
-                else:
-                    result = maybe_chunked_result
+    if layer & Layers.InAppMemory:
+        result = cachepy.get(key)
+        if result is not None:
+            cache_stats.record_hit(stats_name, cache_stats.HITS_INAPP)
+            return result
 
-                # Found in memcache, fill upward layers
-                if layer & Layers.InAppMemory:
-                    cachepy.set(key, result, expiry=expiration)
+    if layer & Layers.Memcache:
+        maybe_chunked_result = memcache.get(key, namespace=namespace)
+        if maybe_chunked_result is not None:
+            cache_stats.record_hit(stats_name, cache_stats.HITS_MEMCACHE,
+                isinstance(maybe_chunked_result, ChunkedResult))
+            if isinstance(maybe_chunked_result, ChunkedResult):
+                result = maybe_chunked_result.get_result(memcache, 
+                                                        namespace=namespace)
+            else:
+                result = maybe_chunked_result
 
-                return result
+            # Found in memcache, fill upward layers
+            if layer & Layers.InAppMemory:
+                cachepy.set(key, result, expiry=expiration,
+                            size=cachepy_size(maybe_chunked_result))
 
-        if layer & Layers.Datastore:
-            maybe_chunked_result = KeyValueCache.get(key, namespace=namespace)
-            if maybe_chunked_result is not None:
-                # Found in datastore. Unchunk results if needed, and fill upward 
-                # layers
-                if isinstance(maybe_chunked_result, ChunkedResult):
-                    result = maybe_chunked_result.get_result(KeyValueCache, 
-                                                            namespace=namespace)
-                    
-                    if layer & Layers.Memcache:
-                        # Since the result in the datastore needed to be chunked
-                        # we will need to use ChunkedResult for memcache as well
-                        ChunkedResult.set(key, result, expiration, namespace, 
-                                          cache_class=memcache)
-                else:
-                    result = maybe_chunked_result
-                    if layer & Layers.Memcache:
-                        # Since the datastore wasn't using a chunked result
-                        # This memcache.set should succeed as well.
-                        memcache.set(key, result, time=expiration, 
-                                     namespace=namespace)
+            return result
 
-                if layer & Layers.InAppMemory:
-                    cachepy.set(key, result, expiry=expiration)
+    if layer & Layers.Datastore:
+        maybe_chunked_result = KeyValueCache.get(key, namespace=namespace)
+        if maybe_chunked_result is not None:
+            cache_stats.record_hit(stats_name, cache_stats.HITS_DATASTORE,
+                isinstance(maybe_chunked_result, ChunkedResult))
+            # Found in datastore. Unchunk results if needed, and fill upward 
+            # layers
+            if isinstance(maybe_chunked_result, ChunkedResult):
+                result = maybe_chunked_result.get_result(KeyValueCache, 
+                                                        namespace=namespace)
                 
-                return result
+                if layer & Layers.Memcache:
+                    # Since the result in the datastore needed to be chunked
+                    # we will need to use ChunkedResult for memcache as well
+                    ChunkedResult.set(key, result, expiration, namespace, 
+                                      cache_class=memcache)
+            else:
+                result = maybe_chunked_result
+                if layer & Layers.Memcache:
+                    # Since the datastore wasn't using a chunked result
+                    # This memcache.set should succeed as well.
+                    memcache.set(key, result, time=expiration, 
+                                 namespace=namespace)
+
+            if layer & Layers.InAppMemory:
+                cachepy.set(key, result, expiry=expiration,
+                            size=cachepy_size(maybe_chunked_result))
+            
+            return result
+    
+def cachepy_size(maybe_chunked_result):
+    ''' The size to tell cachepy a value read from memcache or the datastore
+    takes up: the length of its pickle if it was read as a ChunkedResult,
+    otherwise None for cachepy to estimate it rather than pickle it again.
+    '''
+    if isinstance(maybe_chunked_result, ChunkedResult):
+        return len(maybe_chunked_result.data)
+    return None
+
+def set_cached_result(key, namespace, expiration, layer, result, 
+                      use_chunks, compress_chunks):
+    # Cache the result
+    if layer & Layers.InAppMemory:
+        cachepy.set(key, result, expiry=expiration)
+
+    if layer & Layers.Memcache:
         
-    def set_cached_result(key, namespace, expiration, layer, result, 
-                          use_chunks, compress_chunks):
-        # Cache the result
-        if layer & Layers.InAppMemory:
-            cachepy.set(key, result, expiry=expiration)
+        if not use_chunks:
 
-        if layer & Layers.Memcache:
-            
-            if not use_chunks:
-
-                try:
-                    if not memcache.set(key, result, time=expiration, 
-                                        namespace=namespace):
-                        logging.error("Memcache set failed for %s" % key)
-                except ValueError, e:
-                    if str(e).startswith("Values may not be more than"):
-                        # The result was too big to store in memcache.  Going  
-                        # to chunk it and try again
-                        ChunkedResult.set(key, result, expiration, namespace, 
-                                          compress=compress_chunks,
-                                          cache_class=memcache)
-                    else: 
-                        raise
+            try:
+                if not memcache.set(key, result, time=expiration, 
+                                    namespace=namespace):
+                    logging.error("Memcache set failed for %s" % key)
+            except ValueError, e:
+                if str(e).startswith("Values may not be more than"):
+                    # The result was too big to store in memcache.  Going  
+                    # to chunk it and try again
+                    ChunkedResult.set(key, result, expiration, namespace, 
+                                      compress=compress_chunks,
+                                      cache_class=memcache)
+                else: 
+                    raise
+
+        else:
+            # use_chunks parameter was explicitly set, not going to even 
+            # bother trying to put it in memcache directly
+            ChunkedResult.set(key, result, expiration, namespace, 
+                              compress=compress_chunks,
+                              cache_class=memcache)
+        
+    if layer & Layers.Datastore:
+        if not use_chunks:
+            try:
+                KeyValueCache.set(key, result, time=expiration, 
+                                  namespace=namespace)
+            except (RequestTooLargeError, BadRequestError), e:
+                if (isinstance(e, RequestTooLargeError) or 
+                    str(e).startswith("string property value is too long")):
+
+                    # The result was too big to store in datastore. Going to  
+                    # chunk it and try again
+                    ChunkedResult.set(key, result, time=expiration, 
+                                      namespace=namespace,
+                                      compress=compress_chunks, 
+                                      cache_class=KeyValueCache)  
+                else:
+                    raise
+        else:
+            # use_chunks parameter was explicitly set, not going to even 
+            # bother trying to put it in KeyValueCache directly
+            ChunkedResult.set(key, result, time=expiration, 
+                              namespace=namespace,
+                              compress=compress_chunks, 
+                              cache_class=KeyValueCache)
 
-            else:
-                # use_chunks parameter was explicitly set, not going to even 
-                # bother trying to put it in memcache directly
-                ChunkedResult.set(key, result, expiration, namespace, 
-                                  compress=compress_chunks,
-                                  cache_class=memcache)
-            
-        if layer & Layers.Datastore:
-            if not use_chunks:
-                try:
-                    KeyValueCache.set(key, result, time=expiration, 
-                                      namespace=namespace)
-                except (RequestTooLargeError, BadRequestError), e:
-                    if (isinstance(e, RequestTooLargeError) or 
-                        str(e).startswith("string property value is too long")):
-
-                        # The result was too big to store in datastore. Going to  
-                        # chunk it and try again
-                        ChunkedResult.set(key, result, time=expiration, 
-                                          namespace=namespace,
-                                          compress=compress_chunks, 
-                                          cache_class=KeyValueCache)  
-                    else:
-                        raise
-            else:
-                # use_chunks parameter was explicitly set, not going to even 
-                # bother trying to put it in KeyValueCache directly
-                ChunkedResult.set(key, result, time=expiration, 
-                                  namespace=namespace,
-                                  compress=compress_chunks, 
-                                  cache_class=KeyValueCache)
-                          
+def layer_cache_check_set_return(
+        target,
+        key_fxn,
+        expiration = DEFAULT_LAYER_CACHE_EXPIRATION_SECONDS,
+        layer = Layers.Memcache | Layers.InAppMemory,
+        persist_across_app_versions = False,
+        permanent_key_fxn = None,
+        use_chunks = False,
+        compress_chunks = True,
+        stale_while_revalidate = 0,
+        *args,
+        **kwargs):
 
     bust_cache = False
     if "bust_cache" in kwargs:
@@ -324,12 +393,30 @@ def layer_cache_check_set_return(
     if persist_across_app_versions:
         namespace = None
 
+    # stale copies only make sense for values that actually expire
+    use_stale = stale_while_revalidate > 0 and expiration > 0
+    lease_key = None
+    stats_name = cache_stats.target_name(target)
+
     if not bust_cache:
 
-        result = get_cached_result(key, namespace, expiration, layer)
+        result = get_cached_result(key, namespace, expiration, layer, 
+                                   stats_name)
         if result is not None:
             return result
 
+        if use_stale:
+            lease_key = acquire_recompute_lease(key, namespace)
+            if lease_key is None:
+                # Somebody else is already recomputing this key. Hand out the
+                # stale copy if we have one, otherwise fall through and
+                # compute it ourselves rather than block the request.
+                result = get_cached_result(stale_key(key), namespace,
+                    expiration + stale_while_revalidate, layer, stats_name)
+                if result is not None:
+                    return result
+
+    start_time = time.time()
     try:
         result = target(*args, **kwargs)
 
@@ -349,16 +436,21 @@ def layer_cache_check_set_return(
                 #retreived item from permanent cache - save it to the more temporary cache and then return it
                 set_cached_result(key, namespace, expiration, layer, result, 
                                   use_chunks, compress_chunks)
+                release_recompute_lease(lease_key, namespace)
                 return result
 
         # could not retrieve item from a permanent cache, raise the error on up
         logging.exception(e)
+        release_recompute_lease(lease_key, namespace)
         raise
 
     if isinstance(result, UncachedResult):
         # Don't cache this result, just return it
         result = result.result
+        cache_stats.record_miss(stats_name, start_time)
     else:
+        cache_stats.record_miss(stats_name, start_time, result)
+
         if permanent_key_fxn is not None:
             permanent_key = permanent_key_fxn(*args, **kwargs)
             set_cached_result(permanent_key, namespace, 0, layer, result, 
@@ -369,8 +461,227 @@ def layer_cache_check_set_return(
         set_cached_result(key, namespace, expiration, layer, result, 
                           use_chunks, compress_chunks)
 
+        if use_stale:
+            set_cached_result(stale_key(key), namespace,
+                              expiration + stale_while_revalidate, layer,
+                              result, use_chunks, compress_chunks)
+
+    release_recompute_lease(lease_key, namespace)
+
     return result
 
+def stale_key(key):
+    """ Key under which the stale-while-revalidate copy of key is stored """
+    return key + "__stale__"
+
+def acquire_recompute_lease(key, namespace,
+                            lease_seconds=DEFAULT_RECOMPUTE_LEASE_SECONDS):
+    """ Try to become the single caller recomputing key.
+
+    memcache.add is atomic across instances, so only one caller can win the
+    lease until it is released or times out. Returns the lease key on success
+    and None if somebody else currently holds it.
+    """
+    lease_key = key + "__lease__"
+    if memcache.add(lease_key, 1, time=lease_seconds,
+                    namespace=namespace):
+        return lease_key
+    return None
+
+def release_recompute_lease(lease_key, namespace):
+    if lease_key is not None:
+        memcache.delete(lease_key, namespace=namespace)
+
+def get_cached_results_multi(keys, namespace, expiration, layer, 
+                             stats_name=None):
+    ''' The get_multi counterpart of get_cached_result. Returns a dict of the 
+    keys that were found in any layer to their values, filling upward layers 
+    on the way.
+    '''
+    results = {}
+    missing = list(keys)
+
+    if layer & Layers.InAppMemory:
+        still_missing = []
+        for key in missing:
+            result = cachepy.get(key)
+            if result is not None:
+                results[key] = result
+                cache_stats.record_hit(stats_name or 
+                                       cache_stats.key_prefix(key),
+                                       cache_stats.HITS_INAPP)
+            else:
+                still_missing.append(key)
+        missing = still_missing
+
+    if missing and layer & Layers.Memcache:
+        maybe_chunked_results = memcache.get_multi(missing, 
+                                                   namespace=namespace)
+        for key, maybe_chunked_result in maybe_chunked_results.iteritems():
+            cache_stats.record_hit(stats_name or cache_stats.key_prefix(key),
+                                   cache_stats.HITS_MEMCACHE,
+                                   isinstance(maybe_chunked_result, 
+                                              ChunkedResult))
+            if isinstance(maybe_chunked_result, ChunkedResult):
+                result = maybe_chunked_result.get_result(memcache, 
+                                                        namespace=namespace)
+            else:
+                result = maybe_chunked_result
+
+            if result is not None:
+                results[key] = result
+                # Found in memcache, fill upward layers
+                if layer & Layers.InAppMemory:
+                    cachepy.set(key, result, expiry=expiration,
+                                size=cachepy_size(maybe_chunked_result))
+
+        missing = [key for key in missing if key not in results]
+
+    if missing and layer & Layers.Datastore:
+        maybe_chunked_results = KeyValueCache.get_multi(missing, 
+                                                        namespace=namespace)
+        unchunked_mapping = {}
+        for key, maybe_chunked_result in maybe_chunked_results.iteritems():
+            cache_stats.record_hit(stats_name or cache_stats.key_prefix(key),
+                                   cache_stats.HITS_DATASTORE,
+                                   isinstance(maybe_chunked_result, 
+                                              ChunkedResult))
+            if isinstance(maybe_chunked_result, ChunkedResult):
+                result = maybe_chunked_result.get_result(KeyValueCache, 
+                                                        namespace=namespace)
+                if result is not None and layer & Layers.Memcache:
+                    # Since the result in the datastore needed to be chunked
+                    # we will need to use ChunkedResult for memcache as well
+                    ChunkedResult.set(key, result, expiration, namespace, 
+                                      cache_class=memcache)
+            else:
+                result = maybe_chunked_result
+                unchunked_mapping[key] = result
+
+            if result is not None:
+                results[key] = result
+                if layer & Layers.InAppMemory:
+                    cachepy.set(key, result, expiry=expiration,
+                                size=cachepy_size(maybe_chunked_result))
+
+        if unchunked_mapping and layer & Layers.Memcache:
+            # Since the datastore wasn't using chunked results these should
+            # all fit in memcache as well.
+            memcache.set_multi(unchunked_mapping, time=expiration, 
+                               namespace=namespace)
+
+    return results
+
+def set_cached_results_multi(mapping, namespace, expiration, layer, 
+                             use_chunks, compress_chunks):
+    ''' The set_multi counterpart of set_cached_result. 
+
+    Values are written to each layer in one set_multi. If any of them turns 
+    out to be too big for a single entry, that layer falls back to 
+    set_cached_result one key at a time so the oversized values get chunked.
+    '''
+    if not mapping:
+        return
+
+    if use_chunks:
+        # Every value is going to be chunked anyway
+        for key, result in mapping.iteritems():
+            set_cached_result(key, namespace, expiration, layer, result, 
+                              use_chunks, compress_chunks)
+        return
+
+    if layer & Layers.InAppMemory:
+        for key, result in mapping.iteritems():
+            cachepy.set(key, result, expiry=expiration)
+
+    if layer & Layers.Memcache:
+        try:
+            failed_keys = memcache.set_multi(mapping, time=expiration, 
+                                             namespace=namespace)
+            if failed_keys:
+                logging.error("Memcache set_multi failed for %s" % 
+                              failed_keys)
+        except ValueError, e:
+            if str(e).startswith("Values may not be more than"):
+                for key, result in mapping.iteritems():
+                    set_cached_result(key, namespace, expiration, 
+                                      Layers.Memcache, result, use_chunks, 
+                                      compress_chunks)
+            else:
+                raise
+
+    if layer & Layers.Datastore:
+        try:
+            KeyValueCache.set_multi(mapping, time=expiration, 
+                                    namespace=namespace)
+        except (RequestTooLargeError, BadRequestError), e:
+            if (isinstance(e, RequestTooLargeError) or 
+                str(e).startswith("string property value is too long")):
+                for key, result in mapping.iteritems():
+                    set_cached_result(key, namespace, expiration, 
+                                      Layers.Datastore, result, use_chunks, 
+                                      compress_chunks)
+            else:
+                raise
+
+def layer_cache_multi_check_set_return(
+        target,
+        key_fxn,
+        arg_list,
+        expiration = DEFAULT_LAYER_CACHE_EXPIRATION_SECONDS,
+        layer = Layers.Memcache | Layers.InAppMemory,
+        persist_across_app_versions = False,
+        use_chunks = False,
+        compress_chunks = True,
+        bust_cache = False):
+
+    arg_list = list(arg_list)
+
+    if not arg_list:
+        return []
+
+    if request_cache.get("layer_cache_disabled"):
+        return list(target(arg_list))
+
+    namespace = App.version
+
+    if persist_across_app_versions:
+        namespace = None
+
+    keys = [key_fxn(arg) for arg in arg_list]
+
+    stats_name = cache_stats.target_name(target)
+
+    cached = {}
+    if not bust_cache:
+        cached = get_cached_results_multi(
+            [key for key in set(keys) if key is not None], namespace, 
+            expiration, layer, stats_name)
+
+    missed_indexes = [i for i, key in enumerate(keys) if key not in cached]
+
+    results = [cached.get(key) for key in keys]
+
+    if missed_indexes:
+        start_time = time.time()
+        computed = target([arg_list[i] for i in missed_indexes])
+        cache_stats.record_miss(stats_name, start_time, 
+                                misses=len(missed_indexes))
+
+        mapping = {}
+        for i, result in zip(missed_indexes, computed):
+            if isinstance(result, UncachedResult):
+                # Don't cache this result, just return it
+                result = result.result
+            elif keys[i] is not None and result is not None:
+                mapping[keys[i]] = result
+            results[i] = result
+
+        set_cached_results_multi(mapping, namespace, expiration, layer, 
+                                 use_chunks, compress_chunks)
+
+    return results
+
 class ChunkedResult():
     ''' Allows for storing of data between 1MB and 32MB in size.  If compression
     is turned on then it will first compress the result and store it in this 
@@ -1,5 +1,9 @@
+import pickle
+
 from google.appengine.api import memcache
+from mock import patch
 
+import cache_stats
 import layer_cache
 import request_cache as cachepy
 from testutil import GAEModelTestCase
@@ -182,6 +186,24 @@ class LayerCacheLayerTest(LayerCacheTest):
         self.assertEqualTruncateError(self.big_string, 
             cachepy.get(self.key))
 
+    @patch("layer_cache.cachepy.set")
+    def test_inapp_cache_is_told_size_of_chunked_results(self, mock_set):
+        ''' Results read back as a ChunkedResult already have their pickle in
+        hand, so cachepy shouldn't have to size them again.
+        '''
+
+        @layer_cache.cache(layer=layer_cache.Layers.Memcache |
+                                 layer_cache.Layers.InAppMemory)
+        def func(result):
+            return result
+
+        func(self.big_string)
+        self.assertEqualTruncateError(self.big_string, func("a"))
+
+        self.assertEqual(
+            len(pickle.dumps(self.big_string, pickle.HIGHEST_PROTOCOL)),
+            mock_set.call_args[1]["size"])
+
     def test_missing_inapp_and_memcache_get_repopulated_from_datastore(self):
         ''' Tests if result from datastore resaves data to higher levels
          
@@ -263,3 +285,235 @@ class LayerCacheCompressionTest(LayerCacheTest):
         
         # make sure target func re-evaluates now that we deleted the key
         self.assertEqual("a", self.cache_func("a"))   
+
+
+class LayerCacheStaleWhileRevalidateTest(LayerCacheTest):
+    ''' Simulates several instances missing on the same expired key.
+
+    The "other instances" are simulated by re-entering the cached function
+    from inside the target while the first caller is still recomputing, with
+    the in-app cache flushed so they can't see each other's cachepy.
+    '''
+
+    def setUp(self):
+        super(LayerCacheStaleWhileRevalidateTest, self).setUp()
+        self.calls = []
+        self.concurrent_results = []
+
+    def make_func(self, layer):
+        @layer_cache.cache(layer=layer, expiration=60,
+                           stale_while_revalidate=600)
+        def func(result, concurrent_misses=0):
+            self.calls.append(result)
+            for i in range(concurrent_misses):
+                cachepy.flush()
+                self.concurrent_results.append(func("concurrent"))
+            return result
+
+        return func
+
+    def expire(self, layer):
+        cachepy.flush()
+        if layer & layer_cache.Layers.Memcache:
+            memcache.delete(self.key)
+        if layer & layer_cache.Layers.Datastore:
+            layer_cache.KeyValueCache.delete(self.key, namespace=None)
+
+    def assert_single_flight(self, layer):
+        func = self.make_func(layer)
+        func("old")
+        self.expire(layer)
+
+        self.assertEqual("new", func("new", concurrent_misses=5))
+
+        # only the lease holder recomputed, everybody else got the stale copy
+        self.assertEqual(["old", "new"], self.calls)
+        self.assertEqual(["old"] * 5, self.concurrent_results)
+
+        # the fresh value is served to later callers
+        cachepy.flush()
+        self.assertEqual("new", func("newer"))
+
+    def test_concurrent_misses_get_stale_value_from_memcache(self):
+        self.assert_single_flight(layer_cache.Layers.Memcache)
+
+    def test_concurrent_misses_get_stale_value_from_datastore(self):
+        self.assert_single_flight(layer_cache.Layers.Datastore)
+
+    def test_concurrent_misses_get_stale_value_from_all_layers(self):
+        self.assert_single_flight(layer_cache.Layers.InAppMemory |
+                                  layer_cache.Layers.Memcache |
+                                  layer_cache.Layers.Datastore)
+
+    def test_concurrent_misses_without_stale_value_recompute(self):
+        func = self.make_func(layer_cache.Layers.Memcache)
+
+        self.assertEqual("first", func("first", concurrent_misses=2))
+        self.assertEqual(["first", "concurrent", "concurrent"], self.calls)
+
+    def test_lease_is_released_after_recompute(self):
+        func = self.make_func(layer_cache.Layers.Memcache)
+        func("a")
+        self.assertIsNone(memcache.get(self.key + "__lease__"))
+
+    def test_lease_is_released_when_target_raises(self):
+        @layer_cache.cache(layer=layer_cache.Layers.Memcache, expiration=60,
+                           stale_while_revalidate=600)
+        def func():
+            raise ValueError()
+
+        self.assertRaises(ValueError, func)
+        self.assertIsNone(memcache.get(self.key + "__lease__"))
+
+
+class LayerCacheMultiTest(LayerCacheTest):
+
+    def setUp(self):
+        super(LayerCacheMultiTest, self).setUp()
+        self.calls = []
+
+    def make_func(self, layer, **kwargs):
+        @layer_cache.cache_multi_with_key_fxn(
+            lambda arg: "layer_cache_multi_test_%s" % arg[0],
+            layer=layer, compress_chunks=False, **kwargs)
+        def func(arg_list):
+            self.calls.append([arg[0] for arg in arg_list])
+            return [arg[1] for arg in arg_list]
+
+        return func
+
+    def test_only_misses_are_computed_in_one_batch(self):
+        func = self.make_func(layer_cache.Layers.Memcache)
+        self.assertEqual(["a", "b"], func([(1, "a"), (2, "b")]))
+        self.assertEqual(["a", "b", "c"],
+                         func([(1, "x"), (2, "y"), (3, "c")]))
+        self.assertEqual([[1, 2], [3]], self.calls)
+
+    def test_results_keep_argument_order(self):
+        func = self.make_func(layer_cache.Layers.Memcache)
+        func([(2, "b")])
+        self.assertEqual(["a", "b", "c"],
+                         func([(1, "a"), (2, "x"), (3, "c")]))
+
+    def test_bust_cache_recomputes_everything(self):
+        func = self.make_func(layer_cache.Layers.Memcache)
+        func([(1, "a")])
+        self.assertEqual(["b"], func([(1, "b")], bust_cache=True))
+
+    def test_uncached_result_is_not_stored(self):
+        @layer_cache.cache_multi_with_key_fxn(
+            lambda arg: "layer_cache_multi_test_%s" % arg,
+            layer=layer_cache.Layers.Memcache)
+        def func(arg_list):
+            return [layer_cache.UncachedResult(arg) for arg in arg_list]
+
+        self.assertEqual([1], func([1]))
+        self.assertIsNone(memcache.get("layer_cache_multi_test_1"))
+
+    def test_large_values_are_chunked_in_memcache(self):
+        func = self.make_func(layer_cache.Layers.Memcache)
+        func([(1, "a"), (2, self.big_string)])
+        self.assertIsInstance(memcache.get("layer_cache_multi_test_2"),
+                              layer_cache.ChunkedResult)
+        self.assertEqualTruncateError([self.big_string, "a"],
+                                      func([(2, "x"), (1, "y")]))
+
+    def test_large_values_are_chunked_in_datastore(self):
+        func = self.make_func(layer_cache.Layers.Datastore)
+        func([(1, "a"), (2, self.big_string)])
+        self.assertIsInstance(
+            layer_cache.KeyValueCache.get("layer_cache_multi_test_2", None),
+            layer_cache.ChunkedResult)
+        self.assertEqualTruncateError([self.big_string, "a"],
+                                      func([(2, "x"), (1, "y")]))
+        self.assertEqual([[1, 2]], self.calls)
+
+    def test_datastore_hits_fill_upward_layers(self):
+        func = self.make_func(layer_cache.Layers.InAppMemory |
+                              layer_cache.Layers.Memcache |
+                              layer_cache.Layers.Datastore)
+        func([(1, "a"), (2, self.big_string)])
+        cachepy.flush()
+        memcache.flush_all()
+
+        self.assertEqualTruncateError(["a", self.big_string],
+                                      func([(1, "x"), (2, "y")]))
+        self.assertEqual("a", memcache.get("layer_cache_multi_test_1"))
+        self.assertIsInstance(memcache.get("layer_cache_multi_test_2"),
+                              layer_cache.ChunkedResult)
+        self.assertEqual("a", cachepy.get("layer_cache_multi_test_1"))
+
+
+class LayerCacheStatsTest(LayerCacheTest):
+
+    def setUp(self):
+        super(LayerCacheStatsTest, self).setUp()
+        cache_stats.REQUEST_STATS.clear()
+        # Measure every recomputed value
+        self.sample_rate_patcher = patch("cache_stats.BYTES_SAMPLE_RATE", 1)
+        self.sample_rate_patcher.start()
+
+        @layer_cache.cache(layer=layer_cache.Layers.InAppMemory |
+                                 layer_cache.Layers.Memcache |
+                                 layer_cache.Layers.Datastore)
+        def func(result):
+            return result
+
+        self.cache_func = func
+
+    def tearDown(self):
+        self.sample_rate_patcher.stop()
+        super(LayerCacheStatsTest, self).tearDown()
+
+    def stats(self):
+        rows = [row for row in cache_stats.request_stats()
+                if row["name"] == "layer_cache_test.func"]
+        self.assertEqual(1, len(rows))
+        return rows[0]
+
+    def test_hits_are_counted_per_layer(self):
+        self.cache_func("a")
+        self.cache_func("a")
+        cachepy.flush()
+        self.cache_func("a")
+        cachepy.flush()
+        memcache.flush_all()
+        self.cache_func("a")
+
+        stats = self.stats()
+        self.assertEqual(1, stats["misses"])
+        self.assertEqual(1, stats["hits_inapp"])
+        self.assertEqual(1, stats["hits_memcache"])
+        self.assertEqual(1, stats["hits_datastore"])
+        self.assertEqual(2, stats["unchunked"])
+        self.assertEqual(0, stats["chunked"])
+        self.assertTrue(stats["bytes"] > 0)
+
+    def test_chunked_reads_are_counted(self):
+        self.cache_func(self.big_string)
+        cachepy.flush()
+        self.cache_func("a")
+
+        stats = self.stats()
+        self.assertEqual(1, stats["chunked"])
+        self.assertTrue(stats["bytes"] >= len(self.big_string))
+
+    def test_uncached_results_are_counted_and_not_stored(self):
+        @layer_cache.cache_with_key_fxn(
+            lambda result: "layer_cache_test_uncached_%s" % result,
+            layer=layer_cache.Layers.Memcache, expiration=60,
+            stale_while_revalidate=600)
+        def uncached_func(result):
+            return layer_cache.UncachedResult(result)
+
+        self.assertEqual("a", uncached_func("a"))
+        self.assertEqual("a", uncached_func("a"))
+
+        key = "layer_cache_test_uncached_a"
+        self.assertIsNone(memcache.get(key))
+        self.assertIsNone(memcache.get(key + "__lease__"))
+
+        rows = [row for row in cache_stats.request_stats()
+                if row["name"] == "layer_cache_test.uncached_func"]
+        self.assertEqual(2, rows[0]["misses"])
+        self.assertEqual(0, rows[0]["bytes"])
@@ -43,6 +43,7 @@ import user_util
 import exercise_statistics
 import activity_summary
 import dashboard.handlers
+import counters.handlers
 import exercises.exercise_util
 import exercises.handlers
 import exercisestats.report
@@ -850,6 +851,7 @@ application = webapp2.WSGIApplication([
     ('/dashboard', dashboard.handlers.Dashboard),
     ('/contentdash', dashboard.handlers.ContentDashboard),
     ('/admin/dashboard/record_statistics', dashboard.handlers.RecordStatistics),
+    ('/admin/counters/fold', counters.handlers.FoldPending),
     ('/admin/entitycounts', dashboard.handlers.EntityCounts),
     ('/devadmin/contentcounts', dashboard.handlers.ContentCountsCSV),
 
@@ -884,6 +886,8 @@ application = webapp2.WSGIApplication([
     ('/stats/dashboard', dashboard.handlers.Dashboard),
     ('/stats/contentdash', dashboard.handlers.ContentDashboard),
     ('/stats/memcache', appengine_stats.MemcacheStatus),
+    ('/stats/cachepy', appengine_stats.CachepyStatus),
+    ('/stats/cachestats', appengine_stats.CacheStatsReport),
 
     ('/robots.txt', robots.RobotsTxt),
 
@@ -1,5 +1,9 @@
 #!/usr/bin/env python
 
+import datetime
+
+from mock import patch
+
 from third_party.agar.test import BaseTest
 
 import models
@@ -167,6 +171,171 @@ class UserDataCoachTest(BaseTest):
         self.assertIn('l1', uexs)
 
 
+class UserExerciseGraphTest(BaseTest):
+    class FakeUserData(object):
+        def __init__(self, proficient_exercises):
+            self.proficient_exercises = proficient_exercises
+
+    class FakeUserExerciseCache(object):
+        def __init__(self, dicts):
+            self.dicts = dicts
+
+        def user_exercise_dict(self, exercise_name):
+            user_exercise_dict = (
+                models.UserExerciseCache.dict_from_user_exercise(None))
+            user_exercise_dict.update(self.dicts.get(exercise_name, {}))
+            return user_exercise_dict
+
+    def exercise_dict(self, name, h_position, prerequisites=[], covers=[]):
+        return {
+            "id": h_position,
+            "name": name,
+            "display_name": name,
+            "h_position": h_position,
+            "v_position": 0,
+            "proficient": None,
+            "explicitly_proficient": None,
+            "suggested": None,
+            "prerequisites": [{"name": p, "display_name": p}
+                              for p in prerequisites],
+            "covers": covers,
+            "live": True,
+        }
+
+    def generate(self, proficient_exercises, user_exercise_dicts):
+        # "big" covers "small", and "next" requires "big"
+        template = models.ExerciseGraphTemplate([
+            self.exercise_dict("next", 3, prerequisites=["big"]),
+            self.exercise_dict("small", 1),
+            self.exercise_dict("big", 2, covers=["small"]),
+            self.exercise_dict("later", 4, prerequisites=["next"]),
+        ])
+        return models.UserExerciseGraph.generate(
+            self.FakeUserData(proficient_exercises),
+            self.FakeUserExerciseCache(user_exercise_dicts),
+            template)
+
+    def test_covering_exercise_makes_unmissed_exercises_proficient(self):
+        graph = self.generate(["big"], {
+            "small": {"streak": 3, "total_done": 3},
+        })
+        self.assertEqual(["small", "big"], graph.proficient_exercise_names())
+        self.assertTrue(graph.graph_dict("big")["explicitly_proficient"])
+        self.assertEqual(None,
+                         graph.graph_dict("small")["explicitly_proficient"])
+
+    def test_missed_exercises_are_not_implicitly_proficient(self):
+        graph = self.generate(["big"], {
+            "small": {"streak": 2, "total_done": 3},
+        })
+        self.assertEqual(["big"], graph.proficient_exercise_names())
+
+    def test_boundary_follows_proficiency(self):
+        graph = self.generate([], {})
+        # "small" is covered by "big", which is also on the boundary
+        self.assertEqual(["big"], graph.boundary_names())
+
+        graph = self.generate(["big"], {
+            "small": {"streak": 0, "total_done": 1},
+        })
+        self.assertEqual(["small", "next"], graph.boundary_names())
+        self.assertEqual(["small", "next"], graph.suggested_exercise_names())
+
+    def test_attempted_exercises_are_suggested_first(self):
+        graph = self.generate([], {"later": {"progress": 0.75}})
+        self.assertEqual(["later", "big"], graph.attempted_names() +
+                                           graph.boundary_names())
+        self.assertEqual(["big", "later"], graph.suggested_exercise_names())
+
+    def test_graph_dicts_are_reused(self):
+        graph = self.generate(["big"], {})
+        graph.graph_dict("big")["status"] = "Proficient"
+        proficient_dicts = dict((d["name"], d)
+                                for d in graph.proficient_graph_dicts())
+        self.assertEqual("Proficient", proficient_dicts["big"]["status"])
+        self.assertEqual(["small", "big", "next", "later"],
+                         [d["name"] for d in graph.graph_dicts()])
+
+
+class UserExerciseCacheTest(BaseTest):
+    def user_exercise_dict(self, **kwargs):
+        user_exercise_dict = (
+            models.UserExerciseCache.dict_from_user_exercise(None))
+        user_exercise_dict.update(kwargs)
+        return user_exercise_dict
+
+    def test_records_round_trip(self):
+        dicts = {
+            "addition_1": self.user_exercise_dict(
+                streak=3, longest_streak=7, progress=0.625, struggling=True,
+                total_done=12,
+                last_done=datetime.datetime(2012, 5, 3, 4, 5, 6, 789),
+                review_interval_secs=86400, proficient_date=None),
+            "subtraction_1": self.user_exercise_dict(
+                proficient_date=datetime.datetime(2012, 1, 2)),
+        }
+
+        cache = models.UserExerciseCache(key_name="test",
+            version=models.UserExerciseCache.CURRENT_VERSION)
+        cache.set_dicts(dicts)
+        cache.put()
+
+        cache = models.UserExerciseCache.get_by_key_name("test")
+        self.assertEqual(2 * models.UserExerciseCache.RECORD_SIZE,
+                         len(cache.records))
+        self.assertEqual(dicts, cache.dicts)
+        self.assertEqual(dicts["addition_1"],
+                         cache.user_exercise_dict("addition_1"))
+        self.assertEqual(
+            models.UserExerciseCache.dict_from_user_exercise(None),
+            cache.user_exercise_dict("missing"))
+
+    def test_set_dicts_replaces_and_appends_records(self):
+        cache = models.UserExerciseCache(key_name="test")
+        cache.set_dicts({"a": self.user_exercise_dict(streak=1),
+                         "b": self.user_exercise_dict(streak=2)})
+        cache.set_dicts({"b": self.user_exercise_dict(streak=3),
+                         "c": self.user_exercise_dict(streak=4)})
+        cache.put()
+
+        cache = models.UserExerciseCache.get_by_key_name("test")
+        self.assertEqual({"a": 1, "b": 3, "c": 4},
+                         dict((name, d["streak"])
+                              for name, d in cache.dicts.iteritems()))
+
+    @patch("experiments.StrugglingExperiment.get_alternative_for_user")
+    def test_generated_caches_do_not_share_exercises(self, mock_alternative):
+        mock_alternative.return_value = None
+        alice = make_user("alice@example.com")
+        bob = make_user("bob@example.com")
+
+        alice_cache = models.UserExerciseCache.generate(alice, [
+            models.UserExercise(user=alice.user, exercise="a", streak=1),
+            models.UserExercise(user=alice.user, exercise="b", streak=2),
+        ])
+        bob_cache = models.UserExerciseCache.generate(bob, [
+            models.UserExercise(user=bob.user, exercise="c", streak=3),
+        ])
+
+        self.assertEqual(["a", "b"], sorted(alice_cache.exercise_names))
+        self.assertEqual(["c"], bob_cache.exercise_names)
+        self.assertEqual(models.UserExerciseCache.RECORD_SIZE,
+                         len(bob_cache.records))
+        self.assertEqual({"c": 3},
+                         dict((name, d["streak"])
+                              for name, d in bob_cache.dicts.iteritems()))
+        self.assertEqual({"a": 1, "b": 2},
+                         dict((name, d["streak"])
+                              for name, d in alice_cache.dicts.iteritems()))
+
+        # Nor with caches made without any exercises
+        cache = models.UserExerciseCache(key_name="test")
+        cache.set_dicts({"d": self.user_exercise_dict(streak=4)})
+        self.assertEqual(["d"], cache.exercise_names)
+        self.assertEqual([], models.UserExerciseCache(
+            key_name="other").exercise_names)
+
+
 def do_problem(user_data, user_exercise, correct=True):
     options = {
         "user_data": user_data,
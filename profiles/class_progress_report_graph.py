@@ -1,92 +1,216 @@
-from itertools import izip
+import hashlib
+try:
+    import json                  # python 2.6 and later
+except ImportError:
+    import simplejson as json    # python 2.5 and earlier
+
+from google.appengine.api import memcache
+
+from templatefilters import timesince_ago
+from exercise_models import ExerciseGraphTemplate, UserExerciseCache
+from exercise_models import UserExerciseGraph
+import setting_model
+
+# The report is a students x exercises matrix of status codes, indexes into
+# STATUSES. Students are processed CHUNK_SIZE at a time, each chunk's rows
+# are cached, and the JSON is written out a chunk at a time, so big classes
+# never have all their UserExerciseGraphs or rows in memory at once.
+STATUSES = [
+    "",
+    "Started",
+    "Struggling",
+    "Proficient",
+    "Proficient (due to proficiency in a more advanced module)",
+    "Review",
+]
+STARTED, STRUGGLING, PROFICIENT, PROFICIENT_IMPLICITLY, REVIEW = range(1, 6)
+
+CHUNK_SIZE = 50
+
+# Rows are keyed on each student's last_activity, so this only bounds how
+# stale review states, which change as time passes, can get
+ROWS_EXPIRATION_SECONDS = 60 * 60
+
+
+def cell_status(user_exercise_graph, i):
+    if user_exercise_graph.proficient[i]:
+        if user_exercise_graph.reviewing[i]:
+            return REVIEW
+        if user_exercise_graph.explicitly_proficient[i]:
+            return PROFICIENT
+        return PROFICIENT_IMPLICITLY
+
+    user_exercise_dict = user_exercise_graph.user_exercise_dicts[i]
+    if user_exercise_dict["struggling"]:
+        return STRUGGLING
+    if user_exercise_dict["total_done"] > 0:
+        return STARTED
+    return 0
+
+
+def student_row(user_data, user_exercise_graph):
+    """ A student's row of the report. Only exercises with a status get a
+    [template index, status, progress, total done, last done] cell.
+    """
+    cells = []
+    for i, user_exercise_dict in enumerate(
+            user_exercise_graph.user_exercise_dicts):
+        status = cell_status(user_exercise_graph, i)
+        if not status:
+            continue
+
+        last_done = user_exercise_dict["last_done"]
+        if not last_done or last_done.year <= 1:
+            last_done = None
+
+        cells.append([i, status, user_exercise_dict["progress"],
+                      user_exercise_dict["total_done"], last_done])
 
-from jinja2.utils import escape
-
-from templatefilters import escapejs, timesince_ago
-from exercise_models import Exercise, UserExerciseGraph
-
-
-def class_progress_report_graph_context(user_data, list_students):
-    if not user_data:
-        return {}
-
-    list_students = sorted(list_students, key=lambda student: student.nickname)
-
-    student_email_pairs = [(escape(s.email), (s.nickname[:14] + '...') if len(s.nickname) > 17 else s.nickname) for s in list_students]
-    emails_escapejsed = [escapejs(s.email) for s in list_students]
+    return {
+        "email": user_data.email,
+        "nickname": user_data.nickname,
+        "profile_root": user_data.profile_root,
+        "cells": cells,
+    }
 
-    exercises_all = Exercise.get_all_use_cache()
-    user_exercise_graphs = UserExerciseGraph.get(list_students)
 
-    exercises_found = []
+def rows_key(students, template):
+    students_hash = hashlib.md5("\n".join(
+        "%s:%s" % (student.key_email, student.last_activity)
+        for student in students)).hexdigest()
+    return "class_progress_report_rows_%s_%s_%s" % (
+        setting_model.Setting.cached_exercises_date(),
+        len(template.exercise_dicts), students_hash)
 
-    for exercise in exercises_all:
-        for user_exercise_graph in user_exercise_graphs:
-            graph_dict = user_exercise_graph.graph_dict(exercise.name)
-            if graph_dict and graph_dict["total_done"]:
-                exercises_found.append(exercise)
-                break
 
-    exercise_names = [(e.name, e.display_name, escapejs(e.name))
-                      for e in exercises_found]
+def student_rows(students, template):
+    """ Rows for a chunk of students, in the same order """
+    key = rows_key(students, template)
+    rows = memcache.get(key)
 
-    exercise_list = [{'name': e.name, 'display_name': e.display_name}
-                     for e in exercises_found]
+    if rows is None:
+        user_exercise_caches = UserExerciseCache.get(students)
+        rows = [student_row(student, UserExerciseGraph.generate(
+                    student, user_exercise_cache, template))
+                for student, user_exercise_cache
+                in zip(students, user_exercise_caches)]
+        memcache.set(key, rows, time=ROWS_EXPIRATION_SECONDS)
 
-    exercise_data = {}
+    return rows
 
-    for (student, _, _, user_exercise_graph) in izip(list_students, student_email_pairs, emails_escapejsed, user_exercise_graphs):
 
-        student_email = student.email
+def all_student_rows(list_students, template):
+    """ Yields every student's row, CHUNK_SIZE students at a time """
+    for start in xrange(0, len(list_students), CHUNK_SIZE):
+        for row in student_rows(list_students[start:start + CHUNK_SIZE],
+                                template):
+            yield row
 
-        for (exercise, (_, _, _)) in izip(exercises_found, exercise_names):
 
-            exercise_name = exercise.name
-            graph_dict = user_exercise_graph.graph_dict(exercise_name)
+def class_progress_report_graph_context(user_data, list_students,
+                                        template=None):
+    """ The report with a dict per student and exercise, in the shape the
+    progress report API had before class_progress_report_graph_json.
 
-            status = ""
+    Every student gets an entry in "exercises" for each of exercise_names,
+    which are the exercises at least one of them has done.
+    """
+    if not user_data:
+        return {}
 
-            if graph_dict["proficient"]:
+    template = template or ExerciseGraphTemplate.get()
+    list_students = sorted(list_students,
+                           key=lambda student: student.nickname)
+
+    rows = list(all_student_rows(list_students, template))
+    done_indexes = sorted(set(i for row in rows
+                              for i, _, _, total_done, _ in row["cells"]
+                              if total_done))
+
+    exercise_data = []
+    for row in rows:
+        cells = dict((cell[0], cell) for cell in row["cells"])
+        exercises = []
+        for i in done_indexes:
+            if i not in cells:
+                exercises.append({
+                    "name": template.exercise_dicts[i]["name"],
+                    "status": "",
+                })
+                continue
+
+            _, status, progress, total_done, last_done = cells[i]
+            exercises.append({
+                "status": STATUSES[status],
+                "progress": progress,
+                "total_done": total_done,
+                "last_done": last_done or "",
+                "last_done_ago": timesince_ago(last_done) if last_done else "",
+            })
+
+        exercise_data.append({
+            "email": row["email"],
+            "nickname": row["nickname"],
+            "profile_root": row["profile_root"],
+            "exercises": exercises,
+        })
 
-                if graph_dict["reviewing"]:
-                    status = "Review"
-                else:
-                    status = "Proficient"
-                    if not graph_dict["explicitly_proficient"]:
-                        status = "Proficient (due to proficiency in a more advanced module)"
+    return {
+        "exercise_names": [{
+            "name": template.exercise_dicts[i]["name"],
+            "display_name": template.exercise_dicts[i]["display_name"],
+        } for i in done_indexes],
+        "exercise_data": exercise_data,
+        "coach_email": user_data.email,
+        "c_points": sum(student.points for student in list_students),
+    }
 
-            elif graph_dict["struggling"]:
-                status = "Struggling"
-            elif graph_dict["total_done"] > 0:
-                status = "Started"
 
-            if student_email not in exercise_data:
-                exercise_data[student_email] = {
-                    'email': student.email,
-                    'nickname': student.nickname,
-                    'profile_root': student.profile_root,
-                    'exercises': []
-                }
+def class_progress_report_graph_json(user_data, list_students,
+                                     template=None):
+    """ Yields the JSON report a chunk of students at a time.
 
-            if len(status) > 0:
-                exercise_data[student_email]['exercises'].append({
-                    "status": status,
-                    "progress": graph_dict["progress"],
-                    "total_done": graph_dict["total_done"],
-                    "last_done": graph_dict["last_done"] if graph_dict["last_done"] and graph_dict["last_done"].year > 1 else '',
-                    "last_done_ago": timesince_ago(graph_dict["last_done"]) if graph_dict["last_done"] and graph_dict["last_done"].year > 1 else ''
-                })
+    The report has the STATUSES, the students' rows, then the exercises at
+    least one of them has done as exercise_names. Those are in template order
+    and their "index" is what the rows' cells refer to.
+    """
+    if not user_data:
+        yield "{}"
+        return
+
+    template = template or ExerciseGraphTemplate.get()
+    list_students = sorted(list_students,
+                           key=lambda student: student.nickname)
+
+    yield '{"coach_email": %s, "c_points": %s, "statuses": %s,' % (
+        json.dumps(user_data.email),
+        sum(student.points for student in list_students),
+        json.dumps(STATUSES))
+    yield ' "exercise_data": ['
+
+    done_indexes = set()
+    first = True
+    for row in all_student_rows(list_students, template):
+        cells = []
+        for i, status, progress, total_done, last_done in row["cells"]:
+            if total_done:
+                done_indexes.add(i)
+            if last_done:
+                cells.append([i, status, progress, total_done,
+                              last_done.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                              timesince_ago(last_done)])
             else:
-                exercise_data[student_email]['exercises'].append({
-                    "name": exercise_name,
-                    "status": status,
-                })
+                cells.append([i, status, progress, total_done, "", ""])
 
-    student_row_data = [data for (_, data) in exercise_data.iteritems()]
+        row = dict(row, cells=cells)
+        yield "%s%s" % ("" if first else ",",
+                        json.dumps(row))
+        first = False
 
-    return {
-        'exercise_names': exercise_list,
-        'exercise_data': student_row_data,
-        'coach_email': user_data.email,
-        'c_points': reduce(lambda a, b: a + b, map(lambda s: s.points, list_students), 0)
-    }
+    exercise_names = [{
+        "index": i,
+        "name": template.exercise_dicts[i]["name"],
+        "display_name": template.exercise_dicts[i]["display_name"],
+    } for i in sorted(done_indexes)]
+
+    yield '], "exercise_names": %s}' % json.dumps(exercise_names)
@@ -0,0 +1,158 @@
+import datetime
+try:
+    import json                  # python 2.6 and later
+except ImportError:
+    import simplejson as json    # python 2.5 and earlier
+
+from mock import patch
+
+import exercise_models
+from profiles import class_progress_report_graph
+from testutil import GAEModelTestCase
+
+
+class FakeStudent(object):
+    def __init__(self, nickname, proficient_exercises=[]):
+        self.nickname = nickname
+        self.email = self.key_email = "%s@example.com" % nickname
+        self.profile_root = "/profile/%s/" % nickname
+        self.last_activity = None
+        self.points = 10
+        self.proficient_exercises = proficient_exercises
+
+
+class FakeUserExerciseCache(object):
+    def __init__(self, dicts):
+        self.dicts = dicts
+
+    def user_exercise_dict(self, exercise_name):
+        user_exercise_dict = (
+            exercise_models.UserExerciseCache.dict_from_user_exercise(None))
+        user_exercise_dict.update(self.dicts.get(exercise_name, {}))
+        return user_exercise_dict
+
+
+def exercise_dict(name, h_position):
+    return {
+        "id": h_position,
+        "name": name,
+        "display_name": name.title(),
+        "h_position": h_position,
+        "v_position": 0,
+        "proficient": None,
+        "explicitly_proficient": None,
+        "suggested": None,
+        "prerequisites": [],
+        "covers": [],
+        "live": True,
+    }
+
+
+class ClassProgressReportTest(GAEModelTestCase):
+    def setUp(self):
+        super(ClassProgressReportTest, self).setUp()
+        self.template = exercise_models.ExerciseGraphTemplate([
+            exercise_dict("addition", 1),
+            exercise_dict("subtraction", 2),
+            exercise_dict("division", 3),
+        ])
+
+        last_done = datetime.datetime(2012, 3, 1)
+        self.user_exercise_dicts = {
+            "bob@example.com": {
+                "addition": {"total_done": 10, "progress": 1.0,
+                             "last_done": last_done},
+            },
+            "carol@example.com": {
+                "subtraction": {"total_done": 3, "progress": 0.5,
+                                "struggling": True, "last_done": last_done},
+            },
+        }
+        self.coach = FakeStudent("coach")
+        self.students = [FakeStudent("carol"),
+                         FakeStudent("bob", ["addition"]),
+                         FakeStudent("alice")]
+
+    def fake_caches(self, students):
+        dicts = self.user_exercise_dicts
+        return [FakeUserExerciseCache(dicts.get(student.email, {}))
+                for student in students]
+
+    def report(self):
+        return json.loads("".join(
+            class_progress_report_graph.class_progress_report_graph_json(
+                self.coach, self.students, template=self.template)))
+
+    @patch("profiles.class_progress_report_graph.CHUNK_SIZE", 2)
+    @patch("exercise_models.UserExerciseCache.get")
+    def test_report(self, mock_get):
+        mock_get.side_effect = self.fake_caches
+        report = self.report()
+
+        # Loaded a chunk at a time
+        self.assertEqual(2, mock_get.call_count)
+        self.assertEqual(30, report["c_points"])
+
+        # Only exercises someone has done are columns
+        self.assertEqual([(0, "addition"), (1, "subtraction")],
+                         [(e["index"], e["name"])
+                          for e in report["exercise_names"]])
+
+        rows = dict((row["nickname"], row) for row in report["exercise_data"])
+        self.assertEqual(["alice", "bob", "carol"],
+                         [row["nickname"] for row in report["exercise_data"]])
+        self.assertEqual([], rows["alice"]["cells"])
+
+        [[index, status, progress, total_done, last_done, last_done_ago]] = (
+            rows["bob"]["cells"])
+        self.assertEqual(0, index)
+        self.assertEqual("Proficient", report["statuses"][status])
+        self.assertEqual(10, total_done)
+        self.assertEqual("2012-03-01T00:00:00Z", last_done)
+        self.assertTrue(last_done_ago.endswith("ago"))
+
+        [cell] = rows["carol"]["cells"]
+        self.assertEqual("Struggling", report["statuses"][cell[1]])
+
+    @patch("exercise_models.UserExerciseCache.get")
+    def test_rows_are_cached_until_activity(self, mock_get):
+        mock_get.side_effect = self.fake_caches
+        first_report = self.report()
+        self.assertEqual(first_report, self.report())
+        self.assertEqual(1, mock_get.call_count)
+
+        self.students[0].last_activity = datetime.datetime(2012, 3, 2)
+        self.report()
+        self.assertEqual(2, mock_get.call_count)
+
+    @patch("profiles.class_progress_report_graph.CHUNK_SIZE", 2)
+    @patch("exercise_models.UserExerciseCache.get")
+    def test_context_keeps_the_dict_per_exercise_shape(self, mock_get):
+        mock_get.side_effect = self.fake_caches
+        context = (
+            class_progress_report_graph.class_progress_report_graph_context(
+                self.coach, self.students, template=self.template))
+
+        self.assertEqual(30, context["c_points"])
+        self.assertEqual("coach@example.com", context["coach_email"])
+        self.assertEqual([{"name": "addition", "display_name": "Addition"},
+                          {"name": "subtraction",
+                           "display_name": "Subtraction"}],
+                         context["exercise_names"])
+
+        rows = dict((row["nickname"], row) for row in context["exercise_data"])
+        self.assertEqual([{"name": "addition", "status": ""},
+                          {"name": "subtraction", "status": ""}],
+                         rows["alice"]["exercises"])
+
+        bob_addition, bob_subtraction = rows["bob"]["exercises"]
+        self.assertEqual("Proficient", bob_addition["status"])
+        self.assertEqual(10, bob_addition["total_done"])
+        self.assertEqual(datetime.datetime(2012, 3, 1),
+                         bob_addition["last_done"])
+        self.assertTrue(bob_addition["last_done_ago"].endswith("ago"))
+        self.assertEqual({"name": "subtraction", "status": ""},
+                         bob_subtraction)
+
+        self.assertEqual("Struggling",
+                         rows["carol"]["exercises"][1]["status"])
@@ -1,61 +1,83 @@
-import datetime
+import time
 import user_util
 
 from google.appengine.api import memcache
 
 
 class RateLimiter:
-    
+    """ Limits each user to hourly_limit actions in any sliding hour.
+
+    The hour is split into BUCKET_SECONDS buckets, each a memcache counter
+    that expires once it's out of the window. Checking a user is one
+    get_multi and counting an action is a memcache.incr, no matter how many
+    actions they've taken. Since buckets are whole, the window actually
+    covers somewhere between an hour minus BUCKET_SECONDS and an hour.
+    """
+
+    WINDOW_SECONDS = 3600
+    BUCKET_SECONDS = 60
+
     def __init__(self, user_data, hourly_limit, desc):
         self.hourly_limit = hourly_limit
         self.desc = desc
         self.user_data = user_data
 
-    def is_allowed(self):
-        return len(self.purge()) < self.hourly_limit or \
-                user_util.is_current_user_developer() or \
+    def is_exempt(self):
+        return user_util.is_current_user_developer() or \
                 self.user_data.moderator
 
+    def is_allowed(self):
+        return self.count() < self.hourly_limit or self.is_exempt()
+
     def increment(self):
-        if not self.is_allowed():
+        if self.is_exempt():
+            self.add_new()
+            return True
+
+        # Counting first and checking after keeps this right when several
+        # requests increment at once. An action that went over the limit is
+        # taken back out.
+        keys = self.window_keys()
+        if self.add_new(keys) > self.hourly_limit:
+            memcache.decr(keys[-1])
             return False
 
-        self.add_new()
         return True
 
     def get_key(self):
         return "rate_limiter_%s_%s" % (self.__class__.__name__,
                                        self.user_data.key_email)
 
-    def add_new(self):
-        key = self.get_key()
-
-        dates = memcache.get(key)
-        if not dates:
-            dates = []
-        dates.append(datetime.datetime.now())
-
-        memcache.set(key, dates)
+    def current_bucket(self):
+        return int(time.time()) / RateLimiter.BUCKET_SECONDS
 
-    def purge(self):
-        key = self.get_key()
+    def bucket_key(self, bucket):
+        return "%s_%s" % (self.get_key(), bucket)
 
-        dates = memcache.get(key)
-        if not dates:
-            return []
+    def window_keys(self):
+        """ Keys of all the buckets in the current window, oldest first """
+        current = self.current_bucket()
+        num_buckets = RateLimiter.WINDOW_SECONDS / RateLimiter.BUCKET_SECONDS
+        return [self.bucket_key(bucket)
+                for bucket in range(current - num_buckets + 1, current + 1)]
 
-        date_now = datetime.datetime.now()
-        modified = False
+    def count(self):
+        """ Number of actions in the current window """
+        return sum(memcache.get_multi(self.window_keys()).values())
 
-        for date in dates:
-            if (date_now - date) > datetime.timedelta(seconds=3600):
-                modified = True
-                dates.remove(date)
+    def add_new(self, keys=None):
+        """ Counts an action and returns the new count for the window """
+        if keys is None:
+            keys = self.window_keys()
+        key = keys[-1]
 
-        if modified:
-            memcache.set(key, dates)
+        # memcache.incr's initial_value would create the counter without an
+        # expiration, so it's added first
+        memcache.add(key, 0, time=RateLimiter.WINDOW_SECONDS +
+                     RateLimiter.BUCKET_SECONDS)
+        new_value = memcache.incr(key) or 0
 
-        return dates
+        return new_value + sum(memcache.get_multi(keys[:-1]).values())
 
     def denied_desc(self):
         return self.desc % self.hourly_limit
@@ -0,0 +1,86 @@
+from mock import patch
+
+import rate_limiter
+from rate_limiter import RateLimiter, VoteRateLimiter
+from testutil import GAEModelTestCase
+
+
+class FakeUserData(object):
+    def __init__(self, key_email="user@example.com", moderator=False):
+        self.key_email = key_email
+        self.moderator = moderator
+
+
+class RateLimiterTest(GAEModelTestCase):
+    def setUp(self):
+        super(RateLimiterTest, self).setUp()
+        self._patches = []
+
+        self.mock_is_developer = self.mock_method(
+            "rate_limiter.user_util.is_current_user_developer")
+        self.mock_is_developer.return_value = False
+
+        self.mock_time = self.mock_method("rate_limiter.time.time")
+        self.mock_time.return_value = 1000000.0
+
+    def tearDown(self):
+        for p in self._patches:
+            p.stop()
+        super(RateLimiterTest, self).tearDown()
+
+    def mock_method(self, method_path):
+        patcher = patch(method_path)
+        self._patches.append(patcher)
+        return patcher.start()
+
+    def test_limit(self):
+        limiter = VoteRateLimiter(FakeUserData())
+
+        for i in range(10):
+            self.assertTrue(limiter.is_allowed())
+            self.assertTrue(limiter.increment())
+
+        self.assertFalse(limiter.is_allowed())
+        self.assertFalse(limiter.increment())
+        self.assertEqual(10, limiter.count())
+
+        # Other users and other limiters are counted separately
+        self.assertTrue(VoteRateLimiter(FakeUserData("other")).increment())
+        self.assertTrue(
+            rate_limiter.FlagRateLimiter(FakeUserData()).increment())
+
+    def test_window_slides(self):
+        limiter = VoteRateLimiter(FakeUserData())
+
+        for i in range(5):
+            limiter.increment()
+        self.mock_time.return_value += 30 * 60
+        for i in range(5):
+            limiter.increment()
+        self.assertFalse(limiter.increment())
+
+        # The first five fall out of the window after an hour
+        self.mock_time.return_value += 30 * 60
+        self.assertEqual(5, limiter.count())
+        self.assertTrue(limiter.increment())
+
+        self.mock_time.return_value += RateLimiter.WINDOW_SECONDS
+        self.assertEqual(0, limiter.count())
+
+    def test_exempt_users(self):
+        limiter = VoteRateLimiter(FakeUserData(moderator=True))
+        for i in range(20):
+            self.assertTrue(limiter.increment())
+        self.assertTrue(limiter.is_allowed())
+
+        self.mock_is_developer.return_value = True
+        limiter = VoteRateLimiter(FakeUserData())
+        for i in range(20):
+            self.assertTrue(limiter.increment())
+
+    def test_refused_increments_are_not_counted(self):
+        limiter = VoteRateLimiter(FakeUserData())
+        for i in range(15):
+            limiter.increment()
+
+        self.assertEqual(10, limiter.count())
@@ -1,4 +1,7 @@
 import inspect
+import time
+
+import cache_stats
 
 # request_cache is similar to layer_cache, except it only memoizes results
 # for each individual request. If you need to cache results for longer than
@@ -67,11 +70,16 @@ def request_cache_check_set_return(
             # delete from kwargs so it's not passed to the target
             del kwargs["bust_cache"]
 
+    stats_name = cache_stats.target_name(target)
+
     if not bust_cache:
         if has(key):
+            cache_stats.record_hit(stats_name, cache_stats.HITS_REQUEST)
             return get(key)
 
+    start_time = time.time()
     result = target(*args, **kwargs)
+    cache_stats.record_miss(stats_name, start_time)
 
     # In case the key's value has been changed by target's execution
     key = key_fxn(*args, **kwargs)
@@ -114,4 +122,5 @@ class RequestCacheMiddleware(object):
         # environment is single-threaded per instance, each individual request
         # is guaranteed to start w/ a unique, empty CACHE dict.
         flush()
+        cache_stats.reset_request_stats()
         return self.app(environ, start_response)
@@ -189,3 +189,48 @@ class LogSummary(db.Model):
         query.filter('name =', name)
         return query
 
+
+
+class ClassDailyActivityRollup(db.Model):
+    """All of a coach's ClassDailyActivity LogSummary shards for a closed UTC
+    day, compacted into one entity.
+
+    Each of the coach's students' activity chunks is a row across the
+    parallel columns below. Times are seconds since the epoch, and students,
+    activity classes, videos and exercises are indices into the lists that
+    name them. A chunk's videos are the next video_counts[i] entries of
+    video_refs, and likewise for its exercises.
+
+    See classtime.ClassDailyActivitySummary for converting to and from these.
+    """
+    students = db.StringListProperty(indexed=False)
+    video_names = db.StringListProperty(indexed=False)
+    exercise_names = db.StringListProperty(indexed=False)
+
+    student_indices = db.ListProperty(int, indexed=False)
+    starts = db.ListProperty(int, indexed=False)
+    ends = db.ListProperty(int, indexed=False)
+    activity_classes = db.ListProperty(int, indexed=False)
+    video_counts = db.ListProperty(int, indexed=False)
+    video_refs = db.ListProperty(int, indexed=False)
+    exercise_counts = db.ListProperty(int, indexed=False)
+    exercise_refs = db.ListProperty(int, indexed=False)
+
+    # How long after a UTC day ends before no more activity is expected to be
+    # summarized into it, and it can be rolled up.
+    CLOSED_AFTER = datetime.timedelta(hours=2)
+
+    @staticmethod
+    def get_key_name(user_data, dt_start_utc):
+        return "%s:%s" % (user_data.key_email, dt_start_utc.strftime("%Y-%m-%d"))
+
+    @staticmethod
+    def get_key(user_data, dt_start_utc):
+        return db.Key.from_path(ClassDailyActivityRollup.kind(),
+                ClassDailyActivityRollup.get_key_name(user_data, dt_start_utc))
+
+    @staticmethod
+    def is_closed(dt_start_utc, dt_now_utc=None):
+        dt_now_utc = dt_now_utc or datetime.datetime.utcnow()
+        dt_end_utc = dt_start_utc + datetime.timedelta(days=1)
+        return dt_end_utc + ClassDailyActivityRollup.CLOSED_AFTER < dt_now_utc
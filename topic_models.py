@@ -15,6 +15,7 @@ A 'topic' the stuff after the # in urls like
 """
 
 import base64
+import copy
 import cPickle as pickle
 import datetime
 import logging
@@ -22,6 +23,7 @@ import os
 import re
 
 from google.appengine.api import taskqueue
+from google.appengine.datastore import entity_pb
 from google.appengine.ext import db
 from google.appengine.ext import deferred
 
@@ -335,12 +337,20 @@ class Topic(search.Searchable, db.Model):
     def get_library_data(self, node_dict=None):
         from homepage import thumbnail_link_dict
 
+        snapshot = TopicTreeSnapshot.get_for_topic(self)
+
         if node_dict:
             children = [ node_dict[c] for c in self.child_keys if c in node_dict ]
+        elif snapshot:
+            children = snapshot.child_entities(self.key())
         else:
             children = db.get(self.child_keys)
 
-        (thumbnail_video, thumbnail_topic) = self.get_first_video_and_topic()
+        if snapshot:
+            (thumbnail_video, thumbnail_topic) = snapshot.first_video_and_topic(
+                snapshot.index_by_key[self.key()])
+        else:
+            (thumbnail_video, thumbnail_topic) = self.get_first_video_and_topic()
 
         ret = {
             "id": self.id,
@@ -534,10 +544,16 @@ class Topic(search.Searchable, db.Model):
         return slug
 
     # Gets the data we need for the video player
+    def get_play_data(self):
+        snapshot = TopicTreeSnapshot.get_for_topic(self)
+        if snapshot:
+            return snapshot.play_data(self.key())
+        return self._get_play_data_from_datastore()
+
     @layer_cache.cache_with_key_fxn(lambda self:
         "topic_get_play_data_%s" % self.key(),
         layer=layer_cache.Layers.Memcache)
-    def get_play_data(self):
+    def _get_play_data_from_datastore(self):
 
         # Find last video in the previous topic
         previous_video = None
@@ -1018,12 +1034,18 @@ class Topic(search.Searchable, db.Model):
                 self.version.update()
             return self
 
+    def make_tree(self, types=[], include_hidden=False):
+        snapshot = TopicTreeSnapshot.get_for_topic(self)
+        if snapshot:
+            return snapshot.make_tree(self.key(), types, include_hidden)
+        return self._make_tree_from_datastore(types, include_hidden)
+
     @layer_cache.cache_with_key_fxn(
     lambda self, types=[], include_hidden=False:
             "topic.make_tree_%s_%s_%s" % (
             self.key(), types, include_hidden),
             layer=layer_cache.Layers.Memcache)
-    def make_tree(self, types=[], include_hidden=False):
+    def _make_tree_from_datastore(self, types=[], include_hidden=False):
         if include_hidden:
             nodes = Topic.all().filter("ancestor_keys =", self.key()).run()
         else:
@@ -1101,9 +1123,9 @@ class Topic(search.Searchable, db.Model):
 
         return match
 
-    def search_tree(self, query):
-        query = query.strip().lower()
-
+    def get_search_node_dict(self):
+        """ Returns all the topics and content under this topic, hidden or
+        not, keyed by their keys. """
         nodes = Topic.all().filter("ancestor_keys =", self.key()).run()
 
         node_dict = dict((node.key(), node) for node in nodes)
@@ -1120,6 +1142,17 @@ class Topic(search.Searchable, db.Model):
         for content in contentItems:
             node_dict[content.key()] = content
 
+        return node_dict
+
+    def search_tree(self, query):
+        query = query.strip().lower()
+
+        if not self.parent_keys:
+            # The whole tree is searched from the root, which has an index
+            return TopicSearchIndex.get(self.version).search(query)
+
+        node_dict = self.get_search_node_dict()
+
         matching_paths = []
         matching_nodes = []
 
@@ -1401,123 +1434,6 @@ class Topic(search.Searchable, db.Model):
             topic.indexed_title_changed()
 
     def get_user_progress(self, user_data, flatten=True):
-
-        def get_user_video_progress(video_id, user_video_dict):
-            status_flags = {}
-
-            id = '.v%d' % video_id
-
-            if id in user_video_dict['completed']:
-                status_flags["VideoCompleted"] = 1
-                status_flags["VideoStarted"] = 1
-
-            if id in user_video_dict['started']:
-                status_flags["VideoStarted"] = 1
-
-            if status_flags != {}:
-                return {
-                    "kind": "Video",
-                    "id": video_id,
-                    "status_flags": status_flags
-                }
-
-            return None
-
-        def get_user_exercise_progress(exercise_id, user_exercise_dict):
-            status_flags = {}
-
-            if exercise_id in user_exercise_dict:
-                exercise_dict = user_exercise_dict[exercise_id]
-
-                if exercise_dict["proficient"]:
-                    status_flags["ExerciseProficient"] = 1
-
-                if exercise_dict["struggling"]:
-                    status_flags["ExerciseStruggling"] = 1
-
-                if exercise_dict["total_done"] > 0:
-                    status_flags["ExerciseStarted"] = 1
-
-            if status_flags != {}:
-                return {
-                    "kind": "Exercise",
-                    "id": exercise_id,
-                    "status_flags": status_flags
-                }
-
-            return None
-
-        def get_user_progress_recurse(flat_output, topic, topics_dict, user_video_dict, user_exercise_dict):
-
-            children = []
-            status_flags = {}
-            aggregates = {
-                "video": {},
-                "exercise": {},
-                "topic": {}
-            }
-            counts = {
-                "video": 0,
-                "exercise": 0,
-                "topic": 0
-            }
-
-            for child_key in topic.child_keys:
-                if child_key.kind() == "Topic":
-                    if child_key in topics_dict:
-                        child_topic = topics_dict[child_key]
-                        progress = get_user_progress_recurse(flat_output, child_topic, topics_dict, user_video_dict, user_exercise_dict)
-                        if progress:
-                            children.append(progress)
-                            if flat_output:
-                                flat_output["topic"][child_topic.id] = progress
-                        counts["topic"] += 1
-
-                elif child_key.kind() == "Video":
-                    video_id = child_key.id()
-                    progress = get_user_video_progress(video_id, user_video_dict)
-                    if progress:
-                        children.append(progress)
-                        if flat_output:
-                            flat_output["video"][video_id] = progress
-                    counts["video"] += 1
-
-                elif child_key.kind() == "Exercise":
-                    exercise_id = child_key.id()
-                    progress = get_user_exercise_progress(exercise_id, user_exercise_dict)
-                    if progress:
-                        children.append(progress)
-                        if flat_output:
-                            flat_output["exercise"][exercise_id] = progress
-                    counts["exercise"] += 1
-                    pass
-
-            for child_stat in children:
-                kind = child_stat["kind"].lower()
-                for flag, value in child_stat["status_flags"].iteritems():
-                    if flag not in aggregates[kind]:
-                        aggregates[kind][flag] = 0
-                    aggregates[kind][flag] += value
-
-            for kind, aggregate in aggregates.iteritems():
-                for flag, value in aggregate.iteritems():
-                    if value >= counts[kind]:
-                        status_flags[flag] = 1
-
-            if children != [] or status_flags != {}:
-                stats = {
-                    "kind": "Topic",
-                    "id": topic.id,
-                    "status_flags": status_flags,
-                    "aggregates": aggregates,
-                    "counts": counts
-                }
-                if not flat_output:
-                    stats["children"] = children
-                return stats
-            else:
-                return None
-
         user_video_css = video_models.UserVideoCss.get_for_user_data(user_data)
         if user_video_css:
             user_video_dict = pickle.loads(user_video_css.pickled_dict)
@@ -1525,26 +1441,12 @@ class Topic(search.Searchable, db.Model):
             user_video_dict = {}
 
         user_exercise_graph = exercise_models.UserExerciseGraph.get(user_data)
-        user_exercise_dict = dict((exdict["id"], exdict) for name, exdict in user_exercise_graph.graph.iteritems())
-
-        topics = Topic.get_visible_topics()
-        topics_dict = dict((topic.key(), topic) for topic in topics)
-
-        flat_output = None
-        if flatten:
-            flat_output = {
-                "topic": {},
-                "video": {},
-                "exercise": {}
-            }
 
-        progress_tree = get_user_progress_recurse(flat_output, self, topics_dict, user_video_dict, user_exercise_dict)
+        layout = TopicProgressLayout.get()
+        bits = layout.user_bits(user_video_dict,
+                                user_exercise_graph.graph.itervalues())
 
-        if flat_output:
-            flat_output["topic"][self.id] = progress_tree
-            return flat_output
-        else:
-            return progress_tree
+        return layout.user_progress(self, bits, flatten)
 
 class UserTopic(db.Model):
     user = db.UserProperty()
@@ -1685,6 +1587,12 @@ def _preload_default_version_data(version_number, run_code):
     # Preload topic browsers
     preload_topic_browsers(version)
 
+    # Prerender the public library API responses. api.prerendered imports
+    # topic_models, so importing it at the top would create an import loop
+    from api import prerendered
+    prerendered.preload(version.number)
+    logging.info("prerendered library api responses")
+
     # Preload autocomplete cache
     autocomplete.video_title_dicts(version.number)
     logging.info("preloaded video autocomplete")
@@ -1890,6 +1798,11 @@ def _rebuild_content_caches(version_number, run_code):
     # Wipe the Exercises cache key
     setting_model.Setting.cached_exercises_date(str(datetime.datetime.now()))
 
+    # Build the snapshot that serves the tree now that this version is
+    # default, as the dates it's keyed on won't change again
+    TopicTreeSnapshot.get(version.number)
+    logging.info("built topic tree snapshot")
+
     logging.info("Rebuilt content topic caches. (" + str(found_videos) + " videos)")
     logging.info("set_default_version complete")
     setting_model.Setting.topic_admin_task_message("Publish: finished successfully")
@@ -2045,3 +1958,763 @@ class VersionContentChange(db.Model):
             change.delete()
 
         return change.content_changes
+
+
+class TopicProgressLayout(object):
+    """The shape of the default version's visible topic tree, laid out so
+    that Topic.get_user_progress can work on bit arrays.
+
+    Every video and exercise gets a dense index, so a user's state is one
+    integer per status flag with a bit set for each video or exercise that
+    has it. Each topic keeps a mask of its child videos and exercises, so the
+    number of children with a flag is a popcount instead of a loop, and only
+    topics with some progress below them look at their children one by one.
+    """
+
+    VIDEO_FLAGS = ["VideoCompleted", "VideoStarted"]
+    EXERCISE_FLAGS = ["ExerciseProficient", "ExerciseStruggling",
+                      "ExerciseStarted"]
+
+    def __init__(self):
+        self.video_ids = []
+        self.exercise_ids = []
+        # "video"/"exercise" -> {key id: dense index}
+        self.content_index = {"video": {}, "exercise": {}}
+        # topic key -> TopicProgressLayout.Entry
+        self.topics = {}
+
+    class Entry(object):
+        """ A topic's visible children and the masks of its content """
+
+        def __init__(self, topic_id, children, masks, counts):
+            self.topic_id = topic_id
+            # (kind, topic key or content index) in child_keys order; the
+            # index is None for content that isn't in the layout
+            self.children = children
+            # kind -> (offset, mask) with bit i of mask set for the content
+            # at index offset + i
+            self.masks = masks
+            self.counts = counts
+
+    @staticmethod
+    @layer_cache.cache_with_key_fxn(lambda:
+        "topic_progress_layout_%s" %
+        setting_model.Setting.topic_tree_version(),
+        layer=layer_cache.Layers.InAppMemory | layer_cache.Layers.Memcache)
+    def get():
+        snapshot = None
+        version_number = setting_model.Setting.topic_tree_version()
+        if version_number:
+            snapshot = TopicTreeSnapshot.get(int(version_number))
+
+        if snapshot:
+            topics_dict = snapshot.visible_topics_dict()
+        else:
+            topics = Topic.get_visible_topics()
+            topics_dict = dict((topic.key(), topic) for topic in topics)
+
+        return TopicProgressLayout.build(topics_dict)
+
+    @staticmethod
+    def build(topics_dict):
+        layout = TopicProgressLayout()
+
+        # Content is numbered topic by topic, so that most topics' children
+        # are close together and their masks stay short
+        for topic in topics_dict.itervalues():
+            for child_key in topic.child_keys:
+                if child_key.kind() == "Video":
+                    layout._add_content("video", child_key.id())
+                elif child_key.kind() == "Exercise":
+                    layout._add_content("exercise", child_key.id())
+
+        for key, topic in topics_dict.iteritems():
+            layout.topics[key] = layout._make_entry(topic, topics_dict)
+
+        return layout
+
+    def _add_content(self, kind, id):
+        index = self.content_index[kind]
+        if id not in index:
+            ids = self.video_ids if kind == "video" else self.exercise_ids
+            index[id] = len(ids)
+            ids.append(id)
+
+    def _make_entry(self, topic, topics_dict):
+        children = []
+        indices = {"video": [], "exercise": []}
+        counts = {"video": 0, "exercise": 0, "topic": 0}
+
+        for child_key in topic.child_keys:
+            if child_key.kind() == "Topic":
+                if child_key in topics_dict:
+                    children.append(("topic", child_key))
+                    counts["topic"] += 1
+
+            elif child_key.kind() in ("Video", "Exercise"):
+                kind = child_key.kind().lower()
+                i = self.content_index[kind].get(child_key.id())
+                children.append((kind, i))
+                if i is not None:
+                    indices[kind].append(i)
+                counts[kind] += 1
+
+        masks = {}
+        for kind, kind_indices in indices.iteritems():
+            offset = min(kind_indices) if kind_indices else 0
+            mask = 0
+            for i in kind_indices:
+                mask |= 1 << (i - offset)
+            masks[kind] = (offset, mask)
+
+        return TopicProgressLayout.Entry(topic.id, children, masks, counts)
+
+    @staticmethod
+    def bit_count(bits):
+        # Topics have few children, so few bits are ever set
+        count = 0
+        while bits:
+            bits &= bits - 1
+            count += 1
+        return count
+
+    def user_bits(self, user_video_dict, exercise_graph_dicts):
+        """ Packs a user's UserVideoCss dict and UserExerciseGraph dicts into
+        {status flag: bit array}.
+        """
+        bits = dict((flag, 0) for flag in
+                    TopicProgressLayout.VIDEO_FLAGS +
+                    TopicProgressLayout.EXERCISE_FLAGS)
+
+        video_index = self.content_index["video"]
+        for state, flags in (("completed", ["VideoCompleted", "VideoStarted"]),
+                             ("started", ["VideoStarted"])):
+            for css_id in user_video_dict.get(state, []):
+                # UserVideoCss ids are the videos' CSS selectors, '.v<id>'
+                i = video_index.get(int(css_id[2:]))
+                if i is not None:
+                    for flag in flags:
+                        bits[flag] |= 1 << i
+
+        exercise_index = self.content_index["exercise"]
+        for exercise_dict in exercise_graph_dicts:
+            i = exercise_index.get(exercise_dict["id"])
+            if i is None:
+                continue
+            if exercise_dict["proficient"]:
+                bits["ExerciseProficient"] |= 1 << i
+            if exercise_dict["struggling"]:
+                bits["ExerciseStruggling"] |= 1 << i
+            if exercise_dict["total_done"] > 0:
+                bits["ExerciseStarted"] |= 1 << i
+
+        return bits
+
+    def user_progress(self, topic, bits, flatten=True):
+        """ Returns the same output as Topic.get_user_progress for the user
+        whose state is in bits (see user_bits).
+        """
+        kind_flags = {
+            "video": TopicProgressLayout.VIDEO_FLAGS,
+            "exercise": TopicProgressLayout.EXERCISE_FLAGS,
+        }
+        kind_ids = {"video": self.video_ids, "exercise": self.exercise_ids}
+
+        # Content with any flag at all
+        any_bits = {}
+        for kind, flags in kind_flags.iteritems():
+            any_bits[kind] = 0
+            for flag in flags:
+                any_bits[kind] |= bits[flag]
+
+        flat_output = None
+        if flatten:
+            flat_output = {
+                "topic": {},
+                "video": {},
+                "exercise": {}
+            }
+
+        def content_progress(kind, i):
+            if i is None or not (any_bits[kind] >> i) & 1:
+                return None
+
+            status_flags = {}
+            for flag in kind_flags[kind]:
+                if (bits[flag] >> i) & 1:
+                    status_flags[flag] = 1
+
+            return {
+                "kind": kind.capitalize(),
+                "id": kind_ids[kind][i],
+                "status_flags": status_flags
+            }
+
+        topic_progress_memo = {}
+
+        def topic_progress(key, entry):
+            if key in topic_progress_memo:
+                return topic_progress_memo[key]
+
+            aggregates = {
+                "video": {},
+                "exercise": {},
+                "topic": {}
+            }
+
+            has_progress = False
+            for kind, flags in kind_flags.iteritems():
+                offset, mask = entry.masks[kind]
+                if not (any_bits[kind] >> offset) & mask:
+                    continue
+
+                has_progress = True
+                for flag in flags:
+                    count = TopicProgressLayout.bit_count(
+                        (bits[flag] >> offset) & mask)
+                    if count:
+                        aggregates[kind][flag] = count
+
+            child_progress = {}
+            for kind, child_key in entry.children:
+                if kind == "topic":
+                    progress = topic_progress(child_key, self.topics[child_key])
+                    if progress:
+                        has_progress = True
+                        child_progress[child_key] = progress
+                        topic_aggregates = aggregates["topic"]
+                        for flag, value in progress["status_flags"].iteritems():
+                            topic_aggregates[flag] = topic_aggregates.get(flag, 0) + value
+
+            if not has_progress:
+                topic_progress_memo[key] = None
+                return None
+
+            status_flags = {}
+            for kind, aggregate in aggregates.iteritems():
+                for flag, value in aggregate.iteritems():
+                    if value >= entry.counts[kind]:
+                        status_flags[flag] = 1
+
+            children = []
+            for kind, child in entry.children:
+                if kind == "topic":
+                    progress = child_progress.get(child)
+                else:
+                    progress = content_progress(kind, child)
+
+                if progress:
+                    children.append(progress)
+                    if flat_output:
+                        flat_output[kind][progress["id"]] = progress
+
+            stats = {
+                "kind": "Topic",
+                "id": entry.topic_id,
+                "status_flags": status_flags,
+                "aggregates": aggregates,
+                "counts": dict(entry.counts)
+            }
+            if not flat_output:
+                stats["children"] = children
+
+            topic_progress_memo[key] = stats
+            return stats
+
+        entry = self.topics.get(topic.key())
+        if entry is None:
+            # e.g. the root, which is hidden
+            entry = self._make_entry(topic, self.topics)
+        progress_tree = topic_progress(topic.key(), entry)
+
+        if flat_output:
+            flat_output["topic"][topic.id] = progress_tree
+            return flat_output
+        else:
+            return progress_tree
+
+
+class TopicSearchIndex(object):
+    """An n-gram index over the titles and readable ids of a topic tree.
+
+    It answers the same queries as Topic.search_tree_traversal, with the same
+    output, but only looks at the nodes sharing all of the query's n-grams
+    instead of walking the whole tree. Each place a node appears in the tree
+    is an "occurrence" (content can appear under several topics), numbered in
+    the order the traversal would visit them.
+    """
+
+    NGRAM_LENGTH = 3
+
+    def __init__(self):
+        # per occurrence: the lowercased strings a query is matched against,
+        # the path it adds to "paths", its enclosing topic occurrence (-1 for
+        # the root), and what it adds to "nodes"
+        self.texts = []
+        self.paths = []
+        self.parents = []
+        self.is_topic = []
+        self.nodes = []
+        # position of each occurrence's entry in "nodes": content is added
+        # when visited, topics after all their children
+        self.node_order = []
+        # n-gram -> set of occurrences with that n-gram in one of its texts
+        self.ngrams = {}
+
+    @staticmethod
+    @layer_cache.cache_with_key_fxn(lambda version:
+        "topic_search_index_%s_%s" % (version.number, version.updated_on),
+        layer=layer_cache.Layers.InAppMemory | layer_cache.Layers.Memcache)
+    def get(version):
+        root = Topic.get_root(version)
+        node_dict = root.get_search_node_dict()
+
+        # Saves get_visible_data a version lookup per topic
+        for node in node_dict.itervalues():
+            if isinstance(node, Topic):
+                node.version = version
+
+        return TopicSearchIndex.build(root, node_dict)
+
+    @staticmethod
+    def build(root, node_dict):
+        index = TopicSearchIndex()
+        counter = [0]
+
+        def next_order():
+            counter[0] += 1
+            return counter[0]
+
+        def add(node, texts, path, parent, is_topic):
+            o = len(index.texts)
+            index.texts.append(texts)
+            index.paths.append(path)
+            index.parents.append(parent)
+            index.is_topic.append(is_topic)
+            index.nodes.append(node)
+            index.node_order.append(None)
+
+            n = TopicSearchIndex.NGRAM_LENGTH
+            for text in texts:
+                for i in xrange(len(text) - n + 1):
+                    index.ngrams.setdefault(text[i:i + n], set()).add(o)
+
+            return o
+
+        def visit(topic, path, parent):
+            o = add(None, [topic.title.lower()], path + ['Topic'], parent,
+                    True)
+
+            for child_key in topic.child_keys:
+                if not node_dict.has_key(child_key):
+                    continue
+
+                child = node_dict[child_key]
+                if child_key.kind() == 'Topic':
+                    visit(child, path + [child.id], o)
+                else:
+                    title = getattr(child, "title", getattr(child, "display_name", ""))
+                    id = getattr(child, "id", getattr(child, "readable_id", getattr(child, "name", child.key().id())))
+                    c = add(child, [title.lower(), str(id).lower()],
+                            path + [id, child_key.kind()], o, False)
+                    index.node_order[c] = next_order()
+
+            index.nodes[o] = topic.get_visible_data(node_dict)
+            index.node_order[o] = next_order()
+
+        visit(root, [], -1)
+        return index
+
+    def search(self, query):
+        n = TopicSearchIndex.NGRAM_LENGTH
+
+        if len(query) < n:
+            # Too short to use the index
+            candidates = xrange(len(self.texts))
+        else:
+            postings = [self.ngrams.get(query[i:i + n], set())
+                        for i in xrange(len(query) - n + 1)]
+            postings.sort(key=len)
+            candidates = [o for o in postings[0]
+                          if all(o in posting for posting in postings[1:])]
+            candidates.sort()
+
+        matches = [o for o in candidates
+                   if any(text.find(query) > -1 for text in self.texts[o])]
+
+        # A topic is in the results if it or anything below it matched
+        matching_topics = {}
+        for o in matches:
+            t = o if self.is_topic[o] else self.parents[o]
+            while t != -1 and t not in matching_topics:
+                matching_topics[t] = True
+                t = self.parents[t]
+
+        node_occurrences = [o for o in matches if not self.is_topic[o]]
+        node_occurrences.extend(matching_topics.keys())
+        node_occurrences.sort(key=lambda o: self.node_order[o])
+
+        return {
+            "paths": [self.paths[o] for o in matches],
+            "nodes": [self.nodes[o] for o in node_occurrences]
+        }
+
+
+class TopicTreeSnapshot(object):
+    """A compact, read-only copy of a published topic tree.
+
+    It is built when a version is published, and again after its content is
+    edited or the app is deployed. It's stored chunked in the datastore and
+    memcache through layer_cache, and kept unpickled in each instance's
+    memory. For the default version, make_tree, get_library_data,
+    get_play_data and get_user_progress are then answered from the snapshot
+    without any datastore RPCs.
+
+    Every topic and content item reachable from the root gets a dense node
+    index, in depth-first order with the root at 0. children and parents
+    hold node indexes, and kinds, ids, titles and hidden are per-node
+    summaries. The entities themselves are kept as encoded protobufs and
+    only decoded the first time they're needed in an instance.
+    """
+
+    # Bump this whenever the layout of the snapshot changes
+    FORMAT_VERSION = 1
+
+    def __init__(self, version_number, version_key):
+        self.version_number = version_number
+        self.version_key = version_key
+        self.keys = []
+        self.kinds = []
+        self.ids = []
+        self.titles = []
+        self.hidden = []
+        self.children = []
+        self.parents = []
+        self.protobufs = []
+        # node index -> {attribute: value} for non-property attributes
+        # (like an exercise's related_video_readable_ids) to set on decode
+        self.extra_attrs = {}
+        self._init_lookups()
+
+    def _init_lookups(self):
+        self.index_by_key = dict((key, i) for i, key in enumerate(self.keys))
+        self._entities = [None] * len(self.keys)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["index_by_key"]
+        del state["_entities"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_lookups()
+
+    @staticmethod
+    @layer_cache.cache_with_key_fxn(lambda version_number:
+        "topic_tree_snapshot_%s_v%s_%s_%s" % (version_number,
+            TopicTreeSnapshot.FORMAT_VERSION,
+            setting_model.Setting.cached_content_add_date(),
+            setting_model.Setting.cached_exercises_date()),
+        # A version's tree doesn't change once published, but its content
+        # entities can be edited in place, which changes one of the dates
+        # above, and a deploy can change how the snapshot is built, which is
+        # why it isn't kept across app versions. It's rebuilt at the end of
+        # publishing rather than on a user request, and the expiration is
+        # only a backstop for edits that slip past the dates.
+        expiration=60 * 60 * 24,
+        use_chunks=True,
+        layer=layer_cache.Layers.InAppMemory | layer_cache.Layers.Memcache |
+              layer_cache.Layers.Datastore)
+    def get(version_number):
+        version = TopicVersion.get_by_number(version_number)
+        if version is None:
+            return layer_cache.UncachedResult(None)
+        return TopicTreeSnapshot.build(version)
+
+    @staticmethod
+    def get_for_topic(topic):
+        """ Returns the default version's snapshot if topic is part of it,
+        otherwise None and callers should fall back to the datastore.
+        """
+        if not topic.is_saved():
+            return None
+
+        version_number = setting_model.Setting.topic_tree_version()
+        if not version_number:
+            return None
+
+        snapshot = TopicTreeSnapshot.get(int(version_number))
+        if (snapshot and
+            snapshot.version_key == Topic.version.get_value_for_datastore(topic)
+            and topic.key() in snapshot.index_by_key):
+            return snapshot
+
+        return None
+
+    @staticmethod
+    def build(version):
+        root = Topic.get_root(version)
+        topics = Topic.all().filter("version =", version).fetch(10000)
+        topic_dict = dict((t.key(), t) for t in topics)
+
+        content_keys = set()
+        for topic in topics:
+            content_keys.update([c for c in topic.child_keys
+                                 if c.kind() != "Topic"])
+        content_dict = dict((c.key(), c) for c in db.get(list(content_keys))
+                            if c)
+
+        changes = VersionContentChange.get_updated_content_dict(version)
+        content_dict.update(dict((k, c) for k, c in changes.iteritems()
+                                 if k in content_dict))
+
+        evs = exercise_video_model.ExerciseVideo.all().fetch(10000)
+        exercise_dict = dict((k, v) for k, v in content_dict.iteritems()
+                             if k.kind() == "Exercise")
+        video_dict = dict((k, v) for k, v in content_dict.iteritems()
+                          if k.kind() == "Video")
+        exercise_models.Exercise.add_related_video_readable_ids_prop(
+            exercise_dict, evs, video_dict)
+
+        snapshot = TopicTreeSnapshot(version.number, version.key())
+        entities = []
+
+        def add_node(entity):
+            i = len(snapshot.keys)
+            key = entity.key()
+            snapshot.keys.append(key)
+            snapshot.kinds.append(key.kind())
+            snapshot.ids.append(getattr(entity, "id",
+                getattr(entity, "readable_id",
+                    getattr(entity, "name", key.id()))))
+            snapshot.titles.append(getattr(entity, "title",
+                getattr(entity, "display_name", "")))
+            snapshot.hidden.append(bool(getattr(entity, "hide", False)))
+            snapshot.children.append([])
+            snapshot.parents.append([])
+            snapshot.index_by_key[key] = i
+            entities.append(entity)
+            return i
+
+        def add_topic(topic, parent_ids):
+            i = add_node(topic)
+
+            # Precompute what get_extended_slug would otherwise look up
+            if len(parent_ids) > 1:
+                topic.extended_slug = "%s/%s" % ("/".join(parent_ids[1:]),
+                                                 topic.id)
+            else:
+                topic.extended_slug = topic.id
+
+            for child_key in topic.child_keys:
+                if child_key in snapshot.index_by_key:
+                    # content can live in several topics, topics can't
+                    if child_key.kind() == "Topic":
+                        continue
+                    j = snapshot.index_by_key[child_key]
+                elif child_key in topic_dict:
+                    j = add_topic(topic_dict[child_key],
+                                  parent_ids + [topic.id])
+                elif child_key in content_dict:
+                    j = add_node(content_dict[child_key])
+                else:
+                    continue
+
+                snapshot.children[i].append(j)
+                snapshot.parents[j].append(i)
+
+            return i
+
+        add_topic(root, [])
+
+        for i, entity in enumerate(entities):
+            if snapshot.kinds[i] == "Topic":
+                continue
+
+            # Match what _rebuild_content_caches is about to write
+            entity.topic_string_keys = [str(snapshot.keys[p])
+                                        for p in snapshot.parents[i]
+                                        if not snapshot.hidden[p]]
+
+            if snapshot.kinds[i] == "Exercise":
+                snapshot.extra_attrs[i] = {
+                    "related_video_keys": entity.related_video_keys,
+                    "related_video_readable_ids":
+                        entity.related_video_readable_ids,
+                }
+
+        snapshot.protobufs = [db.model_to_protobuf(e).Encode()
+                              for e in entities]
+        snapshot._init_lookups()
+
+        logging.info("Built topic tree snapshot for version %s: %i nodes" %
+                     (version.number, len(snapshot.keys)))
+        return snapshot
+
+    def entity(self, i):
+        """ The decoded entity for node i. It is shared by every request in
+        this instance, so callers that modify it must copy it first.
+        """
+        entity = self._entities[i]
+        if entity is None:
+            entity = db.model_from_protobuf(
+                entity_pb.EntityProto(self.protobufs[i]))
+            for name, value in self.extra_attrs.get(i, {}).iteritems():
+                setattr(entity, name, value)
+            self._entities[i] = entity
+        return entity
+
+    def entity_for_key(self, key):
+        return self.entity(self.index_by_key[key])
+
+    def child_entities(self, key):
+        return [self.entity(j)
+                for j in self.children[self.index_by_key[key]]]
+
+    def ancestors(self, i):
+        """ Node indexes of i's ancestors, parent first and root last """
+        ancestors = []
+        while self.parents[i]:
+            i = self.parents[i][0]
+            ancestors.append(i)
+        return ancestors
+
+    def visible_topics_dict(self):
+        return dict((self.keys[i], self.entity(i))
+                    for i in xrange(len(self.keys))
+                    if self.kinds[i] == "Topic" and not self.hidden[i])
+
+    def make_tree(self, key, types=[], include_hidden=False):
+        """ Same as Topic.make_tree, on fresh copies of the entities so that
+        callers can hang whatever they want off of them.
+        """
+        def include(j):
+            if self.kinds[j] == "Topic":
+                return include_hidden or not self.hidden[j]
+            return (self.kinds[j] in types or
+                    (len(types) == 0 and self.kinds[j] != "Topic"))
+
+        def copy_tree(i):
+            node = copy.copy(self.entity(i))
+            if self.kinds[i] == "Topic":
+                node.children = [copy_tree(j) for j in self.children[i]
+                                 if include(j)]
+            return node
+
+        return copy_tree(self.index_by_key[key])
+
+    def _child_videos(self, i):
+        return [self.entity(j) for j in self.children[i]
+                if self.kinds[j] == "Video"]
+
+    def _visible_child_topics(self, i):
+        return [j for j in self.children[i]
+                if self.kinds[j] == "Topic" and not self.hidden[j]]
+
+    def first_video_and_topic(self, i):
+        videos = self._child_videos(i)
+        if videos:
+            return (videos[0], self.entity(i))
+
+        for j in self._visible_child_topics(i):
+            ret = self.first_video_and_topic(j)
+            if ret != (None, None):
+                return ret
+
+        return (None, None)
+
+    def last_video_and_topic(self, i):
+        videos = self._child_videos(i)
+        if videos:
+            return (videos[-1], self.entity(i))
+
+        for j in reversed(self._visible_child_topics(i)):
+            ret = self.last_video_and_topic(j)
+            if ret != (None, None):
+                return ret
+
+        return (None, None)
+
+    def _sibling_topic(self, i, step):
+        """ Node index of the closest visible topic before (step=-1) or
+        after (step=1) i, going up the tree like Topic.get_previous_topic
+        """
+        while self.parents[i]:
+            parent = self.parents[i][0]
+            siblings = [j for j in self.children[parent]
+                        if self.kinds[j] == "Topic"]
+            pos = siblings.index(i) + step
+            while 0 <= pos < len(siblings):
+                if not self.hidden[siblings[pos]]:
+                    return siblings[pos]
+                pos += step
+            i = parent
+        return None
+
+    def play_data(self, key):
+        """ Same as Topic.get_play_data """
+        i = self.index_by_key[key]
+        topic = self.entity(i)
+
+        # Find last video in the previous topic
+        previous_video = None
+        previous_video_topic = None
+        previous_topic = i
+
+        while not previous_video:
+            previous_topic = self._sibling_topic(previous_topic, -1)
+            # Don't iterate past the end of the current top-level topic
+            if previous_topic is not None and len(self.ancestors(previous_topic)) > 1:
+                (previous_video, previous_video_topic) = self.last_video_and_topic(previous_topic)
+            else:
+                break
+
+        # Find first video in the next topic
+        next_video = None
+        next_video_topic = None
+        next_topic = i
+
+        while not next_video:
+            next_topic = self._sibling_topic(next_topic, 1)
+            # Don't iterate past the end of the current top-level topic
+            if next_topic is not None and len(self.ancestors(next_topic)) > 1:
+                (next_video, next_video_topic) = self.first_video_and_topic(next_topic)
+            else:
+                break
+
+        previous_topic = (self.entity(previous_topic)
+                          if previous_topic is not None else None)
+        next_topic = (self.entity(next_topic)
+                      if next_topic is not None else None)
+
+        videos_dict = [{
+            "readable_id": v.readable_id,
+            "key_id": v.key().id(),
+            "title": v.title
+        } for v in self._child_videos(i)]
+
+        ancestors = [self.entity(a) for a in self.ancestors(i)]
+        ancestor_topics = [{
+            "title": t.title,
+            "url": (t.topic_page_url if t.id in Topic._super_topic_ids
+                    or t.has_content() else None)
+            }
+            for t in ancestors][0:-1]
+        ancestor_topics.reverse()
+
+        return {
+            'id': topic.id,
+            'title': topic.title,
+            'url': topic.topic_page_url,
+            'extended_slug': topic.get_extended_slug(),
+            'ancestor_topics': ancestor_topics,
+            'top_level_topic': ancestors[-2].id if len(ancestors) > 1 else topic.id,
+            'videos': videos_dict,
+            'previous_topic_title': previous_topic.standalone_title if previous_topic else None,
+            'previous_topic_video': previous_video.readable_id if previous_video else None,
+            'previous_topic_subtopic_slug': previous_video_topic.get_extended_slug() if previous_video_topic else None,
+            'next_topic_title': next_topic.standalone_title if next_topic else None,
+            'next_topic_video': next_video.readable_id if next_video else None,
+            'next_topic_subtopic_slug': next_video_topic.get_extended_slug() if next_video_topic else None
+        }
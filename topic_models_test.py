@@ -0,0 +1,363 @@
+import datetime
+import logging
+import time
+
+from mock import patch
+
+from third_party.agar.test import BaseTest
+
+import exercise_models
+import setting_model
+import topic_models
+import url_model
+import video_models
+from testutil import testsize
+
+
+class TopicSearchIndexTest(BaseTest):
+    def setUp(self):
+        super(TopicSearchIndexTest, self).setUp()
+
+        version = topic_models.TopicVersion.create_new_version()
+        version.edit = True
+        version.put()
+
+        self.root = topic_models.Topic.insert(title="The Root", parent=None,
+            version=version, id="root")
+        algebra = topic_models.Topic.insert(title="Algebra",
+            parent=self.root, id="algebra")
+        # Inserting a subtopic updates a fresh copy of its parent, so content
+        # is added to algebra before its subtopic
+        algebra.add_child(self.make_url("Algebra basics"))
+        linear = topic_models.Topic.insert(title="Linear equations",
+            parent=algebra, id="linear-equations")
+        geometry = topic_models.Topic.insert(title="Geometry",
+            parent=self.root, id="geometry")
+
+        shared = self.make_url("Solving equations")
+        linear.add_child(shared)
+        linear.add_child(self.make_url("Slope of a line"))
+        geometry.add_child(shared)
+        geometry.add_child(self.make_url("Angles"))
+
+        self.root = topic_models.Topic.get_root(version)
+
+    def make_url(self, title):
+        url = url_model.Url(title=title, url="http://example.com/")
+        url.put()
+        return url
+
+    def assert_same_results(self, query):
+        node_dict = self.root.get_search_node_dict()
+        index = topic_models.TopicSearchIndex.build(self.root, node_dict)
+
+        paths = []
+        nodes = []
+        self.root.search_tree_traversal(query, node_dict, [], paths, nodes)
+        results = index.search(query)
+
+        self.assertEqual(paths, results["paths"])
+        self.assertEqual([n.key() for n in nodes],
+                         [n.key() for n in results["nodes"]])
+
+    def test_matches_traversal(self):
+        for query in ["equations", "algebra", "geometry", "line", "angles",
+                      "root", "a", "an", "", "missing"]:
+            self.assert_same_results(query)
+
+    def test_matches_content_in_several_topics(self):
+        node_dict = self.root.get_search_node_dict()
+        index = topic_models.TopicSearchIndex.build(self.root, node_dict)
+
+        results = index.search("solving")
+        self.assertEqual(2, len(results["paths"]))
+        self.assert_same_results("solving")
+
+    @testsize.large()
+    def test_benchmark(self):
+        # A synthetic tree of about 20k nodes: 50 subjects of 20 topics of
+        # 19 videos each
+        version = topic_models.TopicVersion.create_new_version()
+        words = ["adding", "fractions", "linear", "equations", "slope",
+                 "angles", "triangles", "limits", "derivatives", "vectors",
+                 "matrices", "probability", "cells", "atoms", "energy"]
+
+        node_dict = {}
+
+        def add_topic(id, child_keys):
+            topic = topic_models.Topic(key_name=id, id=id,
+                title=" ".join([words[hash(id) % len(words)], id]),
+                version=version, child_keys=child_keys)
+            node_dict[topic.key()] = topic
+            return topic
+
+        subject_keys = []
+        for i in range(50):
+            topic_keys = []
+            for j in range(20):
+                url_keys = []
+                for k in range(19):
+                    n = (i * 20 + j) * 19 + k
+                    url = url_model.Url(key_name="url-%d" % n,
+                        title="%s and %s %d" % (words[n % len(words)],
+                            words[(n / len(words)) % len(words)], n),
+                        url="http://example.com/")
+                    node_dict[url.key()] = url
+                    url_keys.append(url.key())
+                topic_keys.append(add_topic("topic-%d-%d" % (i, j),
+                                            url_keys).key())
+            subject_keys.append(add_topic("subject-%d" % i,
+                                          topic_keys).key())
+        root = add_topic("root", subject_keys)
+
+        queries = ["slope and cells 1234", "fractions and atoms",
+                   "subject-42", "topic-7-1", "vectors", "missing"]
+
+        start = time.time()
+        index = topic_models.TopicSearchIndex.build(root, node_dict)
+        build_time = time.time() - start
+
+        start = time.time()
+        for query in queries:
+            root.search_tree_traversal(query, node_dict, [], [], [])
+        traversal_time = time.time() - start
+
+        class CountingList(list):
+            lookups = 0
+
+            def __getitem__(self, i):
+                CountingList.lookups += 1
+                return list.__getitem__(self, i)
+
+        index.texts = CountingList(index.texts)
+
+        start = time.time()
+        for query in queries:
+            index.search(query)
+        index_time = time.time() - start
+
+        logging.info("%d nodes, %d queries: %.3fs traversing, %.3fs with "
+                     "the index, which took %.3fs to build" % (
+                         len(node_dict), len(queries), traversal_time,
+                         index_time, build_time))
+
+        # Timings vary too much from machine to machine to compare, but the
+        # traversal searches the text of every node for every query, and
+        # the index should only have to search a few of them
+        self.assertTrue(CountingList.lookups * 10 <
+                        len(node_dict) * len(queries))
+
+
+class TopicProgressLayoutTest(BaseTest):
+    def setUp(self):
+        super(TopicProgressLayoutTest, self).setUp()
+
+        self.version = topic_models.TopicVersion.create_new_version()
+
+        # root (hidden)
+        #  |- a: videos 1, 2 and exercise 10
+        #  \- b: video 2 and topic c
+        #      \- c: exercise 11
+        self.c = self.make_topic("c", [self.exercise(11)])
+        self.b = self.make_topic("b", [self.video(2), self.c.key()])
+        self.a = self.make_topic("a",
+            [self.video(1), self.video(2), self.exercise(10)])
+        self.root = self.make_topic("root", [self.a.key(), self.b.key()])
+
+        topics_dict = dict((t.key(), t) for t in [self.a, self.b, self.c])
+        self.layout = topic_models.TopicProgressLayout.build(topics_dict)
+
+        user_video_dict = {
+            "completed": set([".v1"]),
+            "started": set([".v2"]),
+        }
+        exercise_dicts = [
+            self.exercise_dict(10, proficient=True, total_done=5),
+            self.exercise_dict(11, total_done=1),
+            self.exercise_dict(12, proficient=True, total_done=5),
+        ]
+        self.bits = self.layout.user_bits(user_video_dict, exercise_dicts)
+
+    def make_topic(self, id, child_keys):
+        return topic_models.Topic(key_name=id, id=id, title=id,
+                                  version=self.version, child_keys=child_keys)
+
+    def video(self, id):
+        return topic_models.db.Key.from_path("Video", id)
+
+    def exercise(self, id):
+        return topic_models.db.Key.from_path("Exercise", id)
+
+    def exercise_dict(self, id, proficient=False, struggling=False,
+                      total_done=0):
+        return {
+            "id": id,
+            "proficient": proficient,
+            "struggling": struggling,
+            "total_done": total_done,
+        }
+
+    def test_flat(self):
+        progress = self.layout.user_progress(self.root, self.bits)
+
+        self.assertEqual(["a", "b", "c", "root"],
+                         sorted(progress["topic"].keys()))
+        self.assertEqual({"VideoCompleted": 1, "VideoStarted": 1},
+                         progress["video"][1]["status_flags"])
+        self.assertEqual({"VideoStarted": 1},
+                         progress["video"][2]["status_flags"])
+        self.assertEqual({"ExerciseStarted": 1},
+                         progress["exercise"][11]["status_flags"])
+        self.assertFalse(12 in progress["exercise"])
+
+        a = progress["topic"]["a"]
+        self.assertEqual({"VideoCompleted": 1, "VideoStarted": 2},
+                         a["aggregates"]["video"])
+        self.assertEqual({"ExerciseProficient": 1, "ExerciseStarted": 1},
+                         a["aggregates"]["exercise"])
+        self.assertEqual({"video": 2, "exercise": 1, "topic": 0},
+                         a["counts"])
+        self.assertEqual({"VideoStarted": 1, "ExerciseProficient": 1,
+                          "ExerciseStarted": 1}, a["status_flags"])
+        self.assertFalse("children" in a)
+
+        self.assertEqual({"VideoStarted": 1, "ExerciseStarted": 1},
+                         progress["topic"]["b"]["status_flags"])
+
+        root = progress["topic"]["root"]
+        self.assertEqual({"VideoStarted": 2, "ExerciseProficient": 1,
+                          "ExerciseStarted": 2}, root["aggregates"]["topic"])
+        self.assertEqual({"VideoStarted": 1, "ExerciseStarted": 1},
+                         root["status_flags"])
+
+    def test_tree(self):
+        progress = self.layout.user_progress(self.root, self.bits,
+                                             flatten=False)
+
+        self.assertEqual(["a", "b"], [c["id"] for c in progress["children"]])
+        b = progress["children"][1]
+        self.assertEqual([("Video", 2), ("Topic", "c")],
+                         [(c["kind"], c["id"]) for c in b["children"]])
+
+    def test_no_progress(self):
+        bits = self.layout.user_bits({}, [])
+        progress = self.layout.user_progress(self.root, bits)
+        self.assertEqual(None, progress["topic"]["root"])
+        self.assertEqual({}, progress["video"])
+
+
+class TopicTreeSnapshotTest(BaseTest):
+    def setUp(self):
+        super(TopicTreeSnapshotTest, self).setUp()
+
+        self.version = topic_models.TopicVersion.create_new_version()
+        self.version.edit = True
+        self.version.put()
+
+        # root
+        #  \- math
+        #      |- algebra: videos 1 and 2, a url
+        #      |- secret (hidden): video 3
+        #      \- geometry: video 4, the angles exercise
+        root = topic_models.Topic.insert(title="The Root", parent=None,
+            version=self.version, id="root")
+        math = topic_models.Topic.insert(title="Math", parent=root,
+                                         id="math")
+        algebra = topic_models.Topic.insert(title="Algebra", parent=math,
+                                            id="algebra")
+        secret = topic_models.Topic.insert(title="Secret", parent=math,
+                                           id="secret", hide=True)
+        geometry = topic_models.Topic.insert(title="Geometry", parent=math,
+                                             id="geometry")
+
+        algebra.add_child(self.make_video(1))
+        algebra.add_child(self.make_video(2))
+        url = url_model.Url(title="Algebra basics", url="http://example.com/")
+        url.put()
+        algebra.add_child(url)
+        secret.add_child(self.make_video(3))
+        geometry.add_child(self.make_video(4))
+        exercise = exercise_models.Exercise(name="angles", prerequisites=[],
+                                            covers=[], author=None, live=True)
+        exercise.put()
+        geometry.add_child(exercise)
+
+        self.snapshot = topic_models.TopicTreeSnapshot.build(self.version)
+
+    def make_video(self, i):
+        video = video_models.Video(readable_id="video-%s" % i,
+                                   title="Video %s" % i,
+                                   youtube_id="youtube%s" % i)
+        video.put()
+        return video
+
+    def topic(self, id):
+        return topic_models.Topic.get_by_id(id, self.version)
+
+    def shape(self, node):
+        """ The keys in a make_tree tree, with each topic's children """
+        if node.key().kind() != "Topic":
+            return node.key()
+        return (node.key(), [self.shape(c) for c in node.children])
+
+    def test_make_tree_matches_datastore(self):
+        for id in ["root", "math", "algebra", "secret"]:
+            key = self.topic(id).key()
+            for types in [[], ["Video"], ["Url"], ["Exercise"],
+                          ["Video", "Exercise"]]:
+                for include_hidden in [False, True]:
+                    self.assertEqual(
+                        self.shape(self.topic(id)._make_tree_from_datastore(
+                            types, include_hidden)),
+                        self.shape(self.snapshot.make_tree(
+                            key, types, include_hidden)))
+
+    def test_make_tree_skips_hidden_topics(self):
+        tree = self.snapshot.make_tree(self.topic("math").key())
+        self.assertEqual(["algebra", "geometry"],
+                         [c.id for c in tree.children])
+
+        tree = self.snapshot.make_tree(self.topic("math").key(),
+                                       include_hidden=True)
+        self.assertEqual(["algebra", "secret", "geometry"],
+                         [c.id for c in tree.children])
+
+    def test_make_tree_returns_copies(self):
+        key = self.topic("algebra").key()
+        self.snapshot.make_tree(key).children.pop()
+        self.assertEqual(3, len(self.snapshot.make_tree(key).children))
+
+    def test_play_data_matches_datastore(self):
+        for id in ["algebra", "secret", "geometry"]:
+            topic = self.topic(id)
+            self.assertEqual(topic._get_play_data_from_datastore(),
+                             self.snapshot.play_data(topic.key()))
+
+    def test_library_data_matches_datastore(self):
+        for id in ["math", "algebra", "geometry"]:
+            from_datastore = self.topic(id).get_library_data()
+
+            patcher = patch("topic_models.TopicTreeSnapshot.get_for_topic")
+            get_for_topic = patcher.start()
+            try:
+                get_for_topic.return_value = self.snapshot
+                self.assertEqual(from_datastore,
+                                 self.topic(id).get_library_data())
+            finally:
+                patcher.stop()
+
+    def test_snapshot_is_rebuilt_after_content_edits(self):
+        get = topic_models.TopicTreeSnapshot.get
+        snapshot = get(self.version.number)
+        self.assertTrue(snapshot is get(self.version.number))
+
+        # Editing a video in place
+        setting_model.Setting.cached_content_add_date(
+            datetime.datetime.now())
+        edited = get(self.version.number)
+        self.assertFalse(edited is snapshot)
+        self.assertTrue(edited is get(self.version.number))
+
+        # Editing an exercise
+        exercise_models.Exercise.all().get().put()
+        self.assertFalse(edited is get(self.version.number))
@@ -19,11 +19,13 @@ A 'video' is what's on a Khan page like
 import cPickle as pickle
 import datetime
 import logging
+import time
 try:
     import json                  # python 2.6 and later
 except ImportError:
     import simplejson as json    # python 2.5 and earlier
 
+from google.appengine.api import taskqueue
 from google.appengine.api import users
 from google.appengine.ext import db
 from google.appengine.ext import deferred
@@ -412,11 +414,147 @@ def _commit_video_log(video_log, user_data=None):
 
 
 def commit_log_summary_coaches(activity_log, coaches):
-    """Used by our deferred log summary insertion process."""
+    """Used by our deferred log summary insertion process.
+
+    New activities go through queue_log_summary_coaches, this is still here
+    for tasks deferred before that.
+    """
     for coach in coaches:
         summary_log_models.LogSummary.add_or_update_entry(user_models.UserData.get_from_db_key_email(coach), activity_log, classtime.ClassDailyActivitySummary, summary_log_models.LogSummaryTypes.CLASS_DAILY_ACTIVITY, 1440)
 
 
+# Rather than a transaction per activity, which classes answering in
+# lockstep all contend on, activities are put in a pull queue and
+# fold_log_summary_coaches adds everything queued for the same coach and day
+# to a LogSummary shard in one transaction.
+LOG_SUMMARY_PULL_QUEUE = "log-summary-pull-queue"
+
+# Every queued activity makes sure a fold runs at the end of the current
+# FOLD_INTERVAL_SECONDS, so a class's activities get batched together.
+FOLD_INTERVAL_SECONDS = 10
+FOLD_LEASE_SECONDS = 60
+FOLD_BATCH_SIZE = 1000
+
+# Activities that still fail to fold after this many leases are dropped
+FOLD_MAX_RETRIES = 10
+
+# The last interval this instance scheduled a fold for, which saves every
+# other activity in the interval a taskqueue RPC that would only find the
+# fold already scheduled
+_last_scheduled_fold_interval = None
+
+
+def queue_log_summary_coaches(activity_log, coaches):
+    """Queues an activity to be added to its coaches' class summaries."""
+    payload = pickle.dumps((activity_log, coaches), pickle.HIGHEST_PROTOCOL)
+    taskqueue.Queue(LOG_SUMMARY_PULL_QUEUE).add(
+        taskqueue.Task(payload=payload, method="PULL"))
+
+    _schedule_fold_log_summary_coaches(time.time() + FOLD_INTERVAL_SECONDS)
+
+
+def _schedule_fold_log_summary_coaches(eta_seconds):
+    global _last_scheduled_fold_interval
+
+    # Named after its interval, so only one fold is scheduled per interval
+    interval = int(eta_seconds) / FOLD_INTERVAL_SECONDS
+    if interval == _last_scheduled_fold_interval:
+        return
+
+    task_name = "fold_log_summary_coaches_%s" % interval
+    try:
+        deferred.defer(fold_log_summary_coaches,
+                       _queue="log-summary-queue",
+                       _name=task_name,
+                       _eta=datetime.datetime.utcfromtimestamp(
+                           interval * FOLD_INTERVAL_SECONDS),
+                       _url="/_ah/queue/deferred_log_summary")
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+    _last_scheduled_fold_interval = interval
+
+
+def fold_log_summary_coaches():
+    """Adds queued activities to their coaches' class summaries, with one
+    transaction per coach and day.
+    """
+    queue = taskqueue.Queue(LOG_SUMMARY_PULL_QUEUE)
+    tasks = queue.lease_tasks(FOLD_LEASE_SECONDS, FOLD_BATCH_SIZE)
+    if not tasks:
+        return
+
+    # (coach, start of day) -> ([activities], [tasks])
+    batches = {}
+    for task in tasks:
+        if task.retry_count > FOLD_MAX_RETRIES:
+            logging.error("Dropping activity %s after %d failed folds" %
+                          (task.name, task.retry_count))
+            continue
+
+        try:
+            activity_log, coaches = pickle.loads(task.payload)
+        except Exception, e:
+            # e.g. queued by an older version of a model class
+            logging.error("Dropping activity %s that can't be unpickled: %s" %
+                          (task.name, e))
+            continue
+
+        start = summary_log_models.LogSummary.get_start_of_period(
+            activity_log, 1440)
+        for coach in coaches:
+            batch = batches.setdefault((coach, start), ([], []))
+            batch[0].append(activity_log)
+            batch[1].append(task)
+
+    failed_task_names = set()
+    stale_rollup_keys = []
+    for (coach, start), (activities, batch_tasks) in batches.iteritems():
+        try:
+            user_data_coach = user_models.UserData.get_from_db_key_email(coach)
+            summary_log_models.LogSummary.add_or_update_entry(
+                user_data_coach,
+                activities,
+                classtime.ClassDailyActivitySummary,
+                summary_log_models.LogSummaryTypes.CLASS_DAILY_ACTIVITY,
+                1440)
+        except Exception, e:
+            logging.error("Failed to fold %d activities into %s's log "
+                          "summary: %s" % (len(activities), coach, e))
+            for task in batch_tasks:
+                failed_task_names.add(task.name)
+            continue
+
+        # Retried or backed up activities can arrive after their day has
+        # been rolled up, which would otherwise hide them for good
+        rollup_class = summary_log_models.ClassDailyActivityRollup
+        if rollup_class.is_closed(start):
+            stale_rollup_keys.append(
+                rollup_class.get_key(user_data_coach, start))
+
+    if stale_rollup_keys:
+        db.delete(stale_rollup_keys)
+
+    # Failed activities are left leased, to be retried once their lease
+    # runs out, up to FOLD_MAX_RETRIES times. Some of their coaches may have
+    # succeeded and will see them twice, which is the same as when a
+    # deferred commit_log_summary_coaches used to be retried. Dropped
+    # activities are deleted along with the folded ones.
+    done_tasks = [task for task in tasks
+                  if task.name not in failed_task_names]
+    if done_tasks:
+        queue.delete_tasks(done_tasks)
+
+    if failed_task_names:
+        _schedule_fold_log_summary_coaches(time.time() + FOLD_LEASE_SECONDS)
+
+    if len(tasks) == FOLD_BATCH_SIZE:
+        # There's more waiting
+        deferred.defer(fold_log_summary_coaches,
+                       _queue="log-summary-queue",
+                       _url="/_ah/queue/deferred_log_summary")
+
+
 class VideoLog(backup_model.BackupModel):
     user = db.UserProperty()
     video = db.ReferenceProperty(Video)
@@ -530,11 +668,15 @@ class VideoLog(backup_model.BackupModel):
                 if first_topic:
                     action_cache.push_video_log(video_log)
 
+                # Points from this video are only added below, so points
+                # badges are checked for the ones from before
                 badges.util_badges.update_with_user_topic(
                         user_data,
                         user_topic,
                         include_other_badges=first_topic,
-                        action_cache=action_cache)
+                        action_cache=action_cache,
+                        signals=[badges.badges.BadgeSignal.VIDEO,
+                                 badges.badges.BadgeSignal.POINTS])
 
                 first_topic = False
 
@@ -580,10 +722,7 @@ class VideoLog(backup_model.BackupModel):
 
 
         if user_data is not None and user_data.coaches:
-            # Making a separate queue for the log summaries so we can clearly see how much they are getting used
-            deferred.defer(commit_log_summary_coaches, video_log, user_data.coaches,
-                _queue="log-summary-queue",
-                _url="/_ah/queue/deferred_log_summary")
+            queue_log_summary_coaches(video_log, user_data.coaches)
 
         return (user_video, video_log, video_points_total, goals_updated)
 
@@ -1,8 +1,20 @@
+import datetime
+import logging
+import os
 try:
     import unittest2 as unittest
 except ImportError:
     import unittest
 
+from google.appengine.api import taskqueue
+from google.appengine.api import users
+from google.appengine.ext import db
+from google.appengine.ext import testbed
+
+import exercise_models
+import summary_log_models
+import testutil
+import user_models
 import video_models
 from mock import patch
 
@@ -24,3 +36,131 @@ class VideoSubtitlesTest(unittest.TestCase):
         json = subs.load_json()
         self.assertIsNone(json)
         self.assertEqual(warn.call_count, 1, 'logging.warn() not called')
+
+
+class LogSummaryQueueTest(testutil.GAEModelTestCase):
+    def setUp(self):
+        super(LogSummaryQueueTest, self).setUp()
+        self.testbed.init_taskqueue_stub(
+            root_path=os.path.dirname(os.path.abspath(__file__)))
+        self.taskqueue_stub = self.testbed.get_stub(
+            testbed.TASKQUEUE_SERVICE_NAME)
+
+        self.coach = user_models.UserData.insert_for("coach",
+                                                     "coach@example.com")
+        video_models._last_scheduled_fold_interval = None
+
+    def queue_problem_log(self, time_done):
+        problem_log = exercise_models.ProblemLog(
+            user=users.User("student@example.com"), exercise="addition_1",
+            time_done=time_done, time_taken=30)
+        video_models.queue_log_summary_coaches(problem_log,
+                                               [self.coach.key_email])
+
+    def pull_tasks(self):
+        return taskqueue.Queue(
+            video_models.LOG_SUMMARY_PULL_QUEUE).lease_tasks(60, 1000)
+
+    @patch("summary_log_models.db.run_in_transaction")
+    def test_class_activities_are_folded_together(self, run_in_transaction):
+        run_in_transaction.side_effect = db.run_in_transaction
+
+        # A class of 40 answering problems together
+        num_students = 40
+        num_problems = 5
+        start = datetime.datetime(2012, 3, 1, 9)
+        for i in range(num_problems):
+            for j in range(num_students):
+                problem_log = exercise_models.ProblemLog(
+                    user=users.User("student%d@example.com" % j),
+                    exercise="addition_1",
+                    time_done=start + datetime.timedelta(minutes=i),
+                    time_taken=30)
+                video_models.queue_log_summary_coaches(
+                    problem_log, [self.coach.key_email])
+
+        # All of them were picked up by one scheduled fold
+        self.assertEqual(1, len(self.taskqueue_stub.GetTasks(
+            "log-summary-queue")))
+        video_models.fold_log_summary_coaches()
+
+        num_activities = num_students * num_problems
+        transactions_per_activity = (
+            float(run_in_transaction.call_count) / num_activities)
+        logging.info("%d activities took %d transactions, %.3f per activity" %
+                     (num_activities, run_in_transaction.call_count,
+                      transactions_per_activity))
+        self.assertTrue(transactions_per_activity < 0.1)
+
+        [log_summary] = summary_log_models.LogSummary.all().fetch(10)
+        self.assertEqual(num_students,
+                         len(log_summary.summary.student_dict))
+
+        # And nothing is left to fold
+        self.assertEqual([], taskqueue.Queue(
+            video_models.LOG_SUMMARY_PULL_QUEUE).lease_tasks(60, 1000))
+
+    @patch("time.time")
+    @patch("video_models.deferred.defer")
+    def test_fold_is_scheduled_once_per_interval(self, defer, mock_time):
+        mock_time.return_value = 1330592400.0
+        for i in range(10):
+            self.queue_problem_log(datetime.datetime(2012, 3, 1, 9))
+        self.assertEqual(1, defer.call_count)
+
+        mock_time.return_value += video_models.FOLD_INTERVAL_SECONDS
+        self.queue_problem_log(datetime.datetime(2012, 3, 1, 9))
+        self.assertEqual(2, defer.call_count)
+
+    def test_undecodable_activities_are_dropped(self):
+        taskqueue.Queue(video_models.LOG_SUMMARY_PULL_QUEUE).add(
+            taskqueue.Task(payload="not a pickle", method="PULL"))
+        self.queue_problem_log(datetime.datetime(2012, 3, 1, 9))
+
+        video_models.fold_log_summary_coaches()
+
+        [log_summary] = summary_log_models.LogSummary.all().fetch(10)
+        self.assertEqual(1, len(log_summary.summary.student_dict))
+        self.assertEqual([], self.pull_tasks())
+
+    @patch("summary_log_models.LogSummary.add_or_update_entry")
+    def test_failed_activities_are_left_to_retry(self, add_or_update_entry):
+        add_or_update_entry.side_effect = Exception("contention")
+        self.queue_problem_log(datetime.datetime(2012, 3, 1, 9))
+
+        video_models.fold_log_summary_coaches()
+
+        # Still queued, but leased until it's time to retry
+        self.assertEqual(1, len(self.taskqueue_stub.GetTasks(
+            video_models.LOG_SUMMARY_PULL_QUEUE)))
+        self.assertEqual([], self.pull_tasks())
+
+    @patch("video_models.FOLD_MAX_RETRIES", -1)
+    @patch("summary_log_models.LogSummary.add_or_update_entry")
+    def test_activities_are_dropped_after_too_many_retries(
+            self, add_or_update_entry):
+        self.queue_problem_log(datetime.datetime(2012, 3, 1, 9))
+
+        video_models.fold_log_summary_coaches()
+
+        self.assertEqual(0, add_or_update_entry.call_count)
+        self.assertEqual([], self.taskqueue_stub.GetTasks(
+            video_models.LOG_SUMMARY_PULL_QUEUE))
+
+    def test_late_activities_replace_their_days_rollup(self):
+        day = datetime.datetime(2012, 3, 1)
+        rollup_class = summary_log_models.ClassDailyActivityRollup
+        rollup_class(key_name=rollup_class.get_key_name(self.coach, day)).put()
+        today = datetime.datetime.utcnow().replace(hour=0, minute=0)
+        rollup_class(key_name=rollup_class.get_key_name(self.coach,
+                                                        today)).put()
+
+        self.queue_problem_log(day + datetime.timedelta(hours=9))
+        self.queue_problem_log(today + datetime.timedelta(minutes=1))
+        video_models.fold_log_summary_coaches()
+
+        # The closed day's rollup is rebuilt from its shards when next read
+        self.assertEqual(None, rollup_class.get(
+            rollup_class.get_key(self.coach, day)))
+        self.assertNotEqual(None, rollup_class.get(
+            rollup_class.get_key(self.coach, today)))